@@ -0,0 +1,272 @@
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import resource
+import subprocess
+import contextlib
+import numpy as np
+
+from benchmarks.synthetic import synthetic_artists
+from data_processing import process
+from data_processing import measures
+from data_processing import store
+from data_processing import streaming
+from data_processing.csr import CSRGraph
+
+########## Benchmarks of the construction -> backbone -> analysis pipeline on synthetic artist tables
+#python -m benchmarks.run --sizes 1000 3000 10000 [--compare benchmarks/results/<commit>.json]
+#"graph" is the networkx graph and every stage run on it (skip it to run only the array / CSRGraph stages at large sizes)
+OPTIONAL_STAGES = ["loc_similarity", "graph", "threshold_filter", "disparity_filter", "index_matrix_values", "rich_core",
+                   "describe_graph", "streaming"]
+
+def _reset_peak_rss():
+    #Linux: writing 5 to clear_refs resets VmHWM, so each stage gets its own peak
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 #kB on Linux, lifetime peak
+
+def _children_peak_rss_mb():
+    #Largest peak RSS of the worker processes that have exited (the kernel keeps no per-stage value)
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+def _timed(function, repeat=1):
+    #Best of repeat runs: (result, seconds, peaks) with peaks the RSS peak in MB of this process during the runs
+    #and of the largest worker process, if one that exited during the runs set a new high
+    _reset_peak_rss()
+    children_before = _children_peak_rss_mb()
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    children = _children_peak_rss_mb()
+    return result, best, (_peak_rss_mb(), children if children > children_before else None)
+
+def _record(stage, n, seconds, peak, items, unit, **extra):
+    #peak_rss_mb: the parent process only; peak_rss_workers_mb: the largest worker process (None: no new high,
+    #at most the previous stages' value, or no workers)
+    return {"stage": stage, "n": n, "seconds": seconds, "items": items, "unit": unit,
+            "throughput": items / seconds if seconds > 0 else None, "peak_rss_mb": peak[0],
+            "peak_rss_workers_mb": peak[1], **extra}
+
+def _same_edges(edges, other):
+    #Same (row, col, weight) edges, in any order (the edge file is in shard order, build_edges sorted)
+    first, second = np.lexsort(edges[1::-1]), np.lexsort(other[1::-1])
+    return all(np.array_equal(a[first], b[second]) for a, b in zip(edges, other))
+
+def _check_streaming(path, rows, cols, weights, n_nodes, thresholds, alphas):
+    #The edge file filters must keep exactly the edges the in-memory filters keep
+    for threshold in thresholds:
+        kept = weights >= threshold
+        if not _same_edges(streaming.threshold_edges(path, threshold), (rows[kept], cols[kept], weights[kept])):
+            raise AssertionError(f"streaming.threshold_edges differs from threshold_filter at threshold {threshold}")
+    probas, _, _ = measures.disparity_filter_arrays(rows, cols, weights, n_nodes)
+    for alpha in alphas:
+        kept = measures.disparity_backbone(probas, alpha)
+        if not _same_edges(streaming.disparity_edges(path, alpha), (rows[kept], cols[kept], weights[kept])):
+            raise AssertionError(f"streaming.disparity_edges differs from the in-memory backbone at alpha {alpha}")
+
+def run_size(n, repeat=1, n_workers=None, seed=1, skip=(), loc_similarity_pairs=20000, n_sources=200):
+    """Run every stage on a synthetic table of n artists; returns the list of stage records"""
+    artists = synthetic_artists(n, seed)
+    records = []
+
+    artist_store, seconds, peak = _timed(lambda: store.build_artist_store(artists), repeat)
+    records.append(_record("store", n, seconds, peak, n, "rows"))
+
+    raw_years = store.year_matrix(artist_store)
+    has_places = np.diff(artist_store["locations_list_indptr"]) > 0
+    def fix():
+        years, valid = process.fix_years_table(raw_years)
+        valid = np.flatnonzero(valid & has_places)
+        return valid, years[valid]
+    (valid, years), seconds, peak = _timed(fix, repeat)
+    records.append(_record("fix_years", n, seconds, peak, n, "rows", valid=len(valid)))
+
+    encoded, seconds, peak = _timed(lambda: store.to_encoded(artist_store, valid, years), repeat)
+    records.append(_record("encode", n, seconds, peak, len(valid), "artists"))
+
+    n_pairs, seconds, peak = _timed(lambda: sum(len(rows) for rows, _ in process.overlapping_pairs(years, encoded=encoded)), repeat)
+    records.append(_record("pairs", n, seconds, peak, n_pairs, "pairs"))
+
+    if "loc_similarity" not in skip:
+        #The scalar get_loc_similarity on a sample of the candidate pairs, as the notebook loop calls it
+        rows, cols = next(process.overlapping_pairs(years, chunk_size=loc_similarity_pairs, encoded=encoded), ([], []))
+        def lists(field, i):
+            indptr = encoded[f"{field}_indptr"]
+            items = encoded[f"{field}_vocab"][encoded[f"{field}_codes"][indptr[i]:indptr[i + 1]]].tolist()
+            return items if items or field == "places" else np.nan
+        def value(field, i):
+            code = encoded[field][i]
+            return encoded[f"{field}_vocab"][code] if code >= 0 else np.nan
+        arguments = [dict(places=lists("places", i), years=list(years[i]), birthplace=value("birthplace", i),
+                          nationality=lists("nationalities", i), citizenship=value("citizenship", i)) for i in range(len(valid))]
+        def scalar():
+            return [process.get_loc_similarity(
+                a["places"], b["places"], a["years"], b["years"], a["birthplace"], b["birthplace"], a["nationality"],
+                b["nationality"], a["citizenship"], b["citizenship"], active_years_only=True)
+                for a, b in ((arguments[i], arguments[j]) for i, j in zip(rows.tolist(), cols.tolist()))]
+        _, seconds, peak = _timed(scalar, repeat)
+        records.append(_record("loc_similarity", n, seconds, peak, len(rows), "pairs"))
+
+    (rows, cols, weights), seconds, peak = _timed(
+        lambda: process.build_edges(encoded, active_years_only=True, n_workers=n_workers), repeat)
+    records.append(_record("build_edges", n, seconds, peak, n_pairs, "pairs", edges=len(rows),
+                           edges_per_second=len(rows) / seconds if seconds > 0 else None))
+
+    if "streaming" not in skip:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "edges")
+            _, seconds, peak = _timed(lambda: streaming.build_edge_file(encoded, path, active_years_only=True,
+                                                                        n_workers=n_workers), repeat)
+            records.append(_record("build_edge_file", n, seconds, peak, n_pairs, "pairs", edges=len(rows)))
+            thresholds = np.quantile(weights, [0.5, 0.9]).tolist() + [1.0] if len(weights) else []
+            _check_streaming(path, rows, cols, weights, len(valid), thresholds, [0.05, 0.1, 0.3])
+
+    names = artist_store["artist"][valid].tolist()
+    networkx = "graph" not in skip
+    if networkx:
+        G, seconds, peak = _timed(lambda: process.edges_to_graph(names, rows, cols, weights), repeat)
+        records.append(_record("graph", n, seconds, peak, len(rows), "edges"))
+    C, seconds, peak = _timed(lambda: CSRGraph.from_edges(len(names), rows, cols, weights, names), repeat)
+    records.append(_record("csr_graph", n, seconds, peak, len(rows), "edges"))
+
+    if "threshold_filter" not in skip and len(weights):
+        threshold = float(np.median(weights))
+        if networkx:
+            copies = [G.copy() for _ in range(repeat)]
+            _, seconds, peak = _timed(lambda: measures.threshold_filter(copies.pop(), threshold), repeat)
+            records.append(_record("threshold_filter", n, seconds, peak, len(rows), "edges"))
+        _, seconds, peak = _timed(lambda: measures.threshold_filter(C, threshold), repeat)
+        records.append(_record("threshold_filter_csr", n, seconds, peak, len(rows), "edges"))
+
+    if "disparity_filter" not in skip:
+        if networkx:
+            _, seconds, peak = _timed(lambda: measures.compute_disparity_filter_probas(G), repeat)
+            records.append(_record("disparity_filter", n, seconds, peak, len(rows), "edges"))
+        _, seconds, peak = _timed(lambda: measures.disparity_filter_arrays(rows, cols, weights, len(names)), repeat)
+        records.append(_record("disparity_filter_arrays", n, seconds, peak, len(rows), "edges"))
+
+    if "index_matrix_values" not in skip:
+        rng = np.random.default_rng(seed)
+        k = max(int(np.sqrt(len(names))), 1)
+        partitions = [[list(np.asarray(names)[labels == c]) for c in range(k)]
+                      for labels in (rng.integers(k, size=len(names)), rng.integers(k, size=len(names)))]
+        _, seconds, peak = _timed(lambda: measures.index_matrix_values(*partitions), repeat)
+        records.append(_record("index_matrix_values", n, seconds, peak, len(names), "nodes"))
+
+    if "rich_core" not in skip and len(rows):
+        if networkx:
+            _, seconds, peak = _timed(lambda: measures.extract_rich_core(G), repeat)
+            records.append(_record("rich_core", n, seconds, peak, len(rows), "edges"))
+        _, seconds, peak = _timed(lambda: measures.extract_rich_core(C), repeat)
+        records.append(_record("rich_core_csr", n, seconds, peak, len(rows), "edges"))
+
+    if "describe_graph" not in skip and len(rows):
+        #Single worker: pool startup would swamp the sampled work at these sizes and skew the scaling exponent
+        def describe():
+            with contextlib.redirect_stdout(io.StringIO()):
+                measures.describe_graph(C, n_sources=min(n_sources, len(names)), n_workers=1)
+        _, seconds, peak = _timed(describe, repeat)
+        records.append(_record("describe_graph", n, seconds, peak, len(rows), "edges"))
+    return records
+
+def scaling_exponents(records):
+    """Slope of log(seconds) against log(n) per stage (time ~ n^exponent), for stages timed at 2+ sizes"""
+    exponents = {}
+    for stage in dict.fromkeys(record["stage"] for record in records):
+        points = np.array([(record["n"], record["seconds"]) for record in records
+                           if record["stage"] == stage and record["seconds"] > 0], dtype=np.float64)
+        if len(np.unique(points[:, 0])) >= 2:
+            exponents[stage] = float(np.polyfit(np.log(points[:, 0]), np.log(points[:, 1]), 1)[0])
+    return exponents
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment():
+    import scipy, networkx, pandas
+    return {"commit": _git("rev-parse", "HEAD"), "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "numpy": np.__version__, "scipy": scipy.__version__, "networkx": networkx.__version__,
+            "pandas": pandas.__version__, "machine": platform.machine(), "cpus": os.cpu_count()}
+
+def compare(baseline, results, tolerance=0.2):
+    """Print the time ratio (results / baseline) of every stage and size in both; returns the regressions (ratio > 1 + tolerance)"""
+    old = {(record["stage"], record["n"]): record["seconds"] for record in baseline["records"]}
+    regressions = []
+    print(f"{'stage':<26}{'n':>10}{'baseline s':>13}{'current s':>13}{'ratio':>9}")
+    for record in results["records"]:
+        key = (record["stage"], record["n"])
+        if key not in old:
+            continue
+        ratio = record["seconds"] / old[key] if old[key] > 0 else np.inf
+        flag = "  slower" if ratio > 1 + tolerance else ("  faster" if ratio < 1 / (1 + tolerance) else "")
+        print(f"{key[0]:<26}{key[1]:>10}{old[key]:>13.4f}{record['seconds']:>13.4f}{ratio:>9.2f}{flag}")
+        if flag == "  slower":
+            regressions.append({"stage": key[0], "n": key[1], "ratio": ratio})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the painter network pipeline on synthetic artist tables")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 3000, 10000], help="numbers of artists")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per stage (the best is kept)")
+    parser.add_argument("--workers", type=int, default=None, help="processes for the parallel stages (all cores by default)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--skip", nargs="*", default=[], choices=OPTIONAL_STAGES, help="optional stages to skip")
+    parser.add_argument("--output", default=None, help="results JSON (benchmarks/results/<commit>.json by default)")
+    parser.add_argument("--results", default=None, help="compare this results JSON instead of running the benchmarks")
+    parser.add_argument("--compare", default=None, help="baseline results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    if args.results:
+        with open(args.results) as file:
+            results = json.load(file)
+    else:
+        run_size(200, 1, args.workers, args.seed, args.skip) #warm-up: imports, first calls
+        records = []
+        for n in args.sizes:
+            print(f"{n} artists...", file=sys.stderr)
+            records.extend(run_size(n, args.repeat, args.workers, args.seed, args.skip))
+        results = {**environment(), "sizes": args.sizes, "repeat": args.repeat, "workers": args.workers,
+                   "records": records, "scaling": scaling_exponents(records)}
+        output = args.output or os.path.join("benchmarks", "results", f"{(results['commit'] or 'unknown')[:10]}.json")
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with open(output, "w") as file:
+            json.dump(results, file, indent=1)
+        for record in records:
+            throughput = f"{record['throughput']:.3g} {record['unit']}/s" if record["throughput"] else ""
+            workers = f"{record['peak_rss_workers_mb']:>10.1f} MB" if record["peak_rss_workers_mb"] else f"{'-':>13}"
+            print(f"{record['stage']:<26}{record['n']:>10}{record['seconds']:>11.4f} s{record['peak_rss_mb']:>10.1f} MB{workers}  {throughput}")
+        print("Scaling exponents:", {stage: round(value, 2) for stage, value in results["scaling"].items()})
+        print("Saved", output)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        return 1 if compare(baseline, results, args.tolerance) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
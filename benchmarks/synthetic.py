@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+########## Synthetic PainterPalette-shaped artist tables (for benchmarks)
+#Shapes taken from data/artists.csv: missing rates, list lengths (zipf-like), Zipf-popular places and nationalities
+
+def _zipf_codes(rng, n_values, size, exponent=1.1):
+    #Codes 0..n_values-1 drawn with Zipf popularity (code 0 the most popular)
+    p = 1 / np.arange(1, n_values + 1) ** exponent
+    return rng.choice(n_values, size=size, p=p / p.sum())
+
+def _lists(rng, n, prefix, n_values, length_exponent, max_length, missing):
+    #Comma-joined lists of heavy-tailed length, nan for missing
+    lengths = np.minimum(rng.zipf(length_exponent, size=n), max_length)
+    lengths[rng.random(n) < missing] = 0
+    codes = _zipf_codes(rng, n_values, lengths.sum())
+    bounds = np.concatenate(([0], np.cumsum(lengths)))
+    items = np.char.add(prefix, codes.astype(str)).tolist()
+    return [",".join(items[start:stop]) if stop > start else np.nan for start, stop in zip(bounds[:-1], bounds[1:])]
+
+def _labels(rng, n, prefix, n_values, missing):
+    labels = np.char.add(prefix, _zipf_codes(rng, n_values, n).astype(str)).astype(object)
+    labels[rng.random(n) < missing] = np.nan
+    return labels
+
+def synthetic_artists(n, seed=1):
+    """
+    DataFrame of n synthetic artists with the columns of data/artists.csv used by the pipeline:
+    lifespans and active years (births concentrated in the 19th-20th centuries), heavy-tailed location,
+    nationality and style lists over Zipf-popular vocabularies (growing with n), and similar missing rates.
+    """
+    rng = np.random.default_rng(seed)
+    era = rng.choice(3, size=n, p=[0.1, 0.3, 0.6])
+    birth = np.clip(rng.normal(np.array([1550, 1780, 1900])[era], np.array([60, 80, 45])[era]), 1200, 2000).round()
+    death = birth + np.clip(rng.normal(68, 15, n), 20, 105).round()
+    first = birth + np.clip(rng.normal(28, 8, n), 12, 60).round()
+    last = np.maximum(death - np.clip(rng.exponential(12, n), 0, 50).round(), first)
+    alive = death > 2024
+    death[alive] = np.nan; last[alive] = np.minimum(last[alive], 2024)
+    birth[rng.random(n) < 0.087] = np.nan
+    death[rng.random(n) < 0.1] = np.nan
+    active_missing = rng.random(n) < 0.3
+    first[active_missing] = np.nan; last[active_missing] = np.nan
+
+    year = np.nan_to_num(birth, nan=1900)
+    female = rng.random(n) < 0.02 + 0.2 / (1 + np.exp(-(year - 1900) / 30))
+    gender = np.where(female, "female", "male").astype(object)
+    gender[rng.random(n) < 0.037] = np.nan
+    pictures = np.maximum(rng.lognormal(3.3, 1.1, n).round(), 1)
+    on_wikiart = rng.random(n) < 0.31
+    pictures[~on_wikiart] = np.nan
+    n_places = max(50, int(20 * np.sqrt(n)))
+    styles = np.array(_lists(rng, n, "Style ", 1400, 2.3, 37, 0), dtype=object)
+    styles[~on_wikiart] = np.nan
+    movement = _labels(rng, n, "Movement ", 123, 0)
+    movement[~on_wikiart] = np.nan
+    return pd.DataFrame({
+        "artist": np.char.add("Artist ", np.arange(n).astype(str)),
+        "Nationality": _lists(rng, n, "Nation ", 290, 3.0, 4, 0.766),
+        "citizenship": _labels(rng, n, "Country ", 320, 0.138),
+        "gender": gender,
+        "styles": styles,
+        "movement": movement,
+        "birth_place": _labels(rng, n, "Town ", max(50, int(37 * np.sqrt(n))), 0.165),
+        "death_place": _labels(rng, n, "Town ", max(50, int(37 * np.sqrt(n))), 0.3),
+        "birth_year": birth, "death_year": death, "FirstYear": first, "LastYear": last,
+        "wikiart_pictures_count": pictures,
+        "locations": _lists(rng, n, "Place ", n_places, 1.9, 33, 0.618),
+    })
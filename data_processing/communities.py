@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import networkx as nx
+from concurrent.futures import ProcessPoolExecutor
+
+from data_processing import parallel
+from data_processing.csr import CSRGraph
+
+########## Community detection ensembles (several seeds of Louvain / Infomap, consensus partition)
+INFOMAP_OPTIONS = {"two_level": True, "num_trials": 10, "flow_model": "undirected", "recorded_teleportation": False,
+                   "core_level_limit": 2, "teleportation_probability": 0.15} #as in infomap_louvain_jaccard.ipynb
+
+def graph_hash(G):
+    """Hash of a graph's structure, weights and node names (e.g. to key cached results)"""
+    G = G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+    digest = hashlib.sha1()
+    for array in (G.indptr, G.indices, G.weights):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    digest.update("\n".join(map(str, G.names)).encode())
+    return digest.hexdigest()[:16]
+
+def modularity(G, labels, resolution=1):
+    """Weighted modularity of a partition given as community labels in node order (as nx modularity)"""
+    G = G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+    rows, cols, weights = G.edges()
+    labels = np.unique(np.asarray(labels), return_inverse=True)[1]
+    m = weights.sum()
+    if m == 0:
+        return np.nan
+    inside = labels[rows] == labels[cols]
+    internal = np.bincount(labels[rows[inside]], weights=weights[inside], minlength=labels.max() + 1)
+    degrees = np.bincount(labels, weights=G.strengths(), minlength=labels.max() + 1)
+    return float(np.sum(internal / m - resolution * (degrees / (2 * m)) ** 2))
+
+def to_communities(labels, names):
+    """Labels in node order -> nested list of node names (the partition format of measures.compare_partitions)"""
+    communities = {}
+    for name, label in zip(names, np.asarray(labels).tolist()):
+        communities.setdefault(label, []).append(name)
+    return list(communities.values())
+
+def _louvain(n_nodes, rows, cols, weights, seed, resolution=1):
+    H = nx.Graph()
+    H.add_nodes_from(range(n_nodes))
+    H.add_weighted_edges_from(zip(rows.tolist(), cols.tolist(), weights.tolist()))
+    labels = np.zeros(n_nodes, dtype=np.int64)
+    for i, community in enumerate(nx.community.louvain_communities(H, weight="weight", resolution=resolution, seed=seed)):
+        labels[list(community)] = i
+    return labels, np.nan
+
+def _infomap(n_nodes, rows, cols, weights, seed, options):
+    from infomap import Infomap
+    im = Infomap(**options, seed=seed, silent=True)
+    for node in range(n_nodes):
+        im.add_node(node)
+    for u, v, w in zip(rows.tolist(), cols.tolist(), weights.tolist()):
+        im.add_link(u, v, w)
+    im.run()
+    modules = im.get_modules()
+    return np.array([modules[node] for node in range(n_nodes)], dtype=np.int64), im.codelength
+
+_WORKER = {}
+
+def _init_worker(spec, n_nodes):
+    arrays, blocks = parallel.attach_arrays(spec)
+    _WORKER.update(arrays=arrays, blocks=blocks, n_nodes=n_nodes)
+
+def _run(task):
+    algorithm, seed, options = task
+    arrays, n_nodes = _WORKER["arrays"], _WORKER["n_nodes"]
+    rows, cols, weights = arrays["rows"], arrays["cols"], arrays["weights"]
+    start = time.perf_counter()
+    if algorithm == "louvain":
+        labels, codelength = _louvain(n_nodes, rows, cols, weights, seed, **options)
+    elif algorithm == "infomap":
+        labels, codelength = _infomap(n_nodes, rows, cols, weights, seed, options)
+    else:
+        raise ValueError(f"Unknown algorithm: {algorithm}")
+    runtime = time.perf_counter() - start
+    graph = CSRGraph.from_edges(n_nodes, rows, cols, weights)
+    return {"algorithm": algorithm, "seed": seed, "options": options, "labels": labels.tolist(),
+            "n_communities": len(np.unique(labels)), "modularity": modularity(graph, labels, options.get("resolution", 1)),
+            "codelength": codelength, "runtime": runtime}
+
+def _cache_path(cache_dir, key, algorithm, seed, options):
+    parameters = json.dumps({"graph": key, "algorithm": algorithm, "seed": seed, "options": options}, sort_keys=True)
+    return os.path.join(cache_dir, hashlib.sha1(parameters.encode()).hexdigest()[:16] + ".json")
+
+def run_ensemble(G, seeds=range(1, 11), algorithms=("louvain",), resolution=1, infomap_options=None,
+                 n_workers=None, cache_dir="data/cache/communities"):
+    """
+    Run community detection for each seed and algorithm ("louvain": nx louvain_communities, "infomap": Infomap,
+    with INFOMAP_OPTIONS updated by infomap_options; the optional infomap package, Python <= 3.10, see README),
+    the runs spread over n_workers processes sharing the graph; e.g. algorithms=("louvain", "infomap").
+    Each run is cached as JSON in cache_dir (None: no caching), keyed by graph_hash and the parameters,
+    so only missing runs are computed.
+    Returns a list of runs (dicts: algorithm, seed, labels in node order, n_communities, modularity,
+    codelength (nan for Louvain), runtime in seconds), in the order of algorithms and seeds.
+    """
+    G = G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+    rows, cols, weights = G.edges()
+    key = graph_hash(G)
+    options = {"louvain": {"resolution": resolution}, "infomap": {**INFOMAP_OPTIONS, **(infomap_options or {})}}
+    tasks = [(algorithm, int(seed), options[algorithm]) for algorithm in algorithms for seed in seeds]
+    runs = [None] * len(tasks)
+    for i, task in enumerate(tasks):
+        if cache_dir is not None and os.path.exists(_cache_path(cache_dir, key, *task)):
+            with open(_cache_path(cache_dir, key, *task)) as file:
+                runs[i] = json.load(file)
+    missing = [i for i, run in enumerate(runs) if run is None]
+    arrays = {"rows": rows, "cols": cols, "weights": weights.astype(np.float64)}
+    n_workers = min(parallel.worker_count(n_workers), max(len(missing), 1))
+    if n_workers == 1:
+        _WORKER.update(arrays=arrays, n_nodes=G.number_of_nodes())
+        try:
+            results = [_run(tasks[i]) for i in missing]
+        finally:
+            _WORKER.clear()
+    else:
+        blocks, spec = parallel.share_arrays(arrays)
+        try:
+            with ProcessPoolExecutor(n_workers, initializer=_init_worker, initargs=(spec, G.number_of_nodes())) as executor:
+                results = list(executor.map(_run, [tasks[i] for i in missing]))
+        finally:
+            parallel.release(blocks)
+    for i, run in zip(missing, results):
+        runs[i] = run
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(_cache_path(cache_dir, key, *tasks[i]), "w") as file:
+                json.dump({**run, "codelength": None if np.isnan(run["codelength"]) else run["codelength"]}, file)
+    for run in runs:
+        run["labels"] = np.asarray(run["labels"], dtype=np.int64)
+        run["codelength"] = np.nan if run["codelength"] is None else run["codelength"]
+    return runs
+
+def best_run(runs, algorithm=None):
+    """Highest-modularity run (of an algorithm)"""
+    return max((run for run in runs if algorithm in (None, run["algorithm"])), key=lambda run: run["modularity"])
+
+def coassignment(G, runs):
+    """Fraction of the runs putting the two ends of each edge of G (G.edges() order) in the same community"""
+    G = G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+    rows, cols, _ = G.edges()
+    agreement = np.zeros(len(rows))
+    for run in runs:
+        labels = np.asarray(run["labels"] if isinstance(run, dict) else run)
+        agreement += labels[rows] == labels[cols]
+    return agreement / max(len(runs), 1)
+
+def consensus_partition(G, runs, tau=0.5, seed=1, resolution=1):
+    """
+    Consensus of several partitions (runs of run_ensemble, or label arrays): the edges of G weighted by
+    co-assignment fraction, dropping those below tau, partitioned once more by Louvain.
+    Only pairs of linked nodes are counted, so memory stays O(edges) instead of O(N^2).
+    Returns (labels in node order, co-assignment fraction of each edge of G.edges()).
+    """
+    G = G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+    rows, cols, _ = G.edges()
+    agreement = coassignment(G, runs)
+    kept = agreement >= tau
+    labels, _ = _louvain(G.number_of_nodes(), rows[kept], cols[kept], agreement[kept], seed, resolution)
+    return labels, agreement
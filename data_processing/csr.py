@@ -0,0 +1,137 @@
+import numpy as np
+import networkx as nx
+
+########## Compact graph (CSR arrays with integer node ids)
+class CSRGraph:
+    """
+    Undirected weighted graph stored as CSR arrays: the neighbours of node i are indices[indptr[i]:indptr[i+1]],
+    with edge weights in the same positions of weights. Every edge is stored in both directions
+    (self-loops once). Nodes are integer ids 0 ... n-1, with names[i] the original node name.
+    Node, edge and graph attributes are kept so that conversion to and from networkx is lossless.
+    """
+    def __init__(self, indptr, indices, weights, names=None, node_attributes=None,
+                 edge_attributes=None, graph_attributes=None):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.weights = np.asarray(weights)
+        n_nodes = len(self.indptr) - 1
+        self.names = list(range(n_nodes)) if names is None else list(names)
+        self.node_attributes = node_attributes #list of dicts, or None
+        self.edge_attributes = edge_attributes #dict (row, col) -> dict of attributes other than the weight, or None
+        self.graph_attributes = {} if graph_attributes is None else graph_attributes
+        self._ids = None
+
+    @classmethod
+    def from_edges(cls, n_nodes, rows, cols, weights=None, names=None, dtype=np.float64, **attributes):
+        """Graph of an edge list; each undirected edge given once (missing weights: np.nan, written back as no weight)"""
+        rows = np.asarray(rows, dtype=np.int64); cols = np.asarray(cols, dtype=np.int64)
+        weights = np.ones(len(rows), dtype=dtype) if weights is None else np.asarray(weights, dtype=dtype)
+        loops = rows == cols
+        sources = np.concatenate((rows, cols[~loops]))
+        targets = np.concatenate((cols, rows[~loops]))
+        both_weights = np.concatenate((weights, weights[~loops]))
+        order = np.lexsort((targets, sources))
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(sources, minlength=n_nodes))
+        return cls(indptr, targets[order], both_weights[order], names, **attributes)
+
+    @classmethod
+    def from_networkx(cls, G, weight='weight', dtype=np.float64):
+        names = list(G.nodes())
+        ids = {node: i for i, node in enumerate(names)}
+        rows = []; cols = []; weights = []; edge_attributes = {}
+        for u, v, data in G.edges(data=True):
+            i, j = ids[u], ids[v]
+            rows.append(i); cols.append(j); weights.append(data.get(weight, np.nan))
+            extra = {key: value for key, value in data.items() if key != weight}
+            if extra:
+                edge_attributes[(min(i, j), max(i, j))] = extra
+        return cls.from_edges(len(names), rows, cols, weights, names, dtype,
+                              node_attributes=[dict(data) for _, data in G.nodes(data=True)],
+                              edge_attributes=edge_attributes or None, graph_attributes=dict(G.graph))
+
+    def to_networkx(self, weight='weight'):
+        G = nx.Graph(**self.graph_attributes)
+        if self.node_attributes is None:
+            G.add_nodes_from(self.names)
+        else:
+            G.add_nodes_from(zip(self.names, self.node_attributes))
+        rows, cols, weights = self.edges()
+        for i, j, w in zip(rows.tolist(), cols.tolist(), weights.tolist()):
+            data = {} if np.isnan(w) else {weight: w}
+            if self.edge_attributes is not None:
+                data.update(self.edge_attributes.get((i, j), {}))
+            G.add_edge(self.names[i], self.names[j], **data)
+        return G
+
+    def number_of_nodes(self):
+        return len(self.indptr) - 1
+
+    def number_of_edges(self):
+        rows = np.repeat(np.arange(self.number_of_nodes()), np.diff(self.indptr))
+        return int(np.count_nonzero(rows <= self.indices))
+
+    def __len__(self):
+        return self.number_of_nodes()
+
+    def index(self, node):
+        """Integer id of a node name"""
+        if self._ids is None:
+            self._ids = {name: i for i, name in enumerate(self.names)}
+        return self._ids[node]
+
+    def neighbors(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def degrees(self):
+        """Degree of every node (self-loops counted twice, as in networkx)"""
+        rows = np.repeat(np.arange(self.number_of_nodes()), np.diff(self.indptr))
+        return np.diff(self.indptr) + np.bincount(rows[rows == self.indices], minlength=self.number_of_nodes())
+
+    def strengths(self):
+        """Weighted degree of every node"""
+        rows = np.repeat(np.arange(self.number_of_nodes()), np.diff(self.indptr))
+        loops = rows == self.indices
+        weights = np.nan_to_num(self.weights.astype(np.float64), nan=1.0)
+        return (np.bincount(rows, weights, minlength=self.number_of_nodes())
+                + np.bincount(rows[loops], weights[loops], minlength=self.number_of_nodes()))
+
+    def edges(self):
+        """(rows, cols, weights) of every edge once, rows <= cols"""
+        rows = np.repeat(np.arange(self.number_of_nodes()), np.diff(self.indptr))
+        upper = rows <= self.indices
+        return rows[upper], self.indices[upper].astype(np.int64), self.weights[upper]
+
+    def adjacency(self, weighted=True, loops=True):
+        """scipy.sparse CSR adjacency matrix; shares the index arrays, so do not modify it in place"""
+        from scipy.sparse import csr_matrix
+        n = self.number_of_nodes()
+        indptr, indices = self.indptr, self.indices
+        data = self.weights if weighted else np.ones(len(indices), dtype=np.int32)
+        if not loops:
+            rows = np.repeat(np.arange(n), np.diff(indptr))
+            kept = rows != indices
+            if not kept.all():
+                indptr = np.zeros(n + 1, dtype=np.int64)
+                indptr[1:] = np.cumsum(np.bincount(rows[kept], minlength=n))
+                indices, data = indices[kept], data[kept]
+        return csr_matrix((data, indices, indptr), shape=(n, n))
+
+    def subgraph(self, nodes):
+        """Induced subgraph on node ids (or a boolean mask), nodes renumbered in increasing id order"""
+        mask = np.zeros(self.number_of_nodes(), dtype=bool)
+        mask[nodes] = True
+        kept = np.flatnonzero(mask)
+        new_ids = np.full(self.number_of_nodes(), -1, dtype=np.int64)
+        new_ids[kept] = np.arange(len(kept))
+        rows, cols, weights = self.edges()
+        inside = mask[rows] & mask[cols]
+        names = [self.names[i] for i in kept.tolist()]
+        node_attributes = None if self.node_attributes is None else [self.node_attributes[i] for i in kept.tolist()]
+        edge_attributes = None
+        if self.edge_attributes is not None:
+            edge_attributes = {(new_ids[i], new_ids[j]): data for (i, j), data in self.edge_attributes.items()
+                               if mask[i] and mask[j]} or None
+        return CSRGraph.from_edges(len(kept), new_ids[rows[inside]], new_ids[cols[inside]], weights[inside], names,
+                                   self.weights.dtype, node_attributes=node_attributes,
+                                   edge_attributes=edge_attributes, graph_attributes=dict(self.graph_attributes))
@@ -0,0 +1,158 @@
+import os
+import json
+import hashlib
+import warnings
+import numpy as np
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from data_processing import parallel
+from data_processing import instrument
+
+########## Degree distribution fits (power law, lognormal comparison, bootstrap goodness of fit), memoized
+#    fits = fit_many({"threshold 5": degrees_5, "threshold 20": degrees_20}, n_bootstrap=200)
+#    plot.plot_deg_dist_fit_log_single_pdf(degrees_5, fit=fits["threshold 5"])
+#Fits are keyed by the hash of the sorted degree sequence and the powerlaw.Fit options, so the same
+#graph variant is fitted once per session (and once at all with a cache_dir).
+FIELDS = ["key", "n", "alpha", "xmin", "sigma", "D", "n_tail", "lognormal_mu", "lognormal_sigma", "R", "p_R",
+          "p_value", "n_bootstrap", "seed", "degrees", "counts", "pdf_x", "pdf_y", "fit_x", "fit_y"]
+PowerLaw = namedtuple("PowerLaw", ["alpha", "xmin", "sigma", "D"])
+
+class DegreeFit(namedtuple("DegreeFit", FIELDS)):
+    """
+    Power-law fit of a degree sequence (powerlaw.Fit): alpha, xmin, sigma (standard error of alpha), D (KS distance),
+    n_tail (degrees >= xmin); the lognormal fit (mu, sigma) and the log-likelihood ratio R (> 0: power law preferred)
+    with its p-value p_R; the bootstrap goodness-of-fit p_value of n_bootstrap replicates (nan without).
+    The points the plot functions draw: degrees with their counts, the log-binned pdf (pdf_x, pdf_y as
+    powerlaw.plot_pdf), the fitted power law (fit_x, fit_y as Fit.power_law.plot_pdf).
+    """
+    __slots__ = ()
+
+    @property
+    def power_law(self):
+        #As Fit.power_law, for code reading fit.power_law.alpha
+        return PowerLaw(self.alpha, self.xmin, self.sigma, self.D)
+
+_FITS = {}
+
+def degree_key(degrees, options=None):
+    """Hash of a degree sequence (order does not matter) and the fit options"""
+    digest = hashlib.sha1(np.sort(np.asarray(degrees, dtype=np.float64)).tobytes())
+    digest.update(json.dumps(options or {}, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+def clear_cache():
+    _FITS.clear()
+
+def _fit(degrees, options):
+    import powerlaw as pwl
+    degrees = np.asarray(degrees, dtype=np.float64)
+    with warnings.catch_warnings(), np.errstate(all="ignore"):
+        warnings.simplefilter("ignore")
+        with instrument.stage("powerlaw.Fit", n=len(degrees)):
+            fit = pwl.Fit(degrees, **{"verbose": 0, **options})
+        R, p_R = fit.distribution_compare("power_law", "lognormal")
+        lognormal_mu, lognormal_sigma = fit.lognormal.mu, fit.lognormal.sigma
+        edges, pdf_y = pwl.pdf(degrees)
+        fit_x = np.unique(degrees[(degrees >= fit.power_law.xmin) & (degrees <= (fit.power_law.xmax or np.inf))])
+        fit_y = fit.power_law.pdf(fit_x)
+    pdf_y = np.where(pdf_y == 0, np.nan, pdf_y)
+    fit_y = np.where(fit_y == 0, np.nan, fit_y)
+    values, counts = np.unique(degrees, return_counts=True)
+    return DegreeFit(degree_key(degrees, options), len(degrees), float(fit.power_law.alpha), float(fit.power_law.xmin),
+                     float(fit.power_law.sigma), float(fit.power_law.D), int(np.sum(degrees >= fit.power_law.xmin)),
+                     float(lognormal_mu), float(lognormal_sigma), float(R), float(p_R), np.nan, 0, None,
+                     values, counts, (edges[1:] + edges[:-1]) / 2, pdf_y, fit_x, fit_y)
+
+def _fit_task(task):
+    return _fit(*task)
+
+def _replicate_distance(task):
+    #KS distance of the power law refitted to one semi-parametric bootstrap sample (Clauset, Shalizi & Newman 2009):
+    #each value drawn from the fitted power law with the probability of the tail, otherwise resampled below xmin
+    import powerlaw as pwl
+    degrees, alpha, xmin, options, seed = task
+    rng = np.random.default_rng(seed)
+    #powerlaw draws from the global generator: seeded for the replicate, then given back its state
+    #(replicates run in the caller's process with one worker)
+    state = np.random.get_state()
+    np.random.seed(rng.integers(2 ** 32))
+    try:
+        body = degrees[degrees < xmin]
+        n_tail = rng.binomial(len(degrees), 1 - len(body) / len(degrees))
+        with warnings.catch_warnings(), np.errstate(all="ignore"):
+            warnings.simplefilter("ignore")
+            tail = pwl.Power_Law(xmin=xmin, parameters=[alpha], discrete=options.get("discrete", False)).generate_random(n_tail)
+            sample = np.concatenate((rng.choice(body, len(degrees) - n_tail) if len(body) else np.zeros(0), np.ravel(tail)))
+            return float(pwl.Fit(sample, **{"verbose": 0, **options}).power_law.D)
+    finally:
+        np.random.set_state(state)
+
+def _map(function, tasks, n_workers):
+    n_workers = min(parallel.worker_count(n_workers), max(len(tasks), 1))
+    if n_workers == 1:
+        return [function(task) for task in tasks]
+    with ProcessPoolExecutor(n_workers) as executor:
+        return list(executor.map(function, tasks, chunksize=max(len(tasks) // (4 * n_workers), 1)))
+
+def _cache_path(cache_dir, key):
+    return os.path.join(cache_dir, f"{key}.json")
+
+def _load(cache_dir, key):
+    if key in _FITS or cache_dir is None or not os.path.exists(_cache_path(cache_dir, key)):
+        return _FITS.get(key)
+    with open(_cache_path(cache_dir, key)) as file:
+        data = json.load(file)
+    arrays = {field: np.array(data[field], dtype=np.float64 if field != "counts" else np.int64)
+              for field in ("degrees", "counts", "pdf_x", "pdf_y", "fit_x", "fit_y")}
+    _FITS[key] = DegreeFit(**{**data, **arrays, "p_value": np.nan if data["p_value"] is None else data["p_value"]})
+    return _FITS[key]
+
+def _save(cache_dir, fit):
+    _FITS[fit.key] = fit
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        data = {field: value.tolist() if isinstance(value, np.ndarray) else value for field, value in fit._asdict().items()}
+        data = {field: None if isinstance(value, float) and np.isnan(value) else value for field, value in data.items()}
+        with open(_cache_path(cache_dir, fit.key), "w") as file:
+            json.dump(data, file)
+
+@instrument.timed
+def fit_many(degree_sequences, n_bootstrap=0, seed=1, options=None, n_workers=None, cache_dir=None):
+    """
+    DegreeFit of each degree sequence (list, or dict name -> degrees, e.g. one per threshold / alpha / snapshot),
+    fitted in a pool of n_workers processes; sequences fitted before (same degrees and powerlaw.Fit options,
+    in this session or in cache_dir) are not refitted.
+    n_bootstrap > 0: also the goodness-of-fit p-value, the fraction of n_bootstrap semi-parametric bootstrap samples
+    whose refitted KS distance is at least D; all replicates of all sequences share the pool, and replicate b
+    of a sequence uses the generator seeded with (seed, b), so p-values do not depend on n_workers.
+    Returns a list or dict (as degree_sequences) of DegreeFit.
+    """
+    options = options or {}
+    names = list(degree_sequences) if isinstance(degree_sequences, dict) else None
+    sequences = [np.asarray(degrees, dtype=np.float64) for degrees in
+                 (degree_sequences.values() if names is not None else degree_sequences)]
+    keys = [degree_key(degrees, options) for degrees in sequences]
+
+    missing = {key: degrees for key, degrees in zip(keys, sequences) if _load(cache_dir, key) is None}
+    for fit in _map(_fit_task, [(degrees, options) for degrees in missing.values()], n_workers):
+        _save(cache_dir, fit)
+
+    if n_bootstrap:
+        unbootstrapped = {key: degrees for key, degrees in zip(keys, sequences)
+                          if _FITS[key].n_bootstrap != n_bootstrap or _FITS[key].seed != seed}
+        tasks = [(degrees, _FITS[key].alpha, _FITS[key].xmin, options, (seed, b))
+                 for key, degrees in unbootstrapped.items() for b in range(n_bootstrap)]
+        with instrument.stage("degree_fits.bootstrap", replicates=len(tasks)):
+            distances = np.array(_map(_replicate_distance, tasks, n_workers)).reshape(len(unbootstrapped), n_bootstrap)
+        for key, replicate_distances in zip(unbootstrapped, distances):
+            fit = _FITS[key]
+            _save(cache_dir, fit._replace(p_value=float(np.mean(replicate_distances >= fit.D)),
+                                          n_bootstrap=n_bootstrap, seed=seed))
+
+    fits = [_FITS[key] for key in keys]
+    return dict(zip(names, fits)) if names is not None else fits
+
+def fit_degrees(degrees, n_bootstrap=0, seed=1, options=None, n_workers=None, cache_dir=None):
+    """DegreeFit of one degree sequence (see fit_many; the bootstrap replicates run in parallel)"""
+    return fit_many([degrees], n_bootstrap, seed, options, n_workers, cache_dir)[0]
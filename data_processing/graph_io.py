@@ -0,0 +1,208 @@
+import numpy as np
+import networkx as nx
+
+from data_processing import instrument
+from data_processing.csr import CSRGraph
+from data_processing.store import save_arrays, load_arrays
+
+########## Binary graph files (edge arrays + node attribute columns, memory-mappable)
+def _is_number(value):
+    return isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool)
+
+def _is_integer(value):
+    return isinstance(value, (int, np.integer)) and not isinstance(value, (bool, np.bool_))
+
+def _is_bool(value):
+    return isinstance(value, (bool, np.bool_))
+
+def _kind(values):
+    #Column type of the values present: bool, int (int64), float (float64) or str (anything else, or mixed)
+    if values and all(_is_bool(value) for value in values):
+        return "bool"
+    if all(_is_integer(value) for value in values):
+        return "int"
+    if all(_is_number(value) for value in values):
+        return "float"
+    return "str"
+
+def _columns(records, prefix):
+    #One typed column per attribute of a list of dicts, with masks restoring what the type cannot hold:
+    #"absent" (the key is not in the dict), "missing" (None or nan), "empty" ("" in a number column, as GraphML files
+    #store missing values). Mixed-type columns are stored as strings.
+    keys = list(dict.fromkeys(key for data in records for key in data))
+    columns = {}; specs = []
+    for position, key in enumerate(keys):
+        absent = np.array([key not in data for data in records], dtype=bool)
+        values = [data.get(key) for data in records]
+        missing = np.array([value is None or (isinstance(value, (float, np.floating)) and np.isnan(value))
+                            for value in values], dtype=bool) & ~absent
+        empty = np.array([isinstance(value, str) and value == "" for value in values], dtype=bool)
+        kind = _kind([value for value, unset in zip(values, absent | missing | empty) if not unset])
+        if kind == "str":
+            empty[:] = False
+        unset = absent | missing | empty
+        if kind == "str":
+            column = np.array(["" if is_unset else str(value) for value, is_unset in zip(values, unset)], dtype=str)
+        else:
+            fill = np.nan if kind == "float" else 0
+            column = np.array([fill if is_unset else value for value, is_unset in zip(values, unset)],
+                              dtype={"bool": bool, "int": np.int64, "float": np.float64}[kind])
+        columns[f"{prefix}_{position}"] = column
+        masks = []
+        for mask, flags in (("absent", absent), ("missing", missing), ("empty", empty)):
+            if flags.any():
+                columns[f"{prefix}_{position}_{mask}"] = flags
+                masks.append(mask)
+        specs.append({"name": key, "kind": kind, "masks": masks})
+    return columns, specs
+
+def _spec_masks(spec):
+    #Masks of a column spec (files written before dtypes were stored: str columns flag missing values, float ones "")
+    if "masks" in spec:
+        return spec["masks"]
+    return ["missing"] if spec["kind"] == "str" else (["empty"] if spec.get("empty") else [])
+
+def _load_column(path, prefix, position, spec):
+    #A column as written (memory-mapped) if no mask applies, otherwise an object array with None / nan / "" restored
+    #(absent values as nan); and the absent mask (or None)
+    masks = _spec_masks(spec)
+    loaded, _ = load_arrays(path, keys=[f"{prefix}_{position}"] + [f"{prefix}_{position}_{mask}" for mask in masks])
+    values = loaded[f"{prefix}_{position}"]
+    if not masks:
+        return values, None
+    values = values.astype(object)
+    for mask, restored in (("absent", np.nan), ("missing", np.nan), ("empty", "")):
+        if mask in masks:
+            values[np.asarray(loaded[f"{prefix}_{position}_{mask}"])] = restored
+    return values, np.asarray(loaded[f"{prefix}_{position}_absent"]) if "absent" in masks else None
+
+def _records(path, prefix, specs, n, wanted=None):
+    #The list of dicts a set of columns was written from (only the columns in wanted, if given)
+    records = [{} for _ in range(n)]
+    for position, spec in enumerate(specs):
+        if wanted is not None and spec["name"] not in wanted:
+            continue
+        values, absent = _load_column(path, prefix, position, spec)
+        values = values.tolist()
+        for i in (range(n) if absent is None else np.flatnonzero(~absent).tolist()):
+            records[i][spec["name"]] = values[i]
+    return records
+
+@instrument.timed
+def write_graph(G, path):
+    """
+    Write a networkx graph or CSRGraph as a directory of .npy arrays: int32 edge endpoints, float64 weights,
+    node names and one column per node and per edge attribute, each with its type (bool, int, float or str) and masks
+    of the absent, missing (None / nan) and "" values, so read_graph gives back the same attributes.
+    Lossy only for: node names and attribute values of columns mixing types (written as strings, unless all names
+    are ints), graph attributes (in meta.json, as JSON).
+    """
+    if not isinstance(G, CSRGraph):
+        G = CSRGraph.from_networkx(G)
+    rows, cols, weights = G.edges()
+    integer_names = len(G.names) > 0 and all(_is_integer(name) for name in G.names)
+    arrays = {"rows": rows.astype(np.int32), "cols": cols.astype(np.int32), "weights": weights.astype(np.float64),
+              "names": np.array(G.names if integer_names else [str(name) for name in G.names],
+                                dtype=np.int64 if integer_names else str)}
+    columns, node_specs = _columns(G.node_attributes or [{} for _ in G.names], "node")
+    arrays.update(columns)
+    edge_specs = []
+    if G.edge_attributes:
+        columns, edge_specs = _columns([G.edge_attributes.get((i, j), {}) for i, j in zip(rows.tolist(), cols.tolist())], "edge")
+        arrays.update(columns)
+    save_arrays(path, arrays, meta={"n_nodes": len(G.names), "node_columns": node_specs, "edge_columns": edge_specs,
+                                    "graph": G.graph_attributes})
+
+def read_graph_arrays(path, columns=None, edge_list=False):
+    """
+    Memory-mapped arrays of a graph file: dict with 'n_nodes', 'graph' (attributes), 'rows' and 'cols' (the edge
+    endpoints), 'weights', 'names' and 'columns' (attribute name -> array; with absent, missing or "" values an object
+    array, absent values as nan). Only the requested node attribute columns are loaded (all by default, [] for none).
+    edge_list: also 'edge_list', the (E, 2) endpoints graph-tool takes (a copy of rows and cols):
+    g.add_vertex(n_nodes); g.add_edge_list(edge_list); weights and node columns as property values.
+    """
+    arrays, meta = load_arrays(path, keys=["rows", "cols", "weights", "names"])
+    specs = meta["node_columns"]
+    wanted = [spec["name"] for spec in specs] if columns is None else columns
+    positions = {spec["name"]: position for position, spec in enumerate(specs)}
+    node_columns = {name: _load_column(path, "node", positions[name], specs[positions[name]])[0] for name in wanted}
+    result = {"n_nodes": meta["n_nodes"], "graph": meta.get("graph", {}), "rows": arrays["rows"], "cols": arrays["cols"],
+              "weights": arrays["weights"], "names": arrays["names"], "columns": node_columns}
+    if edge_list:
+        result["edge_list"] = np.column_stack((arrays["rows"], arrays["cols"]))
+    return result
+
+@instrument.timed
+def read_graph(path, as_="networkx", columns=None):
+    """
+    Read a graph written by write_graph, as a networkx graph ("networkx"), a CSRGraph ("csr"),
+    or graph-tool compatible arrays ("arrays", see read_graph_arrays).
+    columns: node attributes to load (all by default); e.g. [] for the bare weighted graph.
+    """
+    if as_ == "arrays":
+        return read_graph_arrays(path, columns, edge_list=True)
+    arrays, meta = load_arrays(path, keys=["rows", "cols", "weights", "names"])
+    names = arrays["names"].tolist()
+    specs = meta["node_columns"]
+    node_attributes = None
+    if any(columns is None or spec["name"] in columns for spec in specs):
+        node_attributes = _records(path, "node", specs, len(names), columns)
+    edge_attributes = None
+    if meta.get("edge_columns"):
+        rows, cols = np.asarray(arrays["rows"]).tolist(), np.asarray(arrays["cols"]).tolist()
+        records = _records(path, "edge", meta["edge_columns"], len(rows))
+        edge_attributes = {(i, j): data for i, j, data in zip(rows, cols, records) if data} or None
+    G = CSRGraph.from_edges(meta["n_nodes"], arrays["rows"], arrays["cols"], np.asarray(arrays["weights"]), names,
+                            node_attributes=node_attributes, edge_attributes=edge_attributes,
+                            graph_attributes=meta.get("graph", {}))
+    if as_ == "csr":
+        return G
+    if as_ == "networkx":
+        return G.to_networkx()
+    raise ValueError(f"Unknown graph type: {as_}")
+
+@instrument.timed
+def write_graphml(G, path):
+    """GraphML export (missing node attributes written as "", as the analysis notebooks expect)"""
+    if isinstance(G, CSRGraph):
+        G = G.to_networkx()
+    G_ = nx.Graph(**G.graph)
+    G_.add_nodes_from((node, {key: "" if isinstance(value, float) and np.isnan(value) else value
+                              for key, value in data.items()}) for node, data in G.nodes(data=True))
+    G_.add_edges_from(G.edges(data=True))
+    with open(path, "wb") as file:
+        nx.write_graphml(G_, file)
+
+def _same_value(a, b):
+    return (a == b and type(a) is type(b)) or (isinstance(a, float) and isinstance(b, float) and np.isnan(a) and np.isnan(b))
+
+def _same_attributes(a, b):
+    return a.keys() == b.keys() and all(_same_value(a[key], b[key]) for key in a)
+
+def graph_differences(G, H):
+    """Nodes and edges of two networkx graphs whose attributes (values and types) differ, as a list of messages"""
+    differences = []
+    if list(G.nodes()) != list(H.nodes()):
+        return ["different nodes"]
+    differences += [f"node {node}" for node in G.nodes() if not _same_attributes(G.nodes[node], H.nodes[node])]
+    if G.number_of_edges() != H.number_of_edges():
+        return differences + ["different number of edges"]
+    differences += [f"edge {u} - {v}" for u, v, data in G.edges(data=True)
+                    if not H.has_edge(u, v) or not _same_attributes(data, H.edges[u, v])]
+    if G.graph != H.graph:
+        differences.append("graph attributes")
+    return differences
+
+@instrument.timed
+def graphml_to_binary(graphml_path, path, check=True):
+    """
+    Convert an existing GraphML file (e.g. data/painters.graphml) to the binary format, once;
+    check: read it back and raise ValueError if it does not give the same graph
+    """
+    G = nx.read_graphml(graphml_path)
+    write_graph(G, path)
+    if check:
+        differences = graph_differences(G, read_graph(path))
+        if differences:
+            raise ValueError(f"{path} does not read back as {graphml_path}: {', '.join(differences[:10])}")
+    return G
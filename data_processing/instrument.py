@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import time
+import resource
+import threading
+import functools
+from collections import Counter
+
+########## Opt-in instrumentation: timed stages, counters, memory high-water, sampling profiler
+#Disabled by default; a disabled stage() or @timed function costs one flag check.
+#    with instrument.session(sampling_interval=0.005):
+#        ...
+#    instrument.export_chrome_trace("trace.json") #chrome://tracing, ui.perfetto.dev
+_STATE = {"enabled": False, "origin": time.perf_counter(), "spans": [], "counters": Counter(), "calls": {},
+          "hooks": [], "samples": Counter(), "sampler": None}
+_LOCK = threading.Lock()
+
+def enabled():
+    return _STATE["enabled"]
+
+def enable(sampling_interval=None):
+    """Start recording (and sampling the call stacks of all threads every sampling_interval seconds, if given)"""
+    _STATE["enabled"] = True
+    if sampling_interval:
+        start_sampler(sampling_interval)
+
+def disable():
+    _STATE["enabled"] = False
+    stop_sampler()
+
+def reset():
+    """Forget everything recorded so far"""
+    with _LOCK:
+        _STATE.update(origin=time.perf_counter(), spans=[], counters=Counter(), calls={}, samples=Counter())
+
+class session:
+    """Context manager recording what runs inside it: with instrument.session(): ..."""
+    def __init__(self, sampling_interval=None, clear=True):
+        self.sampling_interval = sampling_interval
+        self.clear = clear
+
+    def __enter__(self):
+        if self.clear:
+            reset()
+        enable(self.sampling_interval)
+        return sys.modules[__name__]
+
+    def __exit__(self, *exc):
+        disable()
+        return False
+
+def add_hook(hook):
+    """hook(event, name, span) is called with event 'start' and 'end' around every recorded stage"""
+    _STATE["hooks"].append(hook)
+
+def remove_hook(hook):
+    _STATE["hooks"].remove(hook)
+
+def _memory_mb():
+    #(current RSS, high-water RSS) of the process in MB
+    try:
+        with open("/proc/self/status") as file:
+            values = {line.split(":")[0]: int(line.split()[1]) / 1024 for line in file
+                      if line.startswith(("VmRSS:", "VmHWM:"))}
+        return values.get("VmRSS"), values.get("VmHWM")
+    except OSError:
+        return None, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class _Stage:
+    __slots__ = ("name", "args", "span")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        rss, _ = _memory_mb()
+        self.span = {"name": self.name, "args": self.args, "tid": threading.get_ident(), "rss_start_mb": rss,
+                     "start": time.perf_counter() - _STATE["origin"]}
+        for hook in _STATE["hooks"]:
+            hook("start", self.name, self.span)
+        return self.span
+
+    def __exit__(self, *exc):
+        span = self.span
+        span["end"] = time.perf_counter() - _STATE["origin"]
+        span["rss_end_mb"], span["rss_peak_mb"] = _memory_mb()
+        seconds = span["end"] - span["start"]
+        with _LOCK:
+            _STATE["spans"].append(span)
+            calls, total, longest = _STATE["calls"].get(self.name, (0, 0.0, 0.0))
+            _STATE["calls"][self.name] = (calls + 1, total + seconds, max(longest, seconds))
+        for hook in _STATE["hooks"]:
+            hook("end", self.name, span)
+        return False
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+def stage(name, **args):
+    """Context manager timing a block as a named stage (args are kept in the trace): with instrument.stage("edges"): ..."""
+    return _Stage(name, args) if _STATE["enabled"] else _NULL_STAGE
+
+def timed(function=None, name=None):
+    """Decorator recording each call of a function as a stage (named module.function by default)"""
+    def decorate(function):
+        stage_name = name or f"{function.__module__.rsplit('.', 1)[-1]}.{function.__qualname__}"
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _STATE["enabled"]:
+                return function(*args, **kwargs)
+            with _Stage(stage_name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate(function) if function is not None else decorate
+
+def count(name, value=1):
+    """Add value to a counter (e.g. pairs evaluated, edges kept)"""
+    if _STATE["enabled"]:
+        with _LOCK:
+            _STATE["counters"][name] += value
+
+########## Sampling profiler (call stacks of all threads at a fixed interval)
+def _sample(interval, stop):
+    own = threading.get_ident()
+    while not stop.wait(interval):
+        for thread, frame in sys._current_frames().items():
+            if thread == own:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            with _LOCK:
+                _STATE["samples"][";".join(reversed(stack))] += 1
+
+def start_sampler(interval=0.005):
+    stop_sampler()
+    stop = threading.Event()
+    thread = threading.Thread(target=_sample, args=(interval, stop), daemon=True, name="instrument-sampler")
+    _STATE["sampler"] = (thread, stop)
+    thread.start()
+
+def stop_sampler():
+    if _STATE["sampler"] is not None:
+        thread, stop = _STATE["sampler"]
+        stop.set()
+        thread.join()
+        _STATE["sampler"] = None
+
+########## Reports and exports
+def report():
+    """Summary: per stage calls, total/mean/max seconds; counters; process memory; the 20 most sampled stacks"""
+    with _LOCK:
+        stages = {name: {"calls": calls, "seconds": total, "mean_seconds": total / calls, "max_seconds": longest}
+                  for name, (calls, total, longest) in _STATE["calls"].items()}
+        counters = dict(_STATE["counters"])
+        samples = _STATE["samples"].most_common(20)
+    rss, peak = _memory_mb()
+    return {"stages": dict(sorted(stages.items(), key=lambda item: -item[1]["seconds"])), "counters": counters,
+            "rss_mb": rss, "peak_rss_mb": peak, "top_samples": [{"stack": stack, "samples": n} for stack, n in samples]}
+
+def export_json(path):
+    """The report plus every recorded span (seconds since the last reset)"""
+    with open(path, "w") as file:
+        json.dump({**report(), "spans": list(_STATE["spans"])}, file, indent=1, default=str)
+
+def export_chrome_trace(path):
+    """Spans as a Chrome trace (chrome://tracing or ui.perfetto.dev), with the counters' final values"""
+    pid = os.getpid()
+    events = [{"name": span["name"], "ph": "X", "ts": span["start"] * 1e6, "dur": (span["end"] - span["start"]) * 1e6,
+               "pid": pid, "tid": span["tid"], "args": {**{key: str(value) for key, value in span["args"].items()},
+                                                         "rss_peak_mb": span["rss_peak_mb"]}}
+              for span in list(_STATE["spans"])]
+    end = max((span["end"] for span in _STATE["spans"]), default=0) * 1e6
+    events += [{"name": name, "ph": "C", "ts": end, "pid": pid, "args": {name: value}}
+               for name, value in dict(_STATE["counters"]).items()]
+    with open(path, "w") as file:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+def export_folded(path):
+    """Sampled stacks in the folded format of flamegraph.pl / speedscope ("a;b;c count" lines)"""
+    with open(path, "w") as file:
+        for stack, n in _STATE["samples"].most_common():
+            file.write(f"{stack} {n}\n")
@@ -3,27 +3,45 @@ import networkx as nx
 import pandas as pd
 import ast
 
-def describe_graph(G, weights=True, shortest_paths = True):    
-    print("Number of nodes: ", G.number_of_nodes())
-    print("Number of edges: ", G.number_of_edges())
+from data_processing import instrument
+from data_processing.csr import CSRGraph
+
+@instrument.timed
+def describe_graph(G, weights=True, shortest_paths = True, n_sources=None, n_workers=None):
+    """
+    Print size, weight, component and (on the largest component) shortest path statistics of a graph
+    (networkx or CSRGraph). Path statistics come from one streamed BFS pass (see paths.path_statistics):
+    exact by default, estimated from n_sources random pivots otherwise, with the diameter bounds of those
+    BFS (the exact diameter takes another traversal: paths.diameter).
+    """
+    from data_processing import paths
+    C = G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+    print("Number of nodes: ", C.number_of_nodes())
+    print("Number of edges: ", C.number_of_edges())
     if weights:
-        print("Average edge weight: ", np.mean([data['weight'] for _, _, data in G.edges(data=True)]))
-        print("Smallest edge weight: ", min([data['weight'] for _, _, data in G.edges(data=True)]))
-        print("Largest edge weight: ", max([data['weight'] for _, _, data in G.edges(data=True)]))
+        edge_weights = C.edges()[2]
+        print("Average edge weight: ", np.mean(edge_weights))
+        print("Smallest edge weight: ", np.min(edge_weights))
+        print("Largest edge weight: ", np.max(edge_weights))
 
-    components = list(nx.connected_components(G))
-    lcc = max(components, key=len)
-    print("Number of connected components: ", nx.number_connected_components(G), 
+    labels, sizes = paths.components(C)
+    print("Number of connected components: ", len(sizes), 
           "\n\tamong which the number of components with more than one node:" , 
-          len([c for c in components if len(c) > 1]))
-    print("Size of largest connected component:", len(lcc))
+          np.count_nonzero(sizes > 1))
+    print("Size of largest connected component:", sizes.max())
 
     if shortest_paths:
-        lcc_all_shortest_path_lengths = nx.all_pairs_shortest_path_length(G.subgraph(lcc))
-        lcc_all_shortest_path_lengths = [length for src, tgts in lcc_all_shortest_path_lengths for tgt, length in tgts.items() if length > 0]
-        print(f"Average shortest path length: {sum(lcc_all_shortest_path_lengths)/len(lcc_all_shortest_path_lengths):.2f}")
-        print("Diameter: ", nx.diameter(G))
+        lcc = C.subgraph(labels == np.argmax(sizes))
+        statistics = paths.path_statistics(lcc, n_sources=n_sources, n_workers=n_workers)
+        if statistics["diameter"] is None:
+            print(f"Average shortest path length: {statistics['average']:.2f} "
+                  f"({statistics['ci'][0]:.2f} - {statistics['ci'][1]:.2f}, {n_sources} sources)")
+            print("Diameter: {} - {} (bounds from the {} sources)".format(*statistics["diameter_bounds"], n_sources))
+        else:
+            print(f"Average shortest path length: {statistics['average']:.2f}")
+            print("Diameter: ", statistics["diameter"])
 
+@instrument.timed
 def describe_measures(artists_df, print_results=True):
     nationality = get_column_counts_adjusted(artists_df, 'Nationality')
     citizenship = get_column_counts_adjusted(artists_df, 'citizenship')
@@ -75,13 +93,14 @@ def get_column_average(artists_df, column):
 def get_column_std(artists_df, column):
     return (artists_df[column]).std()
 
-def get_locations_average(artists_df):
-    all_people_locations = []
-    for index, row in artists_df.iterrows():
-        locations = ast.literal_eval(row['locations'])
-        all_people_locations.extend(locations)
+def _parse_list(value):
+    #"['Paris', 'Rome']" literals or plain "Paris,Rome" strings
+    return ast.literal_eval(value) if value.startswith('[') else value.split(',')
 
-    return pd.Series(all_people_locations).value_counts(normalize=True)
+def get_locations_average(artists_df):
+    """Relative frequency of locations; for the columnar artist store see store.ragged_value_counts"""
+    all_people_locations = artists_df['locations'].dropna().map(_parse_list).explode().dropna()
+    return all_people_locations.value_counts(normalize=True)
 
 def get_female_percentage(artists_df):
     values = (artists_df['gender'].value_counts(normalize=True))
@@ -105,6 +124,95 @@ def get_female_percentage(artists_df):
                 return None
     return 100*values['female'] / values_known
 
+### Per-community (block) statistics
+
+def block_labels(artists_df, blocks, hierarchy=None, level=0):
+    """
+    Block label of each row of artists_df (-1 if in no block), from blocks: block id -> list of artists (data/blocks.json).
+    For nested SBMs, hierarchy is the list of {block id: parent block id} maps of the levels above, and level picks one.
+    Returns (labels, block ids, block sizes), sizes counting the artists listed in the blocks.
+    """
+    ids = list(blocks)
+    membership = {artist: i for i, block in enumerate(ids) for artist in blocks[block]}
+    labels = artists_df['artist'].map(membership).fillna(-1).to_numpy(dtype=np.int64)
+    sizes = np.array([len(blocks[block]) for block in ids], dtype=np.int64)
+    for parents in (hierarchy or [])[:level]:
+        parent_ids = list(dict.fromkeys(parents[block] for block in ids))
+        index = {block: i for i, block in enumerate(parent_ids)}
+        to_parent = np.array([index[parents[block]] for block in ids], dtype=np.int64)
+        labels = np.where(labels >= 0, to_parent[np.maximum(labels, 0)], -1)
+        sizes = np.bincount(to_parent, weights=sizes, minlength=len(parent_ids)).astype(np.int64)
+        ids = parent_ids
+    return labels, ids, sizes
+
+def _grouped_means(labels, values, n_blocks):
+    values = np.asarray(values, dtype=np.float64)
+    ok = (labels >= 0) & ~np.isnan(values)
+    counts = np.bincount(labels[ok], minlength=n_blocks)
+    sums = np.bincount(labels[ok], weights=values[ok], minlength=n_blocks)
+    return np.divide(sums, counts, out=np.full(n_blocks, np.nan), where=counts > 0)
+
+def _grouped_female_percentage(labels, gender, n_blocks):
+    #As get_female_percentage: 100 * female / (male + female), nan if neither is known
+    gender = np.asarray(gender, dtype=object)
+    female = (gender == 'female') & (labels >= 0)
+    known = (female | (gender == 'male')) & (labels >= 0)
+    females = np.bincount(labels[female], minlength=n_blocks)
+    knowns = np.bincount(labels[known], minlength=n_blocks)
+    return np.divide(100 * females, knowns, out=np.full(n_blocks, np.nan), where=knowns > 0)
+
+def _grouped_shares(labels, values, n_blocks, top_k=None, round_to=3):
+    #As get_column_counts_adjusted(...).to_dict() per block: shares of the non-missing values, most frequent first
+    codes, vocab = pd.factorize(values)
+    ok = (labels >= 0) & (codes >= 0)
+    n_values = max(len(vocab), 1)
+    cells, counts = np.unique(labels[ok] * n_values + codes[ok], return_counts=True)
+    block, code = cells // n_values, cells % n_values
+    shares = counts / np.bincount(block, weights=counts, minlength=n_blocks)[block]
+    if round_to:
+        shares = shares.round(round_to)
+    order = np.lexsort((code, -counts, block))
+    block, code, shares = block[order], code[order], shares[order]
+    bounds = np.searchsorted(block, np.arange(n_blocks + 1))
+    vocab = np.asarray(vocab, dtype=object)
+    top = slice(None, top_k)
+    return [dict(zip(vocab[code[start:stop]][top].tolist(), shares[start:stop][top].tolist()))
+            for start, stop in zip(bounds[:-1], bounds[1:])]
+
+@instrument.timed
+def block_statistics(artists_df, blocks, hierarchy=None, level=0, top_k=None, round_to=3,
+                     categorical=('Nationality', 'citizenship', 'styles', 'movement'),
+                     numeric=('birth_year', 'wikiart_pictures_count')):
+    """
+    Statistics of every block (community) of artists at once: blocks is block id -> artists (data/blocks.json),
+    hierarchy and level select a level of a nested SBM (see block_labels).
+    Returns a DataFrame with one row per block: 'Block ID', 'Size', the shares of the categorical columns
+    (dicts as get_column_counts_adjusted, only the top_k values if given), 'Female %' (as get_female_percentage)
+    and the means of the numeric columns. Each statistic is one grouped pass over the table.
+    """
+    labels, ids, sizes = block_labels(artists_df, blocks, hierarchy, level)
+    n_blocks = len(ids)
+    data = {'Block ID': ids, 'Size': sizes}
+    for column in categorical:
+        data[column.lower()] = _grouped_shares(labels, artists_df[column].to_numpy(), n_blocks, top_k, round_to)
+    data['Female %'] = _grouped_female_percentage(labels, artists_df['gender'].to_numpy(), n_blocks)
+    for column in numeric:
+        data[column] = _grouped_means(labels, artists_df[column].to_numpy(), n_blocks)
+    return pd.DataFrame(data)
+
+@instrument.timed
+def block_female_percentage_by_time(artists_df, blocks, bin_width=20, column='birth_year', hierarchy=None, level=0):
+    """Female % of each block (rows, by block id) in bin_width-year bins of column (columns, by bin start); nan if no known gender"""
+    labels, ids, _ = block_labels(artists_df, blocks, hierarchy, level)
+    years = artists_df[column].to_numpy(dtype=np.float64)
+    labels = np.where(np.isnan(years), -1, labels)
+    bins = np.floor(np.nan_to_num(years) / bin_width).astype(np.int64)
+    starts = np.unique(bins[labels >= 0])
+    bin_labels = np.where(labels >= 0, labels * max(len(starts), 1) + np.searchsorted(starts, bins), -1)
+    percentages = _grouped_female_percentage(bin_labels, artists_df['gender'].to_numpy(), len(ids) * len(starts))
+    return pd.DataFrame(percentages.reshape(len(ids), len(starts)), index=pd.Index(ids, name='Block ID'),
+                        columns=starts * bin_width)
+
 ### Graph measures
 
 def random_config_communities(comm, seed=1):
@@ -117,39 +225,287 @@ def random_config_communities(comm, seed=1):
     section_indices = list(np.cumsum(comm_lengths))
     return [flattened[i:j] for i, j in zip([0] + section_indices, section_indices)]
 
+@instrument.timed
 def clustering_coefficient(G):
     """Calculated for each node, returns a list of coefficients"""
+    if isinstance(G, CSRGraph):
+        return _local_clustering(G).tolist()
     return list(nx.clustering(G).values())
 
+def _local_clustering(G):
+    #Unweighted local clustering from sparse triangle counts: t_i = (A^2 * A)_i / 2
+    A = G.adjacency(weighted=False, loops=False)
+    triangles = np.asarray((A @ A).multiply(A).sum(axis=1)).ravel() / 2
+    degrees = np.diff(A.indptr)
+    pairs = degrees * (degrees - 1) / 2
+    return np.divide(triangles, pairs, out=np.zeros(len(pairs)), where=pairs > 0)
+
+@instrument.timed
 def threshold_filter(G, threshold):
+    """Remove edges with weight below threshold and then the isolated nodes (a CSRGraph is returned filtered, not modified)"""
+    if isinstance(G, CSRGraph):
+        rows, cols, weights = G.edges()
+        kept = weights >= threshold
+        nodes = np.zeros(G.number_of_nodes(), dtype=bool)
+        nodes[rows[kept]] = True; nodes[cols[kept]] = True
+        filtered = CSRGraph.from_edges(G.number_of_nodes(), rows[kept], cols[kept], weights[kept], G.names, G.weights.dtype,
+                                       node_attributes=G.node_attributes, edge_attributes=G.edge_attributes,
+                                       graph_attributes=G.graph_attributes)
+        return filtered.subgraph(nodes)
     edges_to_remove = [(u, v) for u, v, data in G.edges(data=True) if data['weight'] < threshold]
     G.remove_edges_from(edges_to_remove)
     G.remove_nodes_from(list(nx.isolates(G)))
     return G
 
-def compute_disparity_filter_probas(G):
+def _edge_arrays(G, weight='weight', weight_default=1):
+    #Integer edge list of a networkx graph or CSRGraph: (nodes, rows, cols, weights)
+    if isinstance(G, CSRGraph):
+        rows, cols, weights = G.edges()
+        return G.names, rows, cols, np.where(np.isnan(weights), weight_default, weights)
+    nodes = list(G.nodes())
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = [(index[u], index[v], d.get(weight, weight_default)) for u, v, d in G.edges(data=True)]
+    rows = np.fromiter((e[0] for e in edges), dtype=np.int64, count=len(edges))
+    cols = np.fromiter((e[1] for e in edges), dtype=np.int64, count=len(edges))
+    weights = np.fromiter((e[2] for e in edges), dtype=np.float64, count=len(edges))
+    return nodes, rows, cols, weights
+
+def _component_sweep(rows, cols, order, stops, n_nodes):
+    #Add the edges in the given order; after the first stops[t] edges (stops ascending) record the number of
+    #non-isolated nodes and the size of the largest component. Component labels are merged at each stop with
+    #connected_components on the new edges between the current components (O(n_nodes + new edges) per stop)
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components
+    labels = np.arange(n_nodes)
+    active = np.zeros(n_nodes, dtype=bool)
+    nodes_counts = np.zeros(len(stops), dtype=np.int64); largest_sizes = np.zeros(len(stops), dtype=np.int64)
+    position = 0
+    for t, stop in enumerate(stops):
+        new = order[position:stop]
+        if len(new):
+            links = csr_matrix((np.ones(len(new), dtype=np.int8), (labels[rows[new]], labels[cols[new]])), shape=(n_nodes, n_nodes))
+            labels = connected_components(links, directed=False)[1][labels]
+            active[rows[new]] = True; active[cols[new]] = True
+        position = max(position, stop)
+        nodes_counts[t] = np.count_nonzero(active)
+        largest_sizes[t] = np.bincount(labels[active]).max(initial=0)
+    return nodes_counts, largest_sizes
+
+def _sweep(rows, cols, keys, cutoffs, n_nodes, side):
+    #Shared part of the threshold and disparity sweeps: the edges kept at a cutoff are those with keys below it
+    #(side 'left': key < cutoff, 'right': key <= cutoff), a prefix of the edges sorted by key
+    order = np.argsort(keys, kind='stable')
+    stops = np.searchsorted(keys[order], cutoffs, side=side)
+    by_stop = np.argsort(stops, kind='stable')
+    nodes_counts, largest_sizes = _component_sweep(rows, cols, order, stops[by_stop], n_nodes)
+    nodes = np.empty(len(cutoffs), dtype=np.int64); nodes[by_stop] = nodes_counts
+    largest = np.empty(len(cutoffs), dtype=np.int64); largest[by_stop] = largest_sizes
+    edges_fraction = stops / max(len(keys), 1)
+    nodes_fraction = nodes / max(n_nodes, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction_of_fractions = edges_fraction / nodes_fraction
+    return {'edges': stops, 'nodes': nodes, 'largest_component': largest, 'edges_fraction': edges_fraction,
+            'nodes_fraction': nodes_fraction, 'fraction_of_fractions': fraction_of_fractions}
+
+@instrument.timed
+def threshold_sweep_arrays(rows, cols, weights, n_nodes, thresholds):
+    """
+    threshold_filter for a whole grid of thresholds in one pass over the edges sorted by weight.
+    For each threshold (keeping edges with weight >= threshold, dropping isolated nodes) returns a dict of arrays:
+    'edges', 'nodes', 'largest_component' (sizes) and the fractions 'edges_fraction', 'nodes_fraction'
+    (relative to the unfiltered edge list and the n_nodes nodes) and 'fraction_of_fractions'.
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    #Edges kept at a threshold (weight >= threshold): -weight <= -threshold
+    return {'thresholds': thresholds, **_sweep(rows, cols, -np.asarray(weights), -thresholds, n_nodes, 'right')}
+
+@instrument.timed
+def threshold_sweep(G, thresholds, weight='weight'):
+    """threshold_sweep_arrays for a networkx graph (fractions relative to G, G is not modified)"""
+    nodes, rows, cols, weights = _edge_arrays(G, weight)
+    return threshold_sweep_arrays(rows, cols, weights, len(nodes), thresholds)
+
+@instrument.timed
+def compute_disparity_filter_probas(G, weight='weight'):
+    """
+    Disparity filter p_ij of each edge, keyed by both (u, v) and (v, u).
+    The value is the smaller of the two endpoints' p_ij, so an edge is kept at alpha (p_ij < alpha)
+    if it is significant for at least one of its endpoints.
+    """
+    nodes, rows, cols, weights = _edge_arrays(G, weight)
+    probas, _, _ = disparity_filter_arrays(rows, cols, weights, len(nodes))
     edge_probas = {}
-    for node in G.nodes():
-        node_edges = G.edges(node, data='weight')
-        k = len(node_edges)
-        strength = sum([w for _, _, w in node_edges])
-
-        for u, v, w in node_edges:
-            p_ij = (1 - w / strength) ** (k - 1)
-            edge_probas[(u, v)] = p_ij
-
+    for u, v, p_ij in zip(rows.tolist(), cols.tolist(), probas.min(axis=1).tolist()):
+        edge_probas[(nodes[u], nodes[v])] = p_ij
+        edge_probas[(nodes[v], nodes[u])] = p_ij
     return edge_probas
 
+def _endpoint_probas(weights, strength, degree):
+    return (1 - weights / strength) ** (degree - 1)
+
+@instrument.timed
+def disparity_filter_arrays(rows, cols, weights, n_nodes):
+    """
+    Disparity filter p_ij of an edge list (rows, cols, weights) over n_nodes nodes, computed from both endpoints.
+    Returns (probas, strength, degree): probas is an (E, 2) array of p_ij seen from rows[e] and from cols[e].
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    strength = np.bincount(rows, weights, minlength=n_nodes) + np.bincount(cols, weights, minlength=n_nodes)
+    degree = np.bincount(rows, minlength=n_nodes) + np.bincount(cols, minlength=n_nodes)
+    probas = np.column_stack((_endpoint_probas(weights, strength[rows], degree[rows]),
+                              _endpoint_probas(weights, strength[cols], degree[cols])))
+    return probas, strength, degree
+
+def disparity_backbone(probas, alpha):
+    """Mask of the edges kept by the disparity filter at significance alpha: significant from at least one endpoint"""
+    return probas.min(axis=1) < alpha
+
+@instrument.timed
+def disparity_sweep_arrays(rows, cols, probas, n_nodes, alphas, return_masks=False):
+    """
+    Disparity filter for a whole grid of alphas in one pass over the edges sorted by significance.
+    probas: (E, 2) endpoint p_ij of disparity_filter_arrays (or an (E,) array of edge p_ij).
+    For each alpha (keeping the edges with p_ij < alpha, dropping isolated nodes) returns a dict of arrays:
+    'edges', 'nodes', 'largest_component' (sizes), 'edges_fraction', 'nodes_fraction' (relative to the
+    unfiltered edges and the n_nodes nodes), 'fraction_of_fractions', 'p' (edge p_ij), and with
+    return_masks the (len(alphas), E) boolean backbone edge masks.
+    """
+    alphas = np.asarray(alphas, dtype=np.float64)
+    probas = np.asarray(probas)
+    p = probas.min(axis=1) if probas.ndim == 2 else probas
+    result = {'alphas': alphas, **_sweep(rows, cols, p, alphas, n_nodes, 'left'), 'p': p}
+    if return_masks:
+        result['masks'] = p[None, :] < alphas[:, None]
+    return result
+
+@instrument.timed
+def disparity_sweep(G, alphas, weight='weight', return_masks=False):
+    """disparity_sweep_arrays for a networkx graph; masks follow the order of G.edges()"""
+    nodes, rows, cols, weights = _edge_arrays(G, weight)
+    probas, _, _ = disparity_filter_arrays(rows, cols, weights, len(nodes))
+    return disparity_sweep_arrays(rows, cols, probas, len(nodes), alphas, return_masks)
+
+@instrument.timed
+def update_disparity_filter(old_rows, old_cols, rows, cols, weights, source, probas, strength, degree, n_nodes=None):
+    """
+    Patch disparity_filter_arrays results after an edge list update (see process.update_edges).
+    source[e] is the index of edge e in the old edge list, or -1 for a new or reweighted edge.
+    Only the strengths and degrees of the endpoints of added or removed edges change,
+    so only the p_ij of the edges touching them are recomputed.
+    n_nodes defaults to the largest node id seen; pass the node count when appended nodes may have no edges.
+    Returns (probas, strength, degree) for the new edge list.
+    """
+    n_nodes = max(n_nodes or 0, len(strength), int(max(np.max(rows, initial=-1), np.max(cols, initial=-1))) + 1)
+    removed = np.ones(len(old_rows), dtype=bool)
+    removed[source[source >= 0]] = False
+    added = source < 0
+    affected = np.zeros(n_nodes, dtype=bool)
+    for endpoints in (old_rows[removed], old_cols[removed], rows[added], cols[added]):
+        affected[endpoints] = True
+
+    touching = affected[rows] | affected[cols]
+    t_rows, t_cols, t_weights = rows[touching], cols[touching], np.asarray(weights[touching], dtype=np.float64)
+    new_strength = np.zeros(n_nodes); new_strength[:len(strength)] = strength
+    new_degree = np.zeros(n_nodes, dtype=np.int64); new_degree[:len(degree)] = degree
+    new_strength[affected] = (np.bincount(t_rows, t_weights, minlength=n_nodes)
+                              + np.bincount(t_cols, t_weights, minlength=n_nodes))[affected]
+    new_degree[affected] = (np.bincount(t_rows, minlength=n_nodes) + np.bincount(t_cols, minlength=n_nodes))[affected]
+
+    new_probas = np.empty((len(rows), 2))
+    new_probas[~added] = probas[source[~added]]
+    new_probas[touching, 0] = _endpoint_probas(t_weights, new_strength[t_rows], new_degree[t_rows])
+    new_probas[touching, 1] = _endpoint_probas(t_weights, new_strength[t_cols], new_degree[t_cols])
+    return new_probas, new_strength, new_degree
+
 def neighbours_avg_degree(G, node):
+    """Average degree of a node's neighbours (for every node at once, of a CSRGraph: neighbours_avg_degrees)"""
+    if isinstance(G, CSRGraph):
+        #Degrees of the neighbours only (self-loops counted twice, as in G.degrees())
+        neighbours = G.neighbors(G.index(node))
+        loops = np.array([np.any(G.neighbors(j) == j) for j in neighbours.tolist()], dtype=np.int64)
+        return np.mean(G.indptr[neighbours + 1] - G.indptr[neighbours] + loops)
     return np.mean([G.degree(neighbour) for neighbour in G.neighbors(node)])
 
+@instrument.timed
+def neighbours_avg_degrees(G):
+    """neighbours_avg_degree of every node of a CSRGraph at once"""
+    degrees = G.degrees()
+    rows = np.repeat(np.arange(G.number_of_nodes()), np.diff(G.indptr))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.bincount(rows, degrees[G.indices], minlength=G.number_of_nodes()) / np.diff(G.indptr)
+
 def average_knn_for_k(k_nn_dict, k):
     return np.mean([data["k_nn"] for data in k_nn_dict.values() if data["degree"] == k])
 
 def average_knn(k_nn_dict):
-    k_values = np.unique([data["degree"] for data in k_nn_dict.values()])
-    k_nn_values_per_k = {k : average_knn_for_k(k_nn_dict, k) for k in k_values}
-    return k_nn_values_per_k
+    degrees = np.array([data["degree"] for data in k_nn_dict.values()])
+    k_nn = np.array([data["k_nn"] for data in k_nn_dict.values()], dtype=np.float64)
+    k_values, groups = np.unique(degrees, return_inverse=True)
+    means = np.bincount(groups, k_nn) / np.bincount(groups)
+    return dict(zip(k_values, means))
+
+@instrument.timed
+def local_profile(G, weight='weight', weight_default=1, bins=None):
+    """
+    Local structure of a graph (networkx or CSRGraph) from its edge arrays, in one pass:
+    'nodes': DataFrame (indexed by node) of degree, strength, k_nn (neighbours_avg_degree), weighted k_nn
+    (sum_j w_ij k_j / s_i) and clustering (nx.clustering);
+    'per_k': DataFrame indexed by k of the node count and the mean strength, k_nn, weighted k_nn and clustering,
+    i.e. the k_nn(k) and C(k) curves (plot.plot_values_per_k(profile["per_k"]["k_nn"])); per distinct degree,
+    or per log-spaced degree bin (k: geometric bin centre) with bins=number of bins (isolated nodes in a k=0 row either way);
+    'assortativity': Newman degree assortativity.
+    """
+    from scipy.sparse import csr_matrix
+    nodes, rows, cols, weights = _edge_arrays(G, weight, weight_default)
+    n = len(nodes)
+    degree = np.bincount(rows, minlength=n) + np.bincount(cols, minlength=n)
+    strength = np.bincount(rows, weights, minlength=n) + np.bincount(cols, weights, minlength=n)
+
+    #Each neighbour once (a self-loop makes a node its own neighbour once, as in G.neighbors)
+    loops = rows == cols
+    sources = np.concatenate((rows, cols[~loops])); targets = np.concatenate((cols, rows[~loops]))
+    target_weights = np.concatenate((weights, weights[~loops]))
+    neighbours = np.bincount(sources, minlength=n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k_nn = np.bincount(sources, degree[targets], minlength=n) / neighbours
+        k_nn_weighted = np.bincount(sources, target_weights * degree[targets], minlength=n) / strength
+
+    #Clustering from sparse triangle counts, without self-loops
+    A = csr_matrix((np.ones(len(sources) - np.count_nonzero(loops)), (sources[sources != targets], targets[sources != targets])),
+                   shape=(n, n))
+    A.sum_duplicates(); A.data[:] = 1
+    triangles = np.asarray((A @ A).multiply(A).sum(axis=1)).ravel() / 2
+    pairs = np.diff(A.indptr) * (np.diff(A.indptr) - 1) / 2
+    clustering = np.divide(triangles, pairs, out=np.zeros(n), where=pairs > 0)
+
+    node_table = pd.DataFrame({"degree": degree, "strength": strength, "k_nn": k_nn, "k_nn_weighted": k_nn_weighted,
+                               "clustering": clustering}, index=pd.Index(list(nodes), name="node"))
+    if bins is None:
+        k_values, groups = np.unique(degree, return_inverse=True)
+    else:
+        edges = np.unique(np.round(np.logspace(0, np.log10(max(degree.max(), 1) + 1), bins + 1)))
+        #Bins 1, 2, ... of the degrees >= 1; isolated nodes (degree 0) in bin 0, their own k=0 row as without bins
+        groups = np.clip(np.searchsorted(edges, degree, side='right') - 1, 0, len(edges) - 2) + 1
+        groups[degree == 0] = 0
+        used, groups = np.unique(groups, return_inverse=True)
+        lower = edges[np.maximum(used - 1, 0)]
+        k_values = np.where(used > 0, np.sqrt(lower * (edges[used] - 1).clip(min=lower)), 0)
+    counts = np.bincount(groups)
+    per_k = {"nodes": counts}
+    for column in ("strength", "k_nn", "k_nn_weighted", "clustering"):
+        values = node_table[column].to_numpy()
+        known = ~np.isnan(values)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            per_k[column] = (np.bincount(groups[known], values[known], minlength=len(counts))
+                             / np.bincount(groups[known], minlength=len(counts)))
+    per_k = pd.DataFrame(per_k, index=pd.Index(k_values, name="k"))
+
+    x = np.concatenate((degree[rows], degree[cols])).astype(np.float64)
+    y = np.concatenate((degree[cols], degree[rows])).astype(np.float64)
+    x -= x.mean() if len(x) else 0; y -= y.mean() if len(y) else 0
+    denominator = np.sqrt(np.sum(x * x) * np.sum(y * y))
+    assortativity = float(np.sum(x * y) / denominator) if denominator > 0 else np.nan
+    return {"nodes": node_table, "per_k": per_k, "assortativity": assortativity}
 
 def rich_club_approximate(G):
     """Only relevant for high degree nodes, as k -> inf !!!"""
@@ -159,7 +515,13 @@ def rich_club_approximate(G):
     rich_club_normalized = {k: v / (factor * k**2) for k, v in rich_club.items() if k > 0}
     return rich_club_normalized
 
+@instrument.timed
 def coreness(G, partition):
+    if isinstance(G, CSRGraph):
+        cores = np.zeros(G.number_of_nodes(), dtype=bool)
+        cores[[G.index(node) for node in partition[0]]] = True
+        rows, cols, _ = G.edges()
+        return int(np.count_nonzero(cores[rows] & cores[cols]))
     edges = list(G.edges())
     cores = partition[0]
     #peripheries = partition[1]
@@ -169,12 +531,21 @@ def coreness(G, partition):
             ro += 1
     return ro
 
-def coreness_corrected(G, partition):
+@instrument.timed
+def coreness_corrected(G, partition, n_samples=None, seed=1):
+    """
+    Coreness relative to a random partition with the same core size. By default a single shuffle (seed 1);
+    with n_samples, relative to the mean over that many shuffles (see nulls.coreness_ensemble for the spread and z-score).
+    """
+    if n_samples is not None:
+        from data_processing import nulls
+        return float(nulls.coreness_ensemble(G, partition, n_samples, seed)["ratio"])
     partition_randomized = random_config_communities(partition)
     ro = coreness(G, partition)
     ro_config = coreness(G, partition_randomized)
     return ro/ro_config
 
+@instrument.timed
 def extract_rich_core(G, weight='weight', weight_default = 1):
     """Returns the core/periphery structure of a weighted undirected network (see [1]).
        Code taken from Iacopo Iacopini [2], but updated the method (replacing outdated functions).
@@ -210,32 +581,61 @@ def extract_rich_core(G, weight='weight', weight_default = 1):
 
         """
     
-    if G.is_multigraph():
+    if not isinstance(G, CSRGraph) and G.is_multigraph():
         raise nx.NetworkXNotImplemented("Function only implemented for simple graphs.")
-    
-    #TODO If no weight, use degree, and in-degree for
 
-    G = G.copy()
-    
-    #Use weight = weight_default for nodes without a weight
-    weights = [d.get(weight, weight_default) for _, _, d in G.edges(data=True)]
-    minw = min(weights)
+    #TODO If no weight, use degree, and in-degree for
 
-    for u, v, data in G.edges(data=True):
-        data[weight] = data.get(weight, 1) / minw
-    
-    strength = dict(G.degree(weight="weight"))
-    ranked_nodes = sorted(strength, key=strength.get, reverse=True)
-    
-    sigmas = []
-    for i in ranked_nodes:
-        sigma_i = sum(strength[j] for j in G.neighbors(i) if strength[j] > strength[i])
-        sigmas.append(sigma_i)
-    
-    #Find r_star, the core boundary index
-    r_star = sigmas.index(max(sigmas))
-    
-    return sigmas, ranked_nodes, r_star
+    nodes, rows, cols, weights = _edge_arrays(G, weight, weight_default)
+    sigmas, ranked, r_star = rich_core_arrays(rows, cols, weights, len(nodes))
+    return sigmas.tolist(), [nodes[i] for i in ranked.tolist()], r_star
+
+def rich_core_arrays(rows, cols, weights, n_nodes):
+    """
+    extract_rich_core on an edge list (each undirected edge once), without copying the graph:
+    weights rescaled by the minimal weight, strengths by bincount, and sigma_i = sum of the strengths of the
+    neighbours j with s_j > s_i in one masked pass over the edges.
+    Returns (sigmas in rank order, node ids ranked by strength, r_star).
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    weights = weights / weights.min()
+    strength = np.bincount(rows, weights, minlength=n_nodes) + np.bincount(cols, weights, minlength=n_nodes)
+    ranked = np.argsort(-strength, kind='stable')
+    up = strength[cols] > strength[rows]
+    down = strength[rows] > strength[cols]
+    sigma = (np.bincount(rows[up], strength[cols[up]], minlength=n_nodes)
+             + np.bincount(cols[down], strength[rows[down]], minlength=n_nodes))[ranked]
+    return sigma, ranked, int(np.argmax(sigma))
+
+def windowed_profile(values, window_len=15):
+    """Means of consecutive windows of window_len values (the last one possibly partial or empty: nan), and the window starts"""
+    values = np.asarray(values, dtype=np.float64)
+    n_windows = len(values) // window_len + 1
+    padded = np.full(n_windows * window_len, np.nan)
+    padded[:len(values)] = values
+    padded = padded.reshape(n_windows, window_len)
+    counts = np.sum(~np.isnan(padded), axis=1)
+    sums = np.nansum(padded, axis=1)
+    return np.divide(sums, counts, out=np.full(n_windows, np.nan), where=counts > 0), window_len * np.arange(n_windows)
+
+@instrument.timed
+def rich_core(G, weight='weight', weight_default=1, window_len=15):
+    """
+    Rich-core analysis of a weighted undirected graph (networkx or CSRGraph) as extract_rich_core, returned as a dict:
+    'sigmas' (array, rank order), 'ranked_nodes', 'r_star', 'core' and 'periphery' (node lists, the core being
+    the nodes ranked up to r_star), 'partition' ([core, periphery]), and the denoised profile
+    'sigmas_denoised' (means over windows of window_len ranks) with the window starts 'x_values'.
+    """
+    if not isinstance(G, CSRGraph) and G.is_multigraph():
+        raise nx.NetworkXNotImplemented("Function only implemented for simple graphs.")
+    nodes, rows, cols, weights = _edge_arrays(G, weight, weight_default)
+    sigmas, ranked, r_star = rich_core_arrays(rows, cols, weights, len(nodes))
+    ranked_nodes = [nodes[i] for i in ranked.tolist()]
+    sigmas_denoised, x_values = windowed_profile(sigmas, window_len)
+    return {'sigmas': sigmas, 'ranked_nodes': ranked_nodes, 'r_star': r_star,
+            'core': ranked_nodes[:r_star + 1], 'periphery': ranked_nodes[r_star + 1:],
+            'partition': [ranked_nodes[:r_star + 1], ranked_nodes[r_star + 1:]],
+            'sigmas_denoised': sigmas_denoised, 'x_values': x_values}
 
 ### Partition comparisons
 
@@ -246,28 +646,44 @@ def community_LUT(comm_nested_list):
             lut[node] = i
     return lut
 
-def index_matrix_values(comm1, comm2):
-    #Assuming comm1 and comm2 include the same nodes
-    a00 = 0; a11 = 0; a01 = 0; a10 = 0 #PEP8 would not approve
-    comm1_lut = community_LUT(comm1)
-    comm2_lut = community_LUT(comm2)
-    if set(comm1_lut.keys()) != set(comm2_lut.keys()):
-        raise ValueError("Communities must have the same nodes")
-    nodes = list(comm1_lut.keys())
-    pairs = [(nodes[i], nodes[j]) for i in range(len(nodes)) for j in range(i+1, len(nodes))]
-    for i, j in pairs:
-        if comm1_lut[i] == comm1_lut[j]:
-            if comm2_lut[i] == comm2_lut[j]:
-                a11 += 1
-            else:
-                a10 += 1
-        else:
-            if comm2_lut[i] == comm2_lut[j]:
-                a01 += 1
-            else:
-                a00 += 1
+def _partition_labels(partitions):
+    #Label arrays of partitions (nested lists of nodes) over a common node order
+    luts = [community_LUT(comm) for comm in partitions]
+    nodes = list(luts[0].keys())
+    node_set = set(nodes)
+    for lut in luts[1:]:
+        if set(lut.keys()) != node_set:
+            raise ValueError("Communities must have the same nodes")
+    return [np.fromiter((lut[node] for node in nodes), dtype=np.int64, count=len(nodes)) for lut in luts]
+
+def _contingency(labels1, labels2):
+    #Nonzero cells n_ij of the contingency table, and its row and column sums
+    _, labels1 = np.unique(labels1, return_inverse=True)
+    _, labels2 = np.unique(labels2, return_inverse=True)
+    _, cells = np.unique(labels1 * (labels2.max(initial=0) + 1) + labels2, return_counts=True)
+    return cells, np.bincount(labels1), np.bincount(labels2)
+
+def _pairs(counts):
+    counts = np.asarray(counts, dtype=np.int64)
+    return int(np.sum(counts * (counts - 1) // 2))
+
+def _pair_counts(cells, rows, cols):
+    n = int(np.sum(rows))
+    a11 = _pairs(cells)
+    a10 = _pairs(rows) - a11
+    a01 = _pairs(cols) - a11
+    a00 = n * (n - 1) // 2 - a11 - a10 - a01
     return a00, a01, a10, a11
 
+@instrument.timed
+def index_matrix_values(comm1, comm2):
+    """
+    Pair counts of two partitions of the same nodes: a11 pairs together in both, a10 together only in comm1,
+    a01 only in comm2, a00 in neither. Computed from the contingency table of the two labelings.
+    """
+    labels1, labels2 = _partition_labels([comm1, comm2])
+    return _pair_counts(*_contingency(labels1, labels2))
+
 def rand_index(comm1, comm2):
     a00, a01, a10, a11 = index_matrix_values(comm1, comm2)
     return (a00 + a11) / (a00 + a01 + a10 + a11)
@@ -275,3 +691,49 @@ def rand_index(comm1, comm2):
 def jaccard_index(comm1, comm2):
     a00, a01, a10, a11 = index_matrix_values(comm1, comm2)
     return a11 / (a01 + a10 + a11)
+
+def _entropy(counts, n):
+    p = np.asarray(counts, dtype=np.float64) / n
+    return -np.sum(p * np.log(p))
+
+def _table_scores(cells, rows, cols):
+    a00, a01, a10, a11 = _pair_counts(cells, rows, cols)
+    total = a00 + a01 + a10 + a11
+    n = int(np.sum(rows))
+    expected = _pairs(rows) * _pairs(cols) / total if total else 0
+    maximum = (_pairs(rows) + _pairs(cols)) / 2
+    h1, h2 = _entropy(rows, n), _entropy(cols, n)
+    mutual_info = h1 + h2 - _entropy(cells, n) #I = H1 + H2 - H12, joint entropy from the nonzero cells
+    return {
+        "rand": (a00 + a11) / total if total else np.nan,
+        "jaccard": a11 / (a01 + a10 + a11) if (a01 + a10 + a11) else np.nan,
+        "adjusted_rand": (a11 - expected) / (maximum - expected) if maximum != expected else 1.0,
+        "nmi": mutual_info / ((h1 + h2) / 2) if h1 + h2 > 0 else 1.0,
+        "vi": h1 + h2 - 2 * mutual_info,
+    }
+
+def adjusted_rand_index(comm1, comm2):
+    return _table_scores(*_contingency(*_partition_labels([comm1, comm2])))["adjusted_rand"]
+
+def normalized_mutual_info(comm1, comm2):
+    """Mutual information normalized by the mean of the two entropies"""
+    return _table_scores(*_contingency(*_partition_labels([comm1, comm2])))["nmi"]
+
+def variation_of_information(comm1, comm2):
+    """H1 + H2 - 2 I, in nats"""
+    return _table_scores(*_contingency(*_partition_labels([comm1, comm2])))["vi"]
+
+@instrument.timed
+def compare_partitions(partitions):
+    """
+    All-vs-all comparison of M partitions (nested lists) of the same nodes.
+    Returns a dict of M x M arrays: 'rand', 'jaccard', 'adjusted_rand', 'nmi', 'vi'.
+    """
+    labels = _partition_labels(partitions)
+    m = len(labels)
+    scores = {name: np.zeros((m, m)) for name in ("rand", "jaccard", "adjusted_rand", "nmi", "vi")}
+    for i in range(m):
+        for j in range(i, m):
+            for name, value in _table_scores(*_contingency(labels[i], labels[j])).items():
+                scores[name][i, j] = scores[name][j, i] = value
+    return scores
@@ -0,0 +1,158 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from data_processing import parallel
+from data_processing import measures
+
+########## Null-model ensembles (degree-preserving rewiring, label shuffles)
+def rewire(rows, cols, n_nodes, n_swaps, rng, max_tries=None):
+    """
+    Degree-preserving randomization by double edge swaps (u1-v1, u2-v2 -> u1-v2, v1-u2 or u1-u2, v1-v2),
+    as nx.double_edge_swap, but proposing many swaps on distinct edges at once. Swaps creating self-loops
+    or multi-edges are rejected; stops after n_swaps accepted swaps (or max_tries proposals, 10 x n_swaps by default).
+    Returns new (rows, cols) arrays.
+    """
+    rows = np.array(rows, dtype=np.int64); cols = np.array(cols, dtype=np.int64)
+    n_edges = len(rows)
+    max_tries = 10 * n_swaps if max_tries is None else max_tries
+    keys = np.sort(np.minimum(rows, cols) * n_nodes + np.maximum(rows, cols))
+    swapped = 0; tries = 0
+    while swapped < n_swaps and tries < max_tries and n_edges >= 2:
+        k = int(min(n_edges // 2, max(n_swaps - swapped, 1), max_tries - tries))
+        chosen = rng.permutation(n_edges)[:2 * k]
+        a, b = chosen[:k], chosen[k:]
+        flip = rng.random(k) < 0.5
+        u1, v1 = rows[a], cols[a]
+        w = np.where(flip, rows[b], cols[b])
+        z = np.where(flip, cols[b], rows[b])
+        key1 = np.minimum(u1, w) * n_nodes + np.maximum(u1, w)
+        key2 = np.minimum(v1, z) * n_nodes + np.maximum(v1, z)
+        ok = (u1 != w) & (v1 != z) & (key1 != key2)
+        for key in (key1, key2):
+            position = np.minimum(np.searchsorted(keys, key), len(keys) - 1)
+            ok &= keys[position] != key
+        #The same new edge proposed twice in this batch
+        new_keys = np.concatenate((key1[ok], key2[ok]))
+        unique, counts = np.unique(new_keys, return_counts=True)
+        repeated = unique[counts > 1]
+        ok &= ~np.isin(key1, repeated) & ~np.isin(key2, repeated)
+        rows[a[ok]], cols[a[ok]] = u1[ok], w[ok]
+        rows[b[ok]], cols[b[ok]] = v1[ok], z[ok]
+        keys = np.sort(np.minimum(rows, cols) * n_nodes + np.maximum(rows, cols))
+        swapped += int(ok.sum()); tries += k
+    return rows, cols
+
+def rich_club_arrays(rows, cols, n_nodes):
+    """Unnormalized rich-club coefficients phi(k), k = 0, 1, ... (same values as nx.rich_club_coefficient(G, normalized=False))"""
+    degrees = np.bincount(rows, minlength=n_nodes) + np.bincount(cols, minlength=n_nodes)
+    nk = n_nodes - np.cumsum(np.bincount(degrees))
+    nk = nk[nk > 1]
+    edge_min = np.minimum(degrees[rows], degrees[cols])
+    ek = len(rows) - np.cumsum(np.bincount(edge_min, minlength=len(nk)))[:len(nk)]
+    if len(rows) == 0:
+        return np.zeros(0)
+    return 2 * ek / (nk * (nk - 1.0))
+
+def assortativity_arrays(rows, cols, n_nodes):
+    """Newman degree assortativity (Pearson correlation of the degrees at the two ends of the edges)"""
+    degrees = np.bincount(rows, minlength=n_nodes) + np.bincount(cols, minlength=n_nodes)
+    x = np.concatenate((degrees[rows], degrees[cols])).astype(np.float64)
+    y = np.concatenate((degrees[cols], degrees[rows])).astype(np.float64)
+    x -= x.mean(); y -= y.mean()
+    denominator = np.sqrt(np.sum(x * x) * np.sum(y * y))
+    return np.sum(x * y) / denominator if denominator > 0 else np.nan
+
+def coreness_arrays(rows, cols, cores):
+    """coreness for a boolean core mask: number of edges inside the core"""
+    return int(np.count_nonzero(cores[rows] & cores[cols]))
+
+_WORKER = {}
+
+def _init_worker(spec, n_nodes, swaps_per_edge):
+    arrays, blocks = parallel.attach_arrays(spec)
+    _WORKER.update(arrays=arrays, blocks=blocks, n_nodes=n_nodes, swaps_per_edge=swaps_per_edge)
+
+def _samples(seeds):
+    #Statistics of one null sample per seed: rewired graph (rich club, assortativity), shuffled core labels (coreness)
+    arrays, n_nodes = _WORKER["arrays"], _WORKER["n_nodes"]
+    rows, cols, cores = arrays["rows"], arrays["cols"], arrays.get("cores")
+    rich_clubs = []; assortativities = []; corenesses = []
+    for seed in seeds:
+        rng = np.random.default_rng(seed)
+        random_rows, random_cols = rewire(rows, cols, n_nodes, int(_WORKER["swaps_per_edge"] * len(rows)), rng)
+        rich_clubs.append(rich_club_arrays(random_rows, random_cols, n_nodes))
+        assortativities.append(assortativity_arrays(random_rows, random_cols, n_nodes))
+        if cores is not None:
+            corenesses.append(coreness_arrays(rows, cols, rng.permutation(cores)))
+    return np.array(rich_clubs), np.array(assortativities), np.array(corenesses)
+
+def _summary(observed, samples):
+    observed = np.asarray(observed, dtype=np.float64)
+    mean = samples.mean(axis=0); std = samples.std(axis=0, ddof=1) if len(samples) > 1 else np.zeros_like(mean)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        summary = {"observed": observed, "mean": mean, "std": std, "z": (observed - mean) / std, "ratio": observed / mean}
+    if observed.ndim == 0:
+        summary = {key: float(value) for key, value in summary.items()}
+    return summary
+
+def _core_mask(nodes, partition):
+    index = {node: i for i, node in enumerate(nodes)}
+    cores = np.zeros(len(nodes), dtype=bool)
+    cores[[index[node] for node in partition[0]]] = True
+    return cores
+
+def coreness_ensemble(G, partition, n_samples=100, seed=1):
+    """
+    The 'coreness' statistic of null_ensemble alone (the same samples for the same seed), without rewiring:
+    coreness of a [core, periphery] partition vs. n_samples random relabelings with the same core size.
+    """
+    nodes, rows, cols, _ = measures._edge_arrays(G)
+    cores = _core_mask(nodes, partition)
+    samples = np.array([coreness_arrays(rows, cols, np.random.default_rng(sample_seed).permutation(cores))
+                        for sample_seed in np.random.SeedSequence(seed).spawn(n_samples)])
+    return _summary(coreness_arrays(rows, cols, cores), samples)
+
+def null_ensemble(G, n_samples=100, partition=None, swaps_per_edge=10, n_workers=None, seed=1, batch_size=None):
+    """
+    Null-model statistics of a graph (networkx or CSRGraph) over n_samples samples computed in worker processes,
+    each with its own random stream (spawned from seed):
+    - 'rich_club': phi(k) of the graph vs. degree-preserving rewirings (swaps_per_edge * E double edge swaps);
+      'ratio' is the normalized rich-club coefficient, 'k' the degrees
+    - 'assortativity': degree assortativity vs. the same rewirings
+    - 'coreness' (if a [core, periphery] partition is given): coreness vs. random relabelings with the same core size;
+      'ratio' is the corrected coreness (see coreness_corrected)
+    Each statistic is a dict of 'observed', 'mean', 'std', 'z' (z-score) and 'ratio' (observed / mean).
+    """
+    nodes, rows, cols, _ = measures._edge_arrays(G)
+    n_nodes = len(nodes)
+    arrays = {"rows": rows, "cols": cols}
+    if partition is not None:
+        arrays["cores"] = _core_mask(nodes, partition)
+    seeds = np.random.SeedSequence(seed).spawn(n_samples)
+    n_workers = min(parallel.worker_count(n_workers), n_samples)
+    batch_size = batch_size or max(1, -(-n_samples // (4 * n_workers)))
+    batches = [seeds[i:i + batch_size] for i in range(0, n_samples, batch_size)]
+    if n_workers == 1:
+        _WORKER.update(arrays=arrays, n_nodes=n_nodes, swaps_per_edge=swaps_per_edge)
+        try:
+            results = [_samples(batch) for batch in batches]
+        finally:
+            _WORKER.clear()
+    else:
+        blocks, spec = parallel.share_arrays(arrays)
+        try:
+            with ProcessPoolExecutor(n_workers, initializer=_init_worker, initargs=(spec, n_nodes, swaps_per_edge)) as executor:
+                results = list(executor.map(_samples, batches))
+        finally:
+            parallel.release(blocks)
+
+    observed_rich_club = rich_club_arrays(rows, cols, n_nodes)
+    rich_club = _summary(observed_rich_club, np.concatenate([result[0] for result in results]))
+    rich_club["k"] = np.arange(len(observed_rich_club))
+    ensemble = {"rich_club": rich_club,
+                "assortativity": _summary(assortativity_arrays(rows, cols, n_nodes),
+                                          np.concatenate([result[1] for result in results]))}
+    if partition is not None:
+        ensemble["coreness"] = _summary(coreness_arrays(rows, cols, arrays["cores"]),
+                                        np.concatenate([result[2] for result in results]))
+    return ensemble
@@ -0,0 +1,43 @@
+import os
+import numpy as np
+from multiprocessing import shared_memory
+
+########## Shared-memory arrays for process pools
+def worker_count(n_workers=None):
+    if n_workers is None:
+        return os.cpu_count() or 1
+    return max(1, int(n_workers))
+
+def share_arrays(arrays):
+    """
+    Copy a dict of numpy arrays into shared memory blocks, so that pool workers can use them without pickling.
+    Returns (blocks, spec): keep the blocks alive in the parent and release them when done,
+    pass the (small, picklable) spec to the workers and call attach_arrays on it.
+    """
+    blocks = []; spec = {}
+    for key, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        spec[key] = (block.name, array.shape, array.dtype.str)
+    return blocks, spec
+
+def attach_arrays(spec):
+    """
+    Read-only views of arrays shared with share_arrays. Returns (arrays, blocks); keep the blocks alive while using the arrays.
+    Meant for pool workers of the sharing process, which use the same resource tracker, so the blocks are unlinked once by release.
+    """
+    arrays = {}; blocks = []
+    for key, (name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=name)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        arrays[key] = array
+        blocks.append(block)
+    return arrays, blocks
+
+def release(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
@@ -0,0 +1,134 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from data_processing import parallel
+from data_processing.csr import CSRGraph
+
+########## Shortest path statistics (batched BFS over CSR adjacency, streamed histograms)
+def _as_csr(G):
+    return G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+
+def components(G):
+    """Connected component label of every node of a CSRGraph, and the component sizes"""
+    from scipy.sparse.csgraph import connected_components
+    _, labels = connected_components(G.adjacency(weighted=False), directed=False)
+    return labels, np.bincount(labels)
+
+def largest_component(G):
+    """Subgraph of the largest connected component (networkx graphs are converted to CSRGraph)"""
+    G = _as_csr(G)
+    labels, sizes = components(G)
+    return G.subgraph(labels == np.argmax(sizes)) if len(sizes) else G
+
+def _distances(adjacency, sources):
+    from scipy.sparse.csgraph import shortest_path
+    return shortest_path(adjacency, method="D", directed=False, unweighted=True, indices=sources)
+
+def _source_statistics(adjacency, sources):
+    #Per batch of BFS sources: histogram of the lengths of paths to reachable nodes, and per source
+    #the eccentricity, sum of distances and number of reachable nodes (itself excluded)
+    distances = _distances(adjacency, sources)
+    reachable = np.isfinite(distances) & (distances > 0)
+    lengths = np.where(reachable, distances, 0).astype(np.int64)
+    histogram = np.bincount(lengths[reachable])
+    return histogram, lengths.max(axis=1, initial=0), lengths.sum(axis=1), reachable.sum(axis=1)
+
+_WORKER = {}
+
+def _init_worker(spec, n_nodes):
+    from scipy.sparse import csr_matrix
+    arrays, blocks = parallel.attach_arrays(spec)
+    adjacency = csr_matrix((np.ones(len(arrays["indices"]), dtype=np.int8), arrays["indices"], arrays["indptr"]),
+                           shape=(n_nodes, n_nodes))
+    _WORKER.update(adjacency=adjacency, blocks=blocks)
+
+def _worker_statistics(sources):
+    return _source_statistics(_WORKER["adjacency"], sources)
+
+def _traverse(G, sources, n_workers=None, batch_size=64):
+    #Run the BFS from all sources in batches (in worker processes), merging the streamed statistics
+    adjacency = G.adjacency(weighted=False)
+    batches = [sources[i:i + batch_size] for i in range(0, len(sources), batch_size)]
+    n_workers = min(parallel.worker_count(n_workers), max(len(batches), 1))
+    if n_workers == 1:
+        results = [_source_statistics(adjacency, batch) for batch in batches]
+    else:
+        blocks, spec = parallel.share_arrays({"indptr": G.indptr, "indices": G.indices})
+        try:
+            with ProcessPoolExecutor(n_workers, initializer=_init_worker, initargs=(spec, G.number_of_nodes())) as executor:
+                results = list(executor.map(_worker_statistics, batches))
+        finally:
+            parallel.release(blocks)
+    histogram = np.zeros(max((len(result[0]) for result in results), default=1), dtype=np.int64)
+    for result in results:
+        histogram[:len(result[0])] += result[0]
+    def merged(position, dtype):
+        return np.concatenate([result[position] for result in results]) if results else np.zeros(0, dtype=dtype)
+    return histogram, merged(1, np.int64), merged(2, np.int64), merged(3, np.int64)
+
+def path_statistics(G, n_sources=None, seed=1, confidence=0.95, n_workers=None, batch_size=64):
+    """
+    Shortest path statistics of a connected graph (networkx or CSRGraph; use largest_component first otherwise),
+    from one BFS pass streaming length histograms instead of materializing path lists.
+    Exact mode (n_sources=None): BFS from every node. Sampled mode: BFS from n_sources random pivots,
+    the average path length is then an estimate with a normal confidence interval.
+    Returns a dict with 'histogram' (number of ordered node pairs per path length), 'average', 'ci',
+    'diameter' (exact, or None when sampled), 'diameter_bounds' (lower, upper) and 'eccentricity' of the sources,
+    with 'sources' their node ids.
+    """
+    G = _as_csr(G)
+    n = G.number_of_nodes()
+    if n_sources is None or n_sources >= n:
+        sources = np.arange(n)
+    else:
+        sources = np.sort(np.random.default_rng(seed).choice(n, n_sources, replace=False))
+    histogram, eccentricity, sums, counts = _traverse(G, sources, n_workers, batch_size)
+    exact = len(sources) == n
+    statistics = {"histogram": histogram, "eccentricity": eccentricity, "sources": sources}
+    if exact:
+        average = histogram @ np.arange(len(histogram)) / max(histogram.sum(), 1)
+        statistics.update(average=average, ci=(average, average), diameter=int(eccentricity.max(initial=0)))
+        statistics["diameter_bounds"] = (statistics["diameter"], statistics["diameter"])
+        return statistics
+
+    from scipy.stats import norm
+    #Each source reaches the same n - 1 nodes, so the average is the mean of the per-source averages
+    per_source = sums / np.maximum(counts, 1)
+    average = per_source.mean()
+    k = len(sources)
+    standard_error = per_source.std(ddof=1) / np.sqrt(k) * np.sqrt((n - k) / (n - 1)) if k > 1 else np.inf
+    margin = norm.ppf(0.5 + confidence / 2) * standard_error
+    statistics.update(average=average, ci=(average - margin, average + margin), diameter=None,
+                      diameter_bounds=(int(eccentricity.max(initial=0)), 2 * int(eccentricity.min(initial=n))))
+    return statistics
+
+def double_sweep(G, start=None):
+    """Diameter bounds of a connected graph from two BFS: (eccentricity of the farthest node from start, 2 x ecc(start))"""
+    G = _as_csr(G)
+    adjacency = G.adjacency(weighted=False)
+    start = int(np.argmax(G.degrees())) if start is None else start
+    distances = _distances(adjacency, [start])[0]
+    farthest = int(np.argmax(distances))
+    return int(_distances(adjacency, [farthest])[0].max()), 2 * int(distances.max())
+
+def diameter(G, start=None, batch_size=64):
+    """
+    Exact diameter of a connected graph with iFUB (iterative fringe upper bound): BFS from a central node,
+    then the eccentricities of its BFS levels from the farthest inwards, until the bounds meet.
+    Usually needs far fewer BFS than the all-pairs computation.
+    """
+    G = _as_csr(G)
+    adjacency = G.adjacency(weighted=False)
+    start = int(np.argmax(G.degrees())) if start is None else start
+    levels = _distances(adjacency, [start])[0].astype(np.int64)
+    level = int(levels.max())
+    lower, upper = level, 2 * level
+    while upper > lower and level > 0:
+        fringe = np.flatnonzero(levels == level)
+        for i in range(0, len(fringe), batch_size):
+            lower = max(lower, int(_distances(adjacency, fringe[i:i + batch_size]).max()))
+        if lower > 2 * (level - 1):
+            return lower
+        upper = 2 * (level - 1)
+        level -= 1
+    return lower
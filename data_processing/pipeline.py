@@ -0,0 +1,394 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from data_processing import process
+from data_processing import measures
+from data_processing import store
+from data_processing import paths
+from data_processing import graph_io
+from data_processing import instrument
+from data_processing.csr import CSRGraph
+
+########## Stage-cached pipeline: artists.csv -> edges -> backbone -> GraphML -> analyses
+#python -m data_processing.pipeline [--alpha 0.1] [--all-years] [--similarity citizenship=0.5] [--graphml data/painters.graphml]
+#Every stage result is cached in cache_dir under a key hashing the stage's parameters and the keys of its inputs,
+#so changing a parameter only recomputes the stages downstream of it (e.g. alpha: backbone, graph, analyses).
+DEFAULTS = {
+    "csv_path": "data/artists.csv",
+    "exclude_artists": ["Nadar"], #removed after construction in painter_networks.ipynb
+    "override_active_years": True,
+    "active_years_only": True,
+    "similarity": dict(process.SIMILARITY_WEIGHTS), #coefficients of the similarity terms (process.combine_components)
+    "thresholds": np.logspace(-2, 2.16, 100).tolist(),
+    "alphas": np.logspace(-4.7, 0, 50).tolist(),
+    "alpha": 0.1,
+    "n_sources": None, #shortest path statistics: exact, or estimated from n_sources pivots
+    "figure_thresholds": [5, 20], #thresholds and alphas of the degree and clustering distribution figures
+    "figure_alphas": [0.7, 0.1],
+    "rich_club_samples": 10, #rewirings normalizing the rich-club coefficient of the knn_rich_club figure
+}
+
+def _artists(params, inputs):
+    artists = pd.read_csv(params["csv_path"])
+    return store.build_artist_store(artists), {"rows": len(artists)}
+
+def _years(params, inputs):
+    #Artists with valid years and at least one place, their years fixed (as in painter_networks.ipynb)
+    artist_store = inputs["artists"][0]
+    raw_years = store.year_matrix(artist_store)
+    has_places = np.diff(artist_store["locations_list_indptr"]) > 0
+    excluded = np.isin(artist_store["artist"], params["exclude_artists"])
+    years, valid = process.fix_years_table(raw_years, params["override_active_years"])
+    valid = np.flatnonzero(valid & has_places & ~excluded)
+    years = years[valid]
+    return {"rows": valid, "years": years}, {"artists": len(valid)}
+
+def _components(params, inputs):
+    #Similarity terms of every pair that can be linked, so edge weightings do not rebuild the pairs
+    artist_store = inputs["artists"][0]
+    valid = inputs["years"][0]
+    encoded = store.to_encoded(artist_store, valid["rows"], valid["years"])
+    *_, components = process.build_edges(encoded, n_workers=params.get("n_workers"), components=True)
+    return components, {"pairs": len(components["rows"])}
+
+def _edges(params, inputs):
+    rows, cols, weights = process.reweight_edges(inputs["components"][0], params["active_years_only"], **params["similarity"])
+    return {"rows": rows, "cols": cols, "weights": weights}, {"edges": len(rows)}
+
+def _largest_component(n_nodes, rows, cols, weights):
+    #Edges and nodes (ids) of the largest component of an edge list
+    labels, sizes = paths.components(CSRGraph.from_edges(n_nodes, rows, cols, weights))
+    kept = labels == np.argmax(sizes) if len(sizes) else np.zeros(n_nodes, dtype=bool)
+    inside = kept[rows]
+    return {"nodes": np.flatnonzero(kept), "rows": rows[inside], "cols": cols[inside], "weights": weights[inside]}
+
+def _lcc(params, inputs):
+    edges = inputs["edges"][0]
+    n_nodes = len(inputs["years"][0]["rows"])
+    lcc = _largest_component(n_nodes, edges["rows"], edges["cols"], edges["weights"])
+    return lcc, {"nodes": len(lcc["nodes"]), "edges": len(lcc["rows"])}
+
+def _threshold_sweep(params, inputs):
+    edges = inputs["edges"][0]
+    n_nodes = len(inputs["years"][0]["rows"])
+    sweep = measures.threshold_sweep_arrays(edges["rows"], edges["cols"], edges["weights"], n_nodes, params["thresholds"])
+    return sweep, {}
+
+def _disparity(params, inputs):
+    lcc = inputs["lcc"][0]
+    n_nodes = len(inputs["years"][0]["rows"])
+    probas, strength, degree = measures.disparity_filter_arrays(lcc["rows"], lcc["cols"], lcc["weights"], n_nodes)
+    return {"probas": probas, "strength": strength, "degree": degree}, {}
+
+def _disparity_sweep(params, inputs):
+    lcc = inputs["lcc"][0]
+    probas = inputs["disparity"][0]["probas"]
+    #Fractions relative to the largest component, as in the notebook (nodes renumbered within it)
+    rows, cols = np.searchsorted(lcc["nodes"], lcc["rows"]), np.searchsorted(lcc["nodes"], lcc["cols"])
+    sweep = measures.disparity_sweep_arrays(rows, cols, probas, len(lcc["nodes"]), params["alphas"])
+    return {key: value for key, value in sweep.items() if key != "masks"}, {}
+
+def _backbone(params, inputs):
+    #Disparity filter at alpha on the largest component, then the largest component of what is kept
+    lcc = inputs["lcc"][0]
+    kept = measures.disparity_backbone(inputs["disparity"][0]["probas"], params["alpha"])
+    n_nodes = len(inputs["years"][0]["rows"])
+    backbone = _largest_component(n_nodes, lcc["rows"][kept], lcc["cols"][kept], lcc["weights"][kept])
+    return backbone, {"nodes": len(backbone["nodes"]), "edges": len(backbone["rows"])}
+
+def backbone_graph(artifacts, params, node_attributes=True):
+    """CSRGraph of the backbone (artist names; the raw artists.csv rows as node attributes, as the notebook writes them)"""
+    backbone = artifacts["backbone"][0]
+    rows = np.asarray(artifacts["years"][0]["rows"])[backbone["nodes"]]
+    names = np.asarray(artifacts["artists"][0]["artist"])[rows].tolist()
+    new_ids = np.full(len(artifacts["years"][0]["rows"]), -1, dtype=np.int64)
+    new_ids[backbone["nodes"]] = np.arange(len(backbone["nodes"]))
+    attributes = None
+    if node_attributes:
+        artists = pd.read_csv(params["csv_path"]).drop(columns=["Type", "Contemporary"], errors="ignore")
+        attributes = [{"name": name, **row} for name, row in zip(names, artists.iloc[rows].to_dict("records"))]
+    return CSRGraph.from_edges(len(names), new_ids[backbone["rows"]], new_ids[backbone["cols"]], backbone["weights"],
+                               names, node_attributes=attributes)
+
+def _graph(params, inputs):
+    #Binary graph and GraphML of the backbone, written into the stage's cache directory
+    G = backbone_graph(inputs, params)
+    path = params["_stage_dir"]
+    graph_io.write_graph(G, os.path.join(path, "graph"))
+    graph_io.write_graphml(G, os.path.join(path, "painters.graphml"))
+    return {}, {"graph": os.path.join(path, "graph"), "graphml": os.path.join(path, "painters.graphml")}
+
+def _statistics(params, inputs):
+    from data_processing import nulls
+    G = backbone_graph(inputs, params, node_attributes=False)
+    rows, cols, weights = G.edges()
+    path_statistics = paths.path_statistics(G, n_sources=params["n_sources"], n_workers=params.get("n_workers"))
+    sigmas, _, r_star = measures.rich_core_arrays(rows, cols, weights, G.number_of_nodes())
+    statistics = {"nodes": G.number_of_nodes(), "edges": G.number_of_edges(),
+                  "average_weight": float(np.mean(weights)), "min_weight": float(np.min(weights)),
+                  "max_weight": float(np.max(weights)),
+                  "average_clustering": float(np.mean(measures.clustering_coefficient(G))),
+                  "assortativity": float(nulls.assortativity_arrays(rows, cols, G.number_of_nodes())),
+                  "average_shortest_path": float(path_statistics["average"]),
+                  "diameter": int(path_statistics["diameter"] if params["n_sources"] is None else paths.diameter(G)),
+                  "rich_core_size": r_star + 1}
+    return {"sigmas": sigmas}, statistics
+
+def _attributes(params, inputs):
+    #describe_measures of the backbone's artists (with the fixed years, as the notebook writes them back)
+    backbone_nodes = inputs["backbone"][0]["nodes"]
+    valid = inputs["years"][0]
+    frame = store.to_frame(inputs["artists"][0], np.asarray(valid["rows"])[backbone_nodes])
+    for i, column in enumerate(store.YEAR_COLUMNS):
+        frame[column] = np.asarray(valid["years"])[backbone_nodes, i]
+    top10s, summary = measures.describe_measures(frame, print_results=False)
+    return {}, {"summary": {key: float(value) for key, value in summary.items()}, "top10s": top10s.to_dict("list")}
+
+def _figures(params, inputs):
+    #Series of the notebook's figures (render_figures draws them): degrees and clustering of the largest component
+    #at each figure threshold, clustering of the disparity filtered largest component (isolates dropped) at each
+    #figure alpha, k_nn(k) and the normalized rich-club coefficient of the backbone
+    from data_processing import nulls
+    edges, lcc = inputs["edges"][0], inputs["lcc"][0]
+    n_nodes = len(inputs["years"][0]["rows"])
+    series = {}
+    for i, threshold in enumerate(params["figure_thresholds"]):
+        kept = edges["weights"] >= threshold
+        component = _largest_component(n_nodes, edges["rows"][kept], edges["cols"][kept], edges["weights"][kept])
+        G = CSRGraph.from_edges(n_nodes, component["rows"], component["cols"], component["weights"])
+        series[f"threshold_degrees_{i}"] = G.degrees()[component["nodes"]]
+        series[f"threshold_clustering_{i}"] = measures._local_clustering(G)[component["nodes"]]
+    for i, alpha in enumerate(params["figure_alphas"]):
+        kept = measures.disparity_backbone(inputs["disparity"][0]["probas"], alpha)
+        rows, cols = lcc["rows"][kept], lcc["cols"][kept]
+        G = CSRGraph.from_edges(n_nodes, rows, cols, lcc["weights"][kept])
+        series[f"disparity_clustering_{i}"] = measures._local_clustering(G)[np.unique(np.concatenate((rows, cols)))]
+    G = backbone_graph(inputs, params, node_attributes=False)
+    per_k = measures.local_profile(G)["per_k"]
+    rich_club = nulls.null_ensemble(G, n_samples=params["rich_club_samples"], n_workers=params.get("n_workers"),
+                                    seed=1104)["rich_club"]
+    known = np.isfinite(rich_club["ratio"])
+    series.update(knn_k=per_k.index.to_numpy(), knn=per_k["k_nn"].to_numpy(),
+                  rich_club_k=rich_club["k"][known], rich_club=rich_club["ratio"][known])
+    return series, {"thresholds": list(params["figure_thresholds"]), "alphas": list(params["figure_alphas"])}
+
+def figure_specs(artifacts, fit_cache_dir=None, n_workers=None):
+    """
+    plot.render_figures specs of the notebook's pipeline figures (images/threshold_fractions.png, threshold_edges_lcc,
+    degree_distributions, cc_distribution_thresholds, disparity_fractions, cc_distribution_disparities, knn_rich_club)
+    from the threshold_sweep, disparity_sweep and figures stages. The degree distributions are fitted here
+    (degree_fits.fit_many, cached in fit_cache_dir), so the render workers only draw.
+    """
+    from data_processing import degree_fits
+    thresholds, threshold_sweep = artifacts["threshold_sweep"][0]["thresholds"], artifacts["threshold_sweep"][0]
+    alphas, disparity_sweep = artifacts["disparity_sweep"][0]["alphas"], artifacts["disparity_sweep"][0]
+    series, meta = artifacts["figures"]
+
+    def fractions(x, sweep, xlabel, invert_xaxis=False):
+        panels = [("edges_fraction", "Fraction of edges above threshold", "Fraction of edges", [0.001, 0.01, 0.1, 1]),
+                  ("nodes_fraction", "Fraction of nodes above threshold", "Fraction of nodes", [0.01, 0.1, 1]),
+                  ("fraction_of_fractions", "Fraction of fraction of nodes / fraction of edges", "Fraction of fractions",
+                   [0.01, 0.1, 1])]
+        return [{"plot": "plot_fraction", "ax": i, "invert_xaxis": invert_xaxis,
+                 "kwargs": {"thresholds": x, "fractions": sweep[key], "title": title, "xlabel": xlabel, "ylabel": ylabel,
+                            "yticks": np.array(yticks)}}
+                for i, (key, title, ylabel, yticks) in enumerate(panels)]
+
+    def clustering(prefix, values, label):
+        return [{"plot": "plot_CC_distribution_hist", "ax": i,
+                 "kwargs": {"clustering_coefficients": series[f"{prefix}_{i}"]},
+                 "set": {"title": f"Clustering coefficient distribution: {label} {value:g}"}}
+                for i, value in enumerate(values)]
+
+    degrees = [series[f"threshold_degrees_{i}"] for i in range(len(meta["thresholds"]))]
+    fits = degree_fits.fit_many(degrees, n_workers=n_workers, cache_dir=fit_cache_dir)
+    pair = {"figsize": (14, 6), "layout": (1, 2)}
+    return [
+        {"name": "threshold_fractions", "figsize": (15, 5), "layout": (1, 3),
+         "panels": fractions(thresholds, threshold_sweep, "Threshold")},
+        {"name": "threshold_edges_lcc", **pair,
+         "panels": [{"plot": "plot_threshold_sizes_regions", "ax": [0, 1],
+                     "kwargs": {"thresholds": thresholds, "more_than_threshold": threshold_sweep["edges"],
+                                "largest_component_sizes": threshold_sweep["largest_component"]}}]},
+        {"name": "degree_distributions", "figsize": (14, 6), "layout": (1, len(degrees)),
+         "panels": [{"plot": "plot_deg_dist_fit_log_single_pdf", "ax": i, "kwargs": {"degrees": degrees[i], "fit": fit}}
+                    for i, fit in enumerate(fits)]},
+        {"name": "cc_distribution_thresholds", **pair,
+         "panels": clustering("threshold_clustering", meta["thresholds"], "Threshold")},
+        {"name": "disparity_fractions", "figsize": (15, 5), "layout": (1, 3),
+         "panels": fractions(alphas, disparity_sweep, "Alpha", invert_xaxis=True)},
+        {"name": "cc_distribution_disparities", **pair,
+         "panels": clustering("disparity_clustering", meta["alphas"], "Alpha")},
+        {"name": "knn_rich_club", **pair,
+         "panels": [{"plot": "plot_values_per_k", "ax": 0,
+                     "kwargs": {"k_nn_values_per_k": dict(zip(series["knn_k"].tolist(), series["knn"].tolist()))}},
+                    {"plot": "plot_values_per_k", "ax": 1,
+                     "kwargs": {"k_nn_values_per_k": dict(zip(series["rich_club_k"].tolist(), series["rich_club"].tolist())),
+                                "yscale": "linear", "title": "Rich club coefficient", "ylabel": "Rich club coefficient"}}]},
+    ]
+
+#Stage -> (function, input stages, parameters in its key)
+STAGES = {
+    "artists": (_artists, [], ["csv_path"]),
+    "years": (_years, ["artists"], ["exclude_artists", "override_active_years"]),
+    "components": (_components, ["artists", "years"], []),
+    "edges": (_edges, ["components"], ["active_years_only", "similarity"]),
+    "lcc": (_lcc, ["edges", "years"], []),
+    "threshold_sweep": (_threshold_sweep, ["edges", "years"], ["thresholds"]),
+    "disparity": (_disparity, ["lcc", "years"], []),
+    "disparity_sweep": (_disparity_sweep, ["lcc", "disparity"], ["alphas"]),
+    "backbone": (_backbone, ["lcc", "disparity", "years"], ["alpha"]),
+    "graph": (_graph, ["backbone", "years", "artists"], ["csv_path"]),
+    "statistics": (_statistics, ["backbone", "years", "artists"], ["n_sources"]),
+    "attributes": (_attributes, ["backbone", "years", "artists"], []),
+    "figures": (_figures, ["edges", "lcc", "disparity", "backbone", "years", "artists"],
+                ["figure_thresholds", "figure_alphas", "rich_club_samples"]),
+}
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _required(targets):
+    #The targets and all their upstream stages, in dependency order
+    order = []
+    def visit(stage):
+        if stage not in order:
+            for upstream in STAGES[stage][1]:
+                visit(upstream)
+            order.append(stage)
+    for target in targets:
+        visit(target)
+    return order
+
+def stage_keys(params, stages=None):
+    """Cache key of each stage: hash of its parameters (the csv contents for 'artists') and of its inputs' keys"""
+    keys = {}
+    for stage in _required(stages or list(STAGES)):
+        _, upstream, names = STAGES[stage]
+        content = {"stage": stage, "params": {name: params[name] for name in names},
+                   "inputs": {name: keys[name] for name in upstream}}
+        if stage == "artists":
+            content["csv"] = _file_digest(params["csv_path"])
+        keys[stage] = hashlib.sha1(json.dumps(content, sort_keys=True).encode()).hexdigest()[:16]
+    return keys
+
+def run_pipeline(params=None, targets=None, cache_dir="data/cache/pipeline", force=(), n_workers=None, verbose=True):
+    """
+    Run the stages needed for targets (all by default) with params (updating DEFAULTS), reusing cached results.
+    Stages whose inputs are ready run concurrently in a thread pool (the heavy stages use process pools themselves);
+    stages in force are recomputed even if cached.
+    Returns {stage: (arrays, meta)}, arrays memory-mapped from the cache.
+    """
+    params = {**DEFAULTS, **(params or {}), "n_workers": n_workers}
+    stages = _required(targets or list(STAGES))
+    keys = stage_keys(params, stages)
+    directories = {stage: os.path.join(cache_dir, stage, keys[stage]) for stage in stages}
+    cached = {stage for stage in stages
+              if stage not in force and os.path.exists(os.path.join(directories[stage], "meta.json"))}
+    #Cached stages are loaded only if a stage to compute needs them
+    to_run = [stage for stage in stages if stage not in cached]
+    needed = set(to_run) | {upstream for stage in to_run for upstream in STAGES[stage][1]} | set(targets or stages)
+    artifacts = {}
+
+    def load(stage):
+        arrays, meta = store.load_arrays(directories[stage])
+        meta.pop("keys", None)
+        return arrays, meta
+
+    def compute(stage):
+        function, upstream, _ = STAGES[stage]
+        start = time.perf_counter()
+        path = directories[stage]
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        with instrument.stage(f"pipeline.{stage}"):
+            arrays, meta = function({**params, "_stage_dir": path}, {name: artifacts[name] for name in upstream})
+        meta = {**meta, "stage": stage, "key": keys[stage], "seconds": time.perf_counter() - start}
+        store.save_arrays(path, arrays, meta)
+        if verbose:
+            print(f"{stage}: computed in {meta['seconds']:.2f} s", file=sys.stderr)
+        return load(stage)
+
+    for stage in stages:
+        if stage in cached and stage in needed:
+            artifacts[stage] = load(stage)
+            if verbose:
+                print(f"{stage}: cached ({keys[stage]})", file=sys.stderr)
+    with ThreadPoolExecutor(max(len(to_run), 1)) as executor:
+        running = {}
+        pending = list(to_run)
+        while pending or running:
+            for stage in [stage for stage in pending if all(name in artifacts for name in STAGES[stage][1])]:
+                pending.remove(stage)
+                running[executor.submit(compute, stage)] = stage
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                artifacts[running.pop(future)] = future.result()
+    return {stage: artifacts[stage] for stage in stages if stage in artifacts}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and analyse the painter network, reusing cached stages")
+    parser.add_argument("--csv", default=DEFAULTS["csv_path"], help="artists table (PainterPalette artists.csv)")
+    parser.add_argument("--all-years", action="store_true", help="weight edges by common lifetime years, not active years")
+    parser.add_argument("--similarity", nargs="*", default=[], metavar="TERM=COEFFICIENT",
+                        help=f"similarity coefficients, of {', '.join(process.SIMILARITY_WEIGHTS)} (e.g. citizenship=0.5)")
+    parser.add_argument("--alpha", type=float, default=DEFAULTS["alpha"], help="disparity filter significance of the backbone")
+    parser.add_argument("--exclude", nargs="*", default=DEFAULTS["exclude_artists"], help="artists left out")
+    parser.add_argument("--n-sources", type=int, default=None, help="estimate path statistics from this many pivots")
+    parser.add_argument("--targets", nargs="*", default=None, choices=list(STAGES), help="stages to bring up to date")
+    parser.add_argument("--force", nargs="*", default=[], choices=list(STAGES), help="stages recomputed even if cached")
+    parser.add_argument("--workers", type=int, default=None, help="processes for the parallel stages")
+    parser.add_argument("--cache-dir", default="data/cache/pipeline")
+    parser.add_argument("--graphml", default=None, help="copy the backbone GraphML here (e.g. data/painters.graphml)")
+    parser.add_argument("--trace", default=None, help="record the run and save it as a Chrome trace (chrome://tracing)")
+    parser.add_argument("--figures", default=None, help="render the notebook's pipeline figures into this directory (e.g. images)")
+    args = parser.parse_args(argv)
+
+    similarity = {**process.SIMILARITY_WEIGHTS}
+    for item in args.similarity:
+        term, _, coefficient = item.partition("=")
+        if term not in similarity:
+            parser.error(f"unknown similarity term: {term}")
+        similarity[term] = float(coefficient)
+    params = {"csv_path": args.csv, "active_years_only": not args.all_years, "similarity": similarity, "alpha": args.alpha,
+              "exclude_artists": args.exclude, "n_sources": args.n_sources}
+    targets = args.targets or list(STAGES)
+    if args.graphml and "graph" not in targets:
+        targets = targets + ["graph"]
+    if args.figures:
+        targets = targets + [stage for stage in ("threshold_sweep", "disparity_sweep", "figures") if stage not in targets]
+    if args.trace:
+        with instrument.session(sampling_interval=0.01):
+            artifacts = run_pipeline(params, targets, args.cache_dir, args.force, args.workers)
+        instrument.export_chrome_trace(args.trace)
+        instrument.export_json(os.path.splitext(args.trace)[0] + ".report.json")
+    else:
+        artifacts = run_pipeline(params, targets, args.cache_dir, args.force, args.workers)
+    if args.graphml:
+        shutil.copyfile(artifacts["graph"][1]["graphml"], args.graphml)
+    if args.figures:
+        from data_processing import plot
+        specs = figure_specs(artifacts, os.path.join(args.cache_dir, "degree_fits"), args.workers)
+        for path in plot.render_figures(specs, args.figures, args.workers):
+            print(f"figure: {path}", file=sys.stderr)
+    for stage in ("statistics", "attributes"):
+        if stage in artifacts:
+            meta = {key: value for key, value in artifacts[stage][1].items() if key not in ("stage", "key", "seconds", "top10s")}
+            print(stage, json.dumps(meta, indent=1))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,30 @@
-import matplotlib.pyplot as plt
+import os
+import importlib
 import numpy as np
-from matplotlib.ticker import FuncFormatter
-import powerlaw as pwl
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
+from data_processing import parallel
+from data_processing import instrument
+from data_processing import degree_fits
 
+class _LazyModule:
+    """A module imported on its first attribute access (plt.subplots imports matplotlib.pyplot then)"""
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+#matplotlib and powerlaw (with scipy and mpmath) take seconds to import and compute workers never need them
+plt = _LazyModule("matplotlib.pyplot")
+ticker = _LazyModule("matplotlib.ticker")
+pwl = _LazyModule("powerlaw")
+
+@instrument.timed
 def plot_deg_distr_lin(degrees, ax=None, label_turnoff = False, ticks_list = None):
     deg_distri=Counter(degrees)
     keys, values = zip(*sorted(deg_distri.items()))
@@ -32,11 +52,13 @@ def plot_deg_distr_lin(degrees, ax=None, label_turnoff = False, ticks_list = Non
             ax.set_ylabel('Frequency', )
         return ax
     
+@instrument.timed
 def plot_deg_distr_linandlog(degrees, ax=None):
     deg_distri=Counter(degrees)
     keys, values = zip(*sorted(deg_distri.items()))
 
     #This case is easier, we will use axes anyways, just a difference in whether the function creates them or not
+    created = ax is None
     if ax is None:
         fig, ax = plt.subplots(1, 2, figsize=(12,6))
 
@@ -70,69 +92,70 @@ def plot_deg_distr_linandlog(degrees, ax=None):
     second_ax.set_xlabel('Degree ($k$)', fontsize=22)
     second_ax.set_ylabel('$P(k)$', fontsize=22)
 
+    fig = first_ax.figure
     fig.suptitle('Degree Distribution', fontsize=22)
     # Show the figure
-    plt.tight_layout()
-    if ax is None:
+    fig.tight_layout()
+    if created:
         plt.show()
     return ax
 
-def plot_deg_dist_fit_log_single(degrees, ax=None, label_ignore=False):
-    deg_distri=Counter(degrees)
-    fit_f = pwl.Fit(degrees)
-    
-    x=[]; y=[]
-    for i in sorted(deg_distri):   
-        x.append(i); y.append(deg_distri[i]/len(degrees))
+@instrument.timed
+def plot_deg_dist_fit_log_single(degrees, ax=None, label_ignore=False, fit=None):
+    #fit: a degree_fits.DegreeFit of degrees (fitted, or taken from the session's fits, if not given)
+    if fit is None:
+        fit = degree_fits.fit_degrees(degrees)
 
     if ax is None:
         fig = plt.figure(figsize=(6,6))
         ax = fig.add_subplot(111)
 
-    ax.plot(x, y, 'ro')
-    pwl.plot_pdf(degrees, color='black', linewidth=2, ax=ax)
+    ax.plot(fit.degrees, fit.counts / fit.n, 'ro')
+    ax.plot(fit.pdf_x, fit.pdf_y, color='black', linewidth=2)
     ax.set_xscale('log')
     ax.set_yscale('log')
     if not label_ignore:
         ax.set_xlabel('Degree ($k$)')
         ax.set_ylabel('$P(k)$')
         ax.set_title("Degree distribution")
-    fit_f.power_law.plot_pdf(ax=ax, color='b', linestyle='-', linewidth=1, label='fit')
-    plt.text(0.05, 0.95, rf'$\alpha={fit_f.power_law.alpha:.2f}, xmin={fit_f.power_law.xmin:.2f}$')
-    #print(fit_f.power_law.alpha, fit_f.power_law.xmin)
+    ax.plot(fit.fit_x, fit.fit_y, color='b', linestyle='-', linewidth=1, label='fit')
+    ax.text(0.05, 0.95, rf'$\alpha={fit.alpha:.2f}, xmin={fit.xmin:.2f}$')
+    #print(fit.alpha, fit.xmin)
 
-def plot_deg_dist_fit_log(degrees_list, label_ignore_list=None):
+@instrument.timed
+def plot_deg_dist_fit_log(degrees_list, label_ignore_list=None, fits=None, n_workers=None):
+    #fits: DegreeFits of degrees_list; by default fitted together in parallel (degree_fits.fit_many)
     if label_ignore_list is None:
         label_ignore_list = [False] * len(degrees_list)
+    if fits is None:
+        fits = degree_fits.fit_many(degrees_list, n_workers=n_workers)
 
     n = len(degrees_list)
     if n == 1:
-        plot_deg_dist_fit_log_single(degrees_list[0], label_ignore=label_ignore_list[0])
+        plot_deg_dist_fit_log_single(degrees_list[0], label_ignore=label_ignore_list[0], fit=fits[0])
         #return something
     else:
         rows = (n + 1) // 2
         fig, axes = plt.subplots(rows, 2, figsize=(12, 6*rows))
         axes = axes.flatten()
         for i, degrees in enumerate(degrees_list):
-            plot_deg_dist_fit_log_single(degrees, ax=axes[i], label_ignore=label_ignore_list[i])
-        plt.tight_layout()
+            plot_deg_dist_fit_log_single(degrees, ax=axes[i], label_ignore=label_ignore_list[i], fit=fits[i])
+        fig.tight_layout()
         #plt.show()
         return fig, axes
     
-def plot_deg_dist_fit_log_single_pdf(degrees, ax=None, label_ignore=False, return_fit = False): #Added a label ignore for other cases, not just for analysis in this notebook
-    deg_distri=Counter(degrees)
-    fit_f = pwl.Fit(degrees)
-    
-    x=[]; y=[]
-    for i in sorted(deg_distri):   
-        x.append(i); y.append(deg_distri[i]/len(degrees))
+@instrument.timed
+def plot_deg_dist_fit_log_single_pdf(degrees, ax=None, label_ignore=False, return_fit = False, fit=None): #Added a label ignore for other cases, not just for analysis in this notebook
+    #fit: a degree_fits.DegreeFit of degrees (fitted, or taken from the session's fits, if not given); return_fit returns it
+    if fit is None:
+        fit = degree_fits.fit_degrees(degrees)
     
     if ax is None:
         fig = plt.figure(figsize=(8,8))
         ax = fig.add_subplot(111)
 
-    ax.plot(x, y, 'bo', markersize=5, label='Data') #Smaller size for prettiness
-    pwl.plot_pdf(degrees, color='black', linewidth=2, ax=ax, label='Probability density function')
+    ax.plot(fit.degrees, fit.counts / fit.n, 'bo', markersize=5, label='Data') #Smaller size for prettiness
+    ax.plot(fit.pdf_x, fit.pdf_y, color='black', linewidth=2, label='Probability density function')
     ax.set_xscale('log')
     ax.set_yscale('log')
     if not label_ignore:
@@ -144,8 +167,9 @@ def plot_deg_dist_fit_log_single_pdf(degrees, ax=None, label_ignore=False, retur
     ax.set_ylim([0.0001,0.1])
 
     if return_fit:
-        return fit_f
+        return fit
 
+@instrument.timed
 def measure_measure_scatter(values1, values2, ax=None, xlabel=None, ylabel=None, title=None):
     if ax is None:
         fig, ax = plt.subplots(figsize=(6,6))
@@ -155,27 +179,33 @@ def measure_measure_scatter(values1, values2, ax=None, xlabel=None, ylabel=None,
     ax.set_title(title)
     return ax
 
-def plot_fraction(thresholds, fractions, title, xlabel, ylabel, vspan_intervals=None, yticks=None, xticks=None):
+@instrument.timed
+def plot_fraction(thresholds, fractions, title, xlabel, ylabel, vspan_intervals=None, yticks=None, xticks=None, ax=None):
+    #ax: the current axes (plt.subplot) by default
+    if ax is None:
+        ax = plt.gca()
 
-    plt.scatter(thresholds, fractions, color='blue')
-    plt.yscale('log')
-    plt.xscale('log')
+    ax.scatter(thresholds, fractions, color='blue')
+    ax.set_yscale('log')
+    ax.set_xscale('log')
     
-    plt.title(title)
-    plt.xlabel(xlabel)
-    plt.ylabel(ylabel)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
     
     if yticks is not None:
-        plt.yticks(yticks)
+        ax.set_yticks(yticks)
     if xticks is not None:
-        plt.xticks(xticks)
+        ax.set_xticks(xticks)
     
     if vspan_intervals is not None:
         for interval0, interval1, color, label in vspan_intervals:
-            plt.axvspan(interval0, interval1, color=color, alpha=0.3, label=label)
-        plt.legend()
+            ax.axvspan(interval0, interval1, color=color, alpha=0.3, label=label)
+        ax.legend()
+    return ax
 
 
+@instrument.timed
 def plot_threshold_sizes_regions(
     thresholds,
     more_than_threshold,
@@ -189,17 +219,22 @@ def plot_threshold_sizes_regions(
     edge_yticks=np.array([1, 10, 100, 1000, 10000, 100000, 200000]),
     component_yticks=np.array([1, 10, 100, 1000, 4000]),
     figsize=(14, 6),
+    ax=None,
 ):
     """
     Draws a figure, with two plots on edge weight threshold and size connections:
     1. Number of edges above threshold
     2. Largest connected component size
+    ax: two axes to draw on instead of a new figure
     """
     
     def format_yticks(tick_val, pos):
         return int(tick_val)
     
-    fig, ax = plt.subplots(1, 2, figsize=figsize)
+    if ax is None:
+        fig, ax = plt.subplots(1, 2, figsize=figsize)
+    else:
+        fig = ax[0].figure
 
     ax[0].scatter(thresholds, more_than_threshold, color='blue')
     ax[0].set_yscale('log')
@@ -213,7 +248,7 @@ def plot_threshold_sizes_regions(
     ax[0].set_ylabel('No. of edges')
     ax[0].set_yticks(edge_yticks)
     ax[0].axhline(y=edge_threshold, xmin=0.0001, xmax=1, color='green', linestyle='--')
-    ax[0].yaxis.set_major_formatter(FuncFormatter(format_yticks))
+    ax[0].yaxis.set_major_formatter(ticker.FuncFormatter(format_yticks))
     ax[0].legend()
 
     ax[1].scatter(thresholds, largest_component_sizes, color='orange')
@@ -228,12 +263,14 @@ def plot_threshold_sizes_regions(
     ax[1].set_ylabel('Component size')
     ax[1].set_yticks(component_yticks)
     ax[1].axhline(y=component_size_threshold, xmin=0.0001, xmax=1, color='green', linestyle='--')
-    ax[1].yaxis.set_major_formatter(FuncFormatter(format_yticks))
+    ax[1].yaxis.set_major_formatter(ticker.FuncFormatter(format_yticks))
     ax[1].legend()
 
-    plt.tight_layout()
+    fig.tight_layout()
     #plt.show()
+    return fig, ax
 
+@instrument.timed
 def plot_CC_distribution_hist(clustering_coefficients, ax):
     ax.hist(clustering_coefficients, bins=np.linspace(0, 1, 21), density=True, alpha=0.75)
     ax.set_xlabel("Clustering coefficient")
@@ -241,19 +278,24 @@ def plot_CC_distribution_hist(clustering_coefficients, ax):
     ax.set_title("Clustering coefficient distribution")
     ax.set_xlim(0, 1)
 
+@instrument.timed
 def plot_values_per_k(k_nn_values_per_k, ax=None, xscale="log", yscale="log",
                       title="Average neighbor's neighbour degree per node degree",
                       ylabel="Average neighbor's neighbour degree"):
     """Intended to use with a dictionary, for these purposes:
        - either {k: average_knn_for_k(k_nn_dict, k)}
        - or nx.rich_club_coefficient(G)
+       - or a column of measures.local_profile(G)["per_k"] (a pandas Series indexed by k)
        """
     if ax is None:
         fig, ax = plt.subplots(figsize=(10, 6))
     else:
         fig = None
 
-    ax.plot(list(k_nn_values_per_k.keys()), list(k_nn_values_per_k.values()), 'o')
+    if hasattr(k_nn_values_per_k, "index"):
+        ax.plot(k_nn_values_per_k.index.to_numpy(), k_nn_values_per_k.to_numpy(), 'o')
+    else:
+        ax.plot(list(k_nn_values_per_k.keys()), list(k_nn_values_per_k.values()), 'o')
     ax.set_xlabel("Node degree ($k$)")
     ax.set_ylabel(ylabel)
     ax.set_xscale(xscale)
@@ -262,3 +304,48 @@ def plot_values_per_k(k_nn_values_per_k, ax=None, xscale="log", yscale="log",
     
     if fig is not None:
         plt.show()
+
+########## Headless batch rendering: figures from precomputed series, drawn in worker processes on the Agg backend
+#A figure spec is a dict: "name" (file name without extension), "figsize", "layout" (rows, columns), "suptitle",
+#and "panels", each {"plot": a plot function's name, "kwargs": its arguments, "ax": axes index (or list of indices,
+#as plot_threshold_sizes_regions takes), "set": Axes.set arguments applied after, "invert_xaxis": bool}.
+#    render_figures([{"name": "cc_distribution", "figsize": (7, 6),
+#                     "panels": [{"plot": "plot_CC_distribution_hist", "kwargs": {"clustering_coefficients": cc}}]}])
+#Figures are matplotlib.figure.Figure objects drawn through their axes only, so no pyplot state is shared or shown.
+def _init_render_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+
+def _render(task):
+    from matplotlib.figure import Figure
+    spec, path, dpi = task
+    fig = Figure(figsize=spec.get("figsize", (6.4, 4.8)))
+    axes = fig.subplots(*spec.get("layout", (1, 1)), squeeze=False).ravel()
+    for panel in spec["panels"]:
+        index = panel.get("ax", 0)
+        ax = [axes[i] for i in index] if isinstance(index, (list, tuple)) else axes[index]
+        globals()[panel["plot"]](**panel.get("kwargs", {}), ax=ax)
+        for panel_ax in (ax if isinstance(ax, list) else [ax]):
+            panel_ax.set(**panel.get("set", {}))
+            if panel.get("invert_xaxis"):
+                panel_ax.invert_xaxis()
+    if spec.get("suptitle"):
+        fig.suptitle(spec["suptitle"])
+    fig.savefig(path, dpi=dpi)
+    return path
+
+@instrument.timed
+def render_figures(specs, out_dir="images", n_workers=None, dpi=100, format="png"):
+    """
+    Render figure specs (see above) to out_dir/<name>.<format>, one figure per task in a pool of n_workers processes
+    (in this process with one worker). Panels get precomputed series: pass degree distributions with their
+    degree_fits.DegreeFit (fit=...) so that workers do not refit. Returns the paths written.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    tasks = [(spec, os.path.join(out_dir, f"{spec['name']}.{format}"), dpi) for spec in specs]
+    n_workers = min(parallel.worker_count(n_workers), max(len(tasks), 1))
+    if n_workers == 1:
+        #Figure objects do not need the pyplot backend, which is left as it is (e.g. inline in a notebook)
+        return [_render(task) for task in tasks]
+    with ProcessPoolExecutor(n_workers, initializer=_init_render_worker) as executor:
+        return list(executor.map(_render, tasks))
@@ -1,4 +1,12 @@
 import numpy as np
+import networkx as nx
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from data_processing import parallel
+from data_processing import instrument
+from data_processing import measures
+from data_processing import store
 
 ########## Network creation (Network based on similarities between artists)
 def years_validity(years):
@@ -16,7 +24,7 @@ def years_validity(years):
 
 def fix_years(years, override_active_years = True, check_years = True, return_all_nan=False): #Birth, first active year, last active year, death
     if check_years:
-        if years_validity(years):
+        if not years_validity(years):
             if return_all_nan:
                 return [np.nan, np.nan, np.nan, np.nan]
             else:
@@ -40,6 +48,137 @@ def fix_years(years, override_active_years = True, check_years = True, return_al
     #Sort just in case
     return sorted(years)
 
+def years_validity_table(years):
+    """years_validity of every row of an (N, 4) array of birth, first active, last active and death years"""
+    birth, first, last, death = np.asarray(years, dtype=np.float64).reshape(-1, 4).T
+    with np.errstate(invalid="ignore"):
+        return ~(np.isnan(birth) & np.isnan(first)) & ~(np.isnan(last) & np.isnan(death)) \
+               & ~(birth > death) & ~(birth + 130 < death)
+
+@instrument.timed
+def fix_years_table(years, override_active_years=True):
+    """
+    fix_years of every row of an (N, 4) array of birth, first active, last active and death years, as array operations.
+    Returns (repaired years, sorted per row, valid: years_validity of the raw rows); invalid rows are not meaningful.
+    """
+    years = np.array(years, dtype=np.float64).reshape(-1, 4)
+    valid = years_validity_table(years)
+    birth, first, last, death = years.T #views, imputed in the order of fix_years
+    np.copyto(birth, first - 20, where=np.isnan(birth))
+    np.copyto(first, birth + 20, where=np.isnan(first))
+    np.copyto(last, death, where=np.isnan(last))
+    np.copyto(death, last, where=np.isnan(death))
+    if override_active_years:
+        with np.errstate(invalid="ignore"):
+            np.copyto(last, death, where=last > death)
+            np.copyto(first, birth, where=first < birth)
+    return np.sort(years, axis=1), valid
+
+def fix_artist_years(artists_df, rows=None, override_active_years=True):
+    """
+    Repair the year columns of an artists DataFrame in place (fix_years_table), in one assignment,
+    for the rows (positions, or a boolean mask) that are also valid; all rows by default.
+    Returns the validity mask of all rows.
+    """
+    years, valid = fix_years_table(artists_df[store.YEAR_COLUMNS].to_numpy(dtype=np.float64), override_active_years)
+    update = valid.copy()
+    if rows is not None:
+        selected = np.zeros(len(valid), dtype=bool)
+        selected[rows] = True
+        update &= selected
+    artists_df.loc[artists_df.index[update], store.YEAR_COLUMNS] = years[update]
+    return valid
+
+
+########## Candidate pairs (artists whose lifespans overlap)
+def shared_keys(encoded):
+    """
+    Offsets and codes of the keys through which two encoded artists can get a nonzero similarity:
+    places, birthplace, citizenship, and nationalities of artists with a known citizenship
+    (get_loc_similarity only gives nationality credit when both citizenships are known).
+    """
+    n = len(encoded["years"])
+    artists = []; keys = []; offset = 0
+    for field in ("places", "nationalities"):
+        counts = np.diff(encoded[f"{field}_indptr"])
+        field_artists = np.repeat(np.arange(n), counts)
+        field_keys = encoded[f"{field}_codes"].astype(np.int64) + offset
+        if field == "nationalities":
+            known = encoded["citizenship"][field_artists] >= 0
+            field_artists, field_keys = field_artists[known], field_keys[known]
+        artists.append(field_artists); keys.append(field_keys)
+        offset += len(encoded[f"{field}_vocab"])
+    for field in ("birthplace", "citizenship"):
+        codes = encoded[field]
+        known = np.flatnonzero(codes >= 0)
+        artists.append(known); keys.append(codes[known].astype(np.int64) + offset)
+        offset += len(encoded[f"{field}_vocab"])
+    artists = np.concatenate(artists); keys = np.concatenate(keys)
+    order = np.lexsort((keys, artists))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(artists, minlength=n))
+    return indptr, keys[order]
+
+def _pair_sweep(years, keys=None):
+    #Sweep-line index: entries (artist, key) sorted by key, then birth year. The partners of entry k are the
+    #following entries of the same key born before the artist of k died, i.e. entries k+1 ... end[k]-1
+    years = np.asarray(years, dtype=np.float64)
+    birth, death = years[:, 0], years[:, 3]
+    if keys is None:
+        artists = np.arange(len(years)); groups = np.zeros(len(years), dtype=np.int64)
+    else:
+        indptr, codes = keys
+        artists = np.repeat(np.arange(len(years)), np.diff(indptr)); groups = codes
+    order = np.lexsort((birth[artists], groups))
+    artists, groups = artists[order], groups[order]
+    base = birth.min() if len(birth) else 0
+    span = max(np.max(birth, initial=0), np.max(death, initial=0)) - base + 2
+    position = groups * span + (birth[artists] - base)
+    end = np.searchsorted(position, groups * span + (death[artists] - base), side="left")
+    counts = np.maximum(end - np.arange(len(artists)) - 1, 0)
+    offsets = np.zeros(len(artists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+    return {"artists": artists, "groups": groups, "offsets": offsets}
+
+def _sweep_pairs(sweep, years, start, stop, keys_matrix=None):
+    #Pairs number start ... stop-1 of the sweep, as (rows, cols) with rows < cols
+    offsets = sweep["offsets"]
+    t = np.arange(start, stop, dtype=np.int64)
+    entry = np.searchsorted(offsets, t, side="right") - 1
+    partner = entry + 1 + (t - offsets[entry])
+    i, j = sweep["artists"][entry], sweep["artists"][partner]
+    keep = years[j, 3] > years[i, 0]
+    if keys_matrix is not None:
+        #A pair sharing several keys is met once per key: keep it only under the first one
+        shared = keys_matrix[i].multiply(keys_matrix[j]).tocsr()
+        shared.sort_indices()
+        keep &= shared.indices[shared.indptr[:-1]] == sweep["groups"][entry]
+    i, j = i[keep], j[keep]
+    return np.minimum(i, j), np.maximum(i, j)
+
+def _keys_matrix(keys):
+    from scipy.sparse import csr_matrix
+    indptr, codes = keys
+    n_keys = int(codes.max()) + 1 if len(codes) else 0
+    return csr_matrix((np.ones(len(codes), dtype=np.int8), codes, indptr), shape=(len(indptr) - 1, n_keys))
+
+def overlapping_pairs(years, chunk_size=1000000, encoded=None):
+    """
+    Generate the pairs of artists whose lifespans overlap (birth1 < death2 and birth2 < death1),
+    as chunks (rows, cols) of index arrays with rows < cols, without building the N x N overlap matrix.
+    years: (N, 4) array of fixed years (birth, first active, last active, death), see fix_years.
+    If encoded artists are given (see encode_artists), only pairs sharing a place, birthplace, citizenship
+    or nationality are generated: exactly the overlapping pairs get_loc_similarity can give a nonzero value.
+    Chunks hold at most chunk_size candidates (fewer after filtering).
+    """
+    years = np.asarray(years, dtype=np.float64)
+    keys = None if encoded is None else shared_keys(encoded)
+    sweep = _pair_sweep(years, keys)
+    keys_matrix = None if keys is None else _keys_matrix(keys)
+    total = sweep["offsets"][-1]
+    for start in range(0, total, chunk_size):
+        yield _sweep_pairs(sweep, years, start, min(start + chunk_size, total), keys_matrix)
+
 
 def get_loc_similarity(places1=None, places2=None, years1=None, years2=None,
                        birthplace1=None, birthplace2=None, nationality1=None,
@@ -102,4 +241,377 @@ def get_loc_similarity(places1=None, places2=None, years1=None, years2=None,
         average_common_years_per_place1 = common_years/(len(places1)) if len(places1) > 0 else 0
         average_common_years_per_place2 = common_years/(len(places2)) if len(places2) > 0 else 0
     
-    return (average_common_years_per_place1 + average_common_years_per_place2)/2 * p
+    similarity = (average_common_years_per_place1 + average_common_years_per_place2)/2 * p
+    if instrument.enabled():
+        instrument.count("pairs_evaluated")
+        instrument.count("pairs_with_edge", similarity > 0)
+    return similarity
+
+
+########## Batched similarity (array-encoded artists)
+def _encode_ragged(lists, vocab):
+    #Offsets + unique codes per artist, with multiplicities (get_loc_similarity counts repeated entries)
+    indptr = np.zeros(len(lists) + 1, dtype=np.int64)
+    codes = []; counts = []; lengths = np.zeros(len(lists), dtype=np.int32)
+    for i, items in enumerate(lists):
+        if items is None or isinstance(items, float):
+            indptr[i + 1] = indptr[i]
+            continue
+        row = {}
+        for item in items:
+            code = vocab.setdefault(item, len(vocab))
+            row[code] = row.get(code, 0) + 1
+        for code in sorted(row):
+            codes.append(code); counts.append(row[code])
+        lengths[i] = len(items)
+        indptr[i + 1] = indptr[i] + len(row)
+    return indptr, np.array(codes, dtype=np.int32), np.array(counts, dtype=np.int32), lengths
+
+def _encode_categorical(values, vocab):
+    codes = np.full(len(values), -1, dtype=np.int32)
+    for i, value in enumerate(values):
+        if value is None or isinstance(value, float):
+            continue
+        codes[i] = vocab.setdefault(value, len(vocab))
+    return codes
+
+@instrument.timed
+def encode_artists(years, places, birthplaces=None, nationalities=None, citizenships=None):
+    """
+    Integer-code artist data for get_loc_similarity_batch.
+
+    All arguments are sequences aligned by artist, holding what get_loc_similarity takes per artist:
+    the four years (birth, first active, last active, death), lists of places and nationalities,
+    birthplace and citizenship strings; missing values are np.nan (or None).
+    Returns a dict of numpy arrays. Multi-valued fields are stored as offsets into a code array
+    ('places_indptr', 'places_codes', 'places_counts', 'places_len'), single-valued ones
+    as codes with -1 for missing ('birthplace', 'citizenship').
+    """
+    n = len(years)
+    encoded = {"years": np.asarray(years, dtype=np.float64).reshape(n, 4)}
+    for field, lists in (("places", places), ("nationalities", nationalities)):
+        vocab = {}
+        lists = [np.nan] * n if lists is None else lists
+        indptr, codes, counts, lengths = _encode_ragged(lists, vocab)
+        encoded[f"{field}_indptr"] = indptr
+        encoded[f"{field}_codes"] = codes
+        encoded[f"{field}_counts"] = counts
+        encoded[f"{field}_len"] = lengths
+        encoded[f"{field}_vocab"] = np.array(list(vocab), dtype=str)
+    for field, values in (("birthplace", birthplaces), ("citizenship", citizenships)):
+        vocab = {}
+        encoded[field] = _encode_categorical([np.nan] * n if values is None else values, vocab)
+        encoded[f"{field}_vocab"] = np.array(list(vocab), dtype=str)
+    return encoded
+
+def incidence_matrix(encoded, field):
+    """Sparse artist x code count matrix of a multi-valued field of encoded artists."""
+    from scipy.sparse import csr_matrix
+    indptr, codes = encoded[f"{field}_indptr"], encoded[f"{field}_codes"]
+    if f"{field}_vocab" in encoded:
+        n_codes = len(encoded[f"{field}_vocab"])
+    else:
+        n_codes = int(codes.max()) + 1 if len(codes) else 0
+    return csr_matrix((encoded[f"{field}_counts"], codes, indptr), shape=(len(indptr) - 1, n_codes))
+
+def _shared_counts(matrix, rows, cols):
+    #Number of matching (item1, item2) combinations for each pair, i.e. the row-wise dot product
+    return np.asarray(matrix[rows].multiply(matrix[cols]).sum(axis=1), dtype=np.float64).ravel()
+
+def _common_years(years1, years2, start, end):
+    #Same count as the year-by-year loops of get_loc_similarity: integers of the interval starting first
+    #(ties go to years1) that fall inside the other interval
+    swap = (years1[:, start] > years2[:, start])[:, None]
+    first = np.where(swap, years2, years1)
+    second = np.where(swap, years1, years2)
+    low = np.maximum(np.trunc(first[:, start]), np.ceil(second[:, start]))
+    high = np.minimum(np.trunc(first[:, end]), np.floor(second[:, end]))
+    return np.maximum(high - low + 1, 0)
+
+########## Similarity components (re-weighting pairs without rebuilding them)
+SIMILARITY_WEIGHTS = {"place": 1, "birthplace": 1, "citizenship": 0.3, "nationality": 0.3} #as in get_loc_similarity
+
+def similarity_components(encoded, rows, cols, places_matrix=None, nationalities_matrix=None):
+    """
+    The terms get_loc_similarity combines, for pairs (rows[k], cols[k]) of encoded artists, as compact columns:
+    common_years, common_active_years, shared_places (matching place combinations), birthplace_match,
+    citizenship_match, nationality_matches and nationality_pairs (matching / all nationality combinations,
+    counted only when both citizenships are known and differ), places_len1, places_len2; and rows, cols.
+    See combine_components.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    if places_matrix is None:
+        places_matrix = incidence_matrix(encoded, "places")
+    if nationalities_matrix is None:
+        nationalities_matrix = incidence_matrix(encoded, "nationalities")
+
+    birthplace1, birthplace2 = encoded["birthplace"][rows], encoded["birthplace"][cols]
+    citizenship1, citizenship2 = encoded["citizenship"][rows], encoded["citizenship"][cols]
+    both_citizenships = (citizenship1 >= 0) & (citizenship2 >= 0)
+    citizenship_match = both_citizenships & (citizenship1 == citizenship2)
+    #Nationality credit only when citizenships are known but differ
+    nationality_matches = np.zeros(len(rows), dtype=np.int32)
+    nationality_pairs = np.zeros(len(rows), dtype=np.int32)
+    nat_pairs = np.flatnonzero(both_citizenships & ~citizenship_match)
+    if len(nat_pairs):
+        nationality_pairs[nat_pairs] = (encoded["nationalities_len"][rows[nat_pairs]].astype(np.int32)
+                                        * encoded["nationalities_len"][cols[nat_pairs]])
+        nationality_matches[nat_pairs] = _shared_counts(nationalities_matrix, rows[nat_pairs], cols[nat_pairs])
+
+    years1, years2 = encoded["years"][rows], encoded["years"][cols]
+    return {"rows": rows, "cols": cols,
+            "common_years": _common_years(years1, years2, 0, 3).astype(np.int16),
+            "common_active_years": _common_years(years1, years2, 1, 2).astype(np.int16),
+            "shared_places": _shared_counts(places_matrix, rows, cols).astype(np.int32),
+            "birthplace_match": (birthplace1 >= 0) & (birthplace1 == birthplace2),
+            "citizenship_match": citizenship_match,
+            "nationality_matches": nationality_matches, "nationality_pairs": nationality_pairs,
+            "places_len1": encoded["places_len"][rows].astype(np.int32),
+            "places_len2": encoded["places_len"][cols].astype(np.int32)}
+
+def combine_components(components, place=1, birthplace=1, citizenship=0.3, nationality=0.3, active_years_only=False):
+    """
+    Similarity of each pair of similarity_components for any coefficients of the shared places, birthplace match,
+    citizenship match and nationality credit, and either year mode; the defaults give get_loc_similarity.
+    """
+    p = place * components["shared_places"].astype(np.float64) + birthplace * components["birthplace_match"]
+    p += citizenship * components["citizenship_match"]
+    pairs = components["nationality_pairs"]
+    p += np.divide(nationality * components["nationality_matches"], pairs, out=np.zeros(len(p)), where=pairs > 0)
+
+    common_years = components["common_active_years" if active_years_only else "common_years"].astype(np.float64)
+    #Formula: average_common_years / places  *  common_places
+    len1, len2 = components["places_len1"], components["places_len2"]
+    per_place1 = np.divide(common_years, len1, out=np.zeros_like(common_years), where=len1 > 0)
+    per_place2 = np.divide(common_years, len2, out=np.zeros_like(common_years), where=len2 > 0)
+    return (per_place1 + per_place2) / 2 * p
+
+def _possible_edges(components):
+    #Pairs with a positive similarity for some non-negative coefficients and year mode
+    shared = (components["shared_places"] > 0) | components["birthplace_match"] | components["citizenship_match"] \
+             | (components["nationality_matches"] > 0)
+    years = (components["common_years"] > 0) | (components["common_active_years"] > 0)
+    return shared & years & ((components["places_len1"] > 0) | (components["places_len2"] > 0))
+
+@instrument.timed
+def reweight_edges(components, active_years_only=False, **weights):
+    """
+    Edge list (rows, cols, weights > 0) of the components kept by build_edges(components=True), weighted by
+    combine_components with the coefficients in weights (SIMILARITY_WEIGHTS keys), without rebuilding anything.
+    """
+    similarity = combine_components(components, **{**SIMILARITY_WEIGHTS, **weights}, active_years_only=active_years_only)
+    edges = similarity > 0
+    return components["rows"][edges], components["cols"][edges], similarity[edges]
+
+@instrument.timed
+def get_loc_similarity_batch(encoded, rows, cols, active_years_only=False,
+                             places_matrix=None, nationalities_matrix=None):
+    """
+    Vectorized get_loc_similarity for a block of pairs (rows[k], cols[k]) of encoded artists
+    (see encode_artists). Returns an array of similarity values, equal to calling
+    get_loc_similarity on each pair (up to floating point summation order).
+    The incidence matrices can be passed to avoid rebuilding them for every block.
+    """
+    components = similarity_components(encoded, rows, cols, places_matrix, nationalities_matrix)
+    return combine_components(components, active_years_only=active_years_only)
+
+
+########## Network construction (sharded over worker processes)
+_WORKER = {}
+
+def _init_build_worker(spec, active_years_only, components=False):
+    arrays, blocks = parallel.attach_arrays(spec)
+    _setup_build(arrays, active_years_only, components)
+    _WORKER["blocks"] = blocks
+
+def _setup_build(arrays, active_years_only, components=False):
+    _WORKER["arrays"] = arrays
+    _WORKER["active_years_only"] = active_years_only
+    _WORKER["components"] = components
+    _WORKER["places_matrix"] = incidence_matrix(arrays, "places")
+    _WORKER["nationalities_matrix"] = incidence_matrix(arrays, "nationalities")
+    _WORKER["keys_matrix"] = _keys_matrix((arrays["keys_indptr"], arrays["keys_codes"])) if "keys_indptr" in arrays else None
+
+def _build_shard(start, stop):
+    arrays = _WORKER["arrays"]
+    sweep = {"artists": arrays["sweep_artists"], "groups": arrays["sweep_groups"], "offsets": arrays["sweep_offsets"]}
+    rows, cols = _sweep_pairs(sweep, arrays["years"], start, stop, _WORKER["keys_matrix"])
+    components = similarity_components(arrays, rows, cols, _WORKER["places_matrix"], _WORKER["nationalities_matrix"])
+    weights = combine_components(components, active_years_only=_WORKER["active_years_only"])
+    edges = weights > 0
+    if _WORKER["components"]:
+        possible = _possible_edges(components)
+        components = {key: value[possible] for key, value in components.items()}
+    else:
+        components = None
+    return rows[edges], cols[edges], weights[edges], len(rows), components
+
+def edge_shards(encoded, active_years_only=False, shared_places=True, n_workers=None, chunk_size=1000000,
+                components=False):
+    """
+    The shards of build_edges as they are computed, in order: (rows, cols, weights > 0, number of pairs evaluated,
+    similarity_components of the possible edges or None). At most two shards per worker are held at a time,
+    so the edges can be written out (see streaming.build_edge_file) in bounded memory.
+    """
+    arrays = {key: value for key, value in encoded.items() if value.dtype.kind != "U"}
+    with instrument.stage("process.build_edges.pair_sweep"):
+        keys = shared_keys(encoded) if shared_places else None
+        if keys is not None:
+            arrays["keys_indptr"], arrays["keys_codes"] = keys
+        sweep = _pair_sweep(encoded["years"], keys)
+    for key, value in sweep.items():
+        arrays[f"sweep_{key}"] = value
+    total = int(sweep["offsets"][-1])
+    starts = list(range(0, total, chunk_size))
+    stops = [min(start + chunk_size, total) for start in starts]
+    instrument.count("pairs_candidates", total)
+
+    n_workers = min(parallel.worker_count(n_workers), max(len(starts), 1))
+    if n_workers == 1:
+        _setup_build(arrays, active_years_only, components)
+        try:
+            for start, stop in zip(starts, stops):
+                shard = _build_shard(start, stop)
+                instrument.count("pairs_evaluated", shard[3])
+                instrument.count("pairs_with_edge", len(shard[0]))
+                yield shard
+        finally:
+            _WORKER.clear()
+    else:
+        blocks, spec = parallel.share_arrays(arrays)
+        try:
+            with ProcessPoolExecutor(n_workers, initializer=_init_build_worker,
+                                     initargs=(spec, active_years_only, components)) as executor:
+                running = deque()
+                for position, (start, stop) in enumerate(zip(starts, stops)):
+                    running.append(executor.submit(_build_shard, start, stop))
+                    while running and (len(running) >= 2 * n_workers or position == len(starts) - 1):
+                        shard = running.popleft().result()
+                        instrument.count("pairs_evaluated", shard[3])
+                        instrument.count("pairs_with_edge", len(shard[0]))
+                        yield shard
+        finally:
+            parallel.release(blocks)
+
+@instrument.timed
+def build_edges(encoded, active_years_only=False, shared_places=True, n_workers=None, chunk_size=1000000,
+                components=False):
+    """
+    Weighted edge list of the painter network: get_loc_similarity for every pair of encoded artists
+    (see encode_artists) with overlapping lifespans, keeping the positive values.
+    The candidate pairs are split into shards of chunk_size, computed in a pool of n_workers processes
+    (all cores by default) reading the artist arrays from shared memory.
+    shared_places: only evaluate pairs sharing a place, birthplace, citizenship or nationality
+    (see overlapping_pairs) - the result is the same, only faster.
+    Returns (rows, cols, weights) sorted by (rows, cols), with rows < cols; identical for any n_workers.
+    components: also return the similarity_components of every pair that has a positive similarity for some
+    coefficients or year mode (sorted the same way), to re-weight the network with reweight_edges.
+    """
+    with instrument.stage("process.build_edges.shards"):
+        shards = list(edge_shards(encoded, active_years_only, shared_places, n_workers, chunk_size, components))
+
+    if not shards:
+        rows, cols, weights = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        if components:
+            return rows, cols, weights, similarity_components(encoded, rows, cols)
+        return rows, cols, weights
+    rows = np.concatenate([shard[0] for shard in shards])
+    cols = np.concatenate([shard[1] for shard in shards])
+    weights = np.concatenate([shard[2] for shard in shards])
+    order = np.lexsort((cols, rows))
+    if not components:
+        return rows[order], cols[order], weights[order]
+    pairs = {key: np.concatenate([shard[4][key] for shard in shards]) for key in shards[0][4]}
+    pair_order = np.lexsort((pairs["cols"], pairs["rows"]))
+    return rows[order], cols[order], weights[order], {key: value[pair_order] for key, value in pairs.items()}
+
+@instrument.timed
+def edges_to_graph(names, rows, cols, weights, node_attributes=None):
+    """networkx graph of an edge list over artists names; node_attributes: optional dict name -> attribute dict"""
+    G = nx.Graph()
+    for name in names:
+        if node_attributes is None:
+            G.add_node(name, name=name)
+        else:
+            G.add_node(name, name=name, **node_attributes[name])
+    names = np.asarray(names, dtype=object)
+    G.add_weighted_edges_from(zip(names[rows], names[cols], np.asarray(weights).tolist()))
+    return G
+
+
+########## Incremental updates (artists added or edited)
+def _changed_pairs(encoded, changed, shared_places=True):
+    #Candidate pairs (changed artist, any artist) with overlapping lifespans
+    years = encoded["years"]
+    n = len(years)
+    if shared_places:
+        keys_matrix = _keys_matrix(shared_keys(encoded))
+        candidates = (keys_matrix[changed] @ keys_matrix.T).tocoo()
+        rows, cols = changed[candidates.row], candidates.col.astype(np.int64)
+    else:
+        rows, cols = np.repeat(changed, n), np.tile(np.arange(n), len(changed))
+    keep = (years[cols, 0] < years[rows, 3]) & (years[cols, 3] > years[rows, 0]) & (rows != cols)
+    rows, cols = rows[keep], cols[keep]
+    #Pairs of two changed artists are met from both sides
+    changed_mask = np.zeros(n, dtype=bool); changed_mask[changed] = True
+    keep = ~changed_mask[cols] | (rows < cols)
+    rows, cols = rows[keep], cols[keep]
+    return np.minimum(rows, cols), np.maximum(rows, cols)
+
+@instrument.timed
+def update_edges(encoded, rows, cols, weights, changed, active_years_only=False, shared_places=True):
+    """
+    Update an edge list of build_edges after some artists changed, recomputing only the edges touching them.
+    encoded: the new encoded artists, where unchanged artists keep their index and new artists are appended.
+    changed: indices of the edited and added artists (removing an artist = editing it to have no places).
+    Returns (rows, cols, weights, source) sorted like build_edges; source[e] is the index of edge e
+    in the old edge list, or -1 for a recomputed edge.
+    """
+    changed = np.unique(np.asarray(changed, dtype=np.int64))
+    changed_mask = np.zeros(len(encoded["years"]), dtype=bool); changed_mask[changed] = True
+    kept = np.flatnonzero(~(changed_mask[rows] | changed_mask[cols]))
+
+    new_rows, new_cols = _changed_pairs(encoded, changed, shared_places)
+    new_weights = get_loc_similarity_batch(encoded, new_rows, new_cols, active_years_only)
+    edges = new_weights > 0
+
+    rows = np.concatenate((rows[kept], new_rows[edges]))
+    cols = np.concatenate((cols[kept], new_cols[edges]))
+    weights = np.concatenate((weights[kept], new_weights[edges]))
+    source = np.concatenate((kept, np.full(edges.sum(), -1)))
+    order = np.lexsort((cols, rows))
+    return rows[order], cols[order], weights[order], source[order]
+
+@instrument.timed
+def build_network(encoded, alpha=None, threshold=None, active_years_only=False, shared_places=True, n_workers=None):
+    """
+    Build artifacts of the network: the edge list of build_edges, node strengths and degrees,
+    disparity filter probabilities (see measures.disparity_filter_arrays), and the backbone mask
+    of the edges kept at the disparity filter alpha and/or the weight threshold.
+    """
+    rows, cols, weights = build_edges(encoded, active_years_only, shared_places, n_workers)
+    probas, strength, degree = measures.disparity_filter_arrays(rows, cols, weights, len(encoded["years"]))
+    build = {"rows": rows, "cols": cols, "weights": weights, "probas": probas, "strength": strength, "degree": degree}
+    build["backbone"] = _backbone_mask(build, alpha, threshold)
+    return build
+
+@instrument.timed
+def update_network(build, encoded, changed, alpha=None, threshold=None, active_years_only=False, shared_places=True):
+    """Incremental build_network: patch the artifacts of a previous build after the changed artists (see update_edges)"""
+    rows, cols, weights, source = update_edges(encoded, build["rows"], build["cols"], build["weights"], changed,
+                                               active_years_only, shared_places)
+    probas, strength, degree = measures.update_disparity_filter(build["rows"], build["cols"], rows, cols, weights, source,
+                                                                build["probas"], build["strength"], build["degree"],
+                                                                n_nodes=len(encoded["years"]))
+    new_build = {"rows": rows, "cols": cols, "weights": weights, "probas": probas, "strength": strength, "degree": degree}
+    new_build["backbone"] = _backbone_mask(new_build, alpha, threshold)
+    return new_build
+
+def _backbone_mask(build, alpha, threshold):
+    mask = np.ones(len(build["weights"]), dtype=bool)
+    if alpha is not None:
+        mask &= measures.disparity_backbone(build["probas"], alpha)
+    if threshold is not None:
+        mask &= build["weights"] >= threshold
+    return mask
@@ -0,0 +1,184 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from data_processing import parallel
+from data_processing import paths
+from data_processing.csr import CSRGraph
+
+########## Temporal snapshots (time windows over the artists' years)
+YEAR_ATTRIBUTES = ["birth_year", "FirstYear", "LastYear", "death_year"]
+
+def node_years(G):
+    """(N, 4) birth, first active, last active and death years of the nodes (graph attributes, in node order)"""
+    if isinstance(G, CSRGraph):
+        attributes = G.node_attributes or [{} for _ in G.names]
+    else:
+        attributes = [data for _, data in G.nodes(data=True)]
+    return np.array([[float(data.get(key, np.nan)) if data.get(key, "") != "" else np.nan for key in YEAR_ATTRIBUTES]
+                     for data in attributes], dtype=np.float64).reshape(-1, 4)
+
+def sliding_windows(start, stop, width, step=None):
+    """(W, 2) array of windows [start, start + width] moving by step (width by default) until stop"""
+    step = width if step is None else step
+    starts = np.arange(start, stop, step, dtype=np.float64)
+    return np.column_stack((starts, starts + width))
+
+def _intervals(years, mode, min_lifespan=0):
+    #Interval of each artist in a mode: lifespan (birth - death), active years, or the birth year only.
+    #Artists with missing years or a shorter lifespan than min_lifespan never fall in a window
+    years = np.asarray(years, dtype=np.float64)
+    if mode == "lifespan":
+        low, high = years[:, 0].copy(), years[:, 3].copy()
+    elif mode == "active":
+        low, high = years[:, 1].copy(), years[:, 2].copy()
+    elif mode == "birth":
+        low, high = years[:, 0].copy(), years[:, 0].copy()
+    else:
+        raise ValueError(f"Unknown mode: {mode}")
+    excluded = np.isnan(low) | np.isnan(high)
+    if min_lifespan:
+        excluded |= ~(years[:, 3] - years[:, 0] >= min_lifespan)
+    low[excluded] = np.inf; high[excluded] = -np.inf
+    return low, high
+
+def window_members(years, start, end, mode="lifespan", min_lifespan=0):
+    """Node ids in the window [start, end]: artists whose interval (see snapshot_statistics) meets it"""
+    low, high = _intervals(years, mode, min_lifespan)
+    return np.flatnonzero((low <= end) & (high >= start))
+
+def snapshot(G, years, start, end, mode="lifespan", min_lifespan=0, largest_component=False):
+    """
+    Subgraph (CSRGraph) of the artists in the window [start, end] (the window_members of snapshot_statistics,
+    lifespans meeting it by default); e.g. the artists born 1820-1920 who lived
+    at least 30 years: snapshot(G, years, 1820, 1920, "birth", 30). Only the window's nodes are copied.
+    """
+    G = G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+    subgraph = G.subgraph(window_members(years, start, end, mode, min_lifespan))
+    return paths.largest_component(subgraph) if largest_component else subgraph
+
+class _WindowSweep:
+    #Active artists and their degrees within the window, updated incrementally as artists enter and leave
+    def __init__(self, indptr, indices, low, high):
+        self.indptr, self.indices, self.low, self.high = indptr, indices, low, high
+        self.by_low = np.argsort(low, kind="stable"); self.sorted_low = low[self.by_low]
+        self.by_high = np.argsort(high, kind="stable"); self.sorted_high = high[self.by_high]
+        self.reset()
+
+    def reset(self):
+        n = len(self.low)
+        self.active = np.zeros(n, dtype=bool)
+        self.degrees = np.zeros(n, dtype=np.int64)
+        self.entered = 0; self.left = 0; self.start = -np.inf; self.end = -np.inf
+
+    def _neighbours(self, nodes):
+        lengths = self.indptr[nodes + 1] - self.indptr[nodes]
+        starts = np.repeat(self.indptr[nodes] - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        return np.repeat(nodes, lengths), self.indices[starts + np.arange(lengths.sum())]
+
+    def _add(self, nodes):
+        self.active[nodes] = True
+        sources, targets = self._neighbours(nodes)
+        inside = self.active[targets]
+        np.add.at(self.degrees, sources[inside], 1)
+        #Edges to artists already in the window (edges among the new ones are counted from both sides already)
+        new = np.zeros(len(self.active), dtype=bool); new[nodes] = True
+        outer = inside & ~new[targets]
+        np.add.at(self.degrees, targets[outer], 1)
+
+    def _remove(self, nodes):
+        sources, targets = self._neighbours(nodes)
+        leaving = np.zeros(len(self.active), dtype=bool); leaving[nodes] = True
+        staying = self.active[targets] & ~leaving[targets]
+        np.add.at(self.degrees, targets[staying], -1)
+        self.active[nodes] = False
+        self.degrees[nodes] = 0
+
+    def move(self, start, end):
+        if start < self.start or end < self.end:
+            self.reset()
+        entered = np.searchsorted(self.sorted_low, end, side="right")
+        left = np.searchsorted(self.sorted_high, start, side="left")
+        leaving = self.by_high[self.left:left]
+        self._remove(leaving[self.active[leaving]])
+        entering = self.by_low[self.entered:entered]
+        self._add(entering[self.high[entering] >= start])
+        self.entered, self.left, self.start, self.end = entered, left, start, end
+        return np.flatnonzero(self.active)
+
+def _closeness(adjacency, batch_size=64):
+    #networkx closeness (wf_improved): reachable / distance sum * reachable / (n - 1), from BFS batches of
+    #batch_size sources as in paths.path_statistics (one dense batch_size x n distance block at a time)
+    n = adjacency.shape[0]
+    sums = np.zeros(n, dtype=np.int64); counts = np.zeros(n, dtype=np.int64)
+    for i in range(0, n, batch_size):
+        sources = np.arange(i, min(i + batch_size, n))
+        _, _, sums[sources], counts[sources] = paths._source_statistics(adjacency, sources)
+    return np.divide(counts, sums, out=np.zeros(n), where=sums > 0) * counts / max(n - 1, 1)
+
+def _window_statistics(adjacency, sweep, windows, closeness):
+    from scipy.sparse.csgraph import connected_components
+    rows = []
+    for start, end in windows:
+        members = sweep.move(start, end)
+        degrees = sweep.degrees[members]
+        statistics = {"start": start, "end": end, "nodes": len(members), "edges": int(degrees.sum()) // 2,
+                      "mean_degree": degrees.mean() if len(members) else np.nan,
+                      "max_degree": int(degrees.max(initial=0))}
+        sub = adjacency[members][:, members]
+        n_components, labels = connected_components(sub, directed=False) if len(members) else (0, np.zeros(0, dtype=int))
+        sizes = np.bincount(labels)
+        statistics["components"] = n_components
+        statistics["largest_component"] = int(sizes.max(initial=0))
+        triangles = np.asarray((sub @ sub).multiply(sub).sum(axis=1)).ravel() / 2
+        pairs = degrees * (degrees - 1) / 2
+        statistics["clustering"] = np.divide(triangles, pairs, out=np.zeros(len(pairs)), where=pairs > 0).mean() if len(members) else np.nan
+        if closeness:
+            values = _closeness(sub)
+            statistics["closeness"] = values.mean() if len(members) else np.nan
+            statistics["max_closeness"] = values.max(initial=0)
+        rows.append(statistics)
+    return rows
+
+_WORKER = {}
+
+def _init_worker(spec, closeness):
+    arrays, blocks = parallel.attach_arrays(spec)
+    _WORKER.update(arrays=arrays, blocks=blocks, closeness=closeness)
+
+def _worker_windows(windows):
+    arrays = _WORKER["arrays"]
+    return _run_windows(arrays["indptr"], arrays["indices"], arrays["low"], arrays["high"], windows, _WORKER["closeness"])
+
+def _run_windows(indptr, indices, low, high, windows, closeness):
+    from scipy.sparse import csr_matrix
+    n = len(indptr) - 1
+    adjacency = csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr), shape=(n, n))
+    return _window_statistics(adjacency, _WindowSweep(indptr, indices, low, high), windows, closeness)
+
+def snapshot_statistics(G, years, windows, mode="lifespan", min_lifespan=0, closeness=False, n_workers=None):
+    """
+    Statistics of the snapshots of G (networkx or CSRGraph) in a sequence of time windows [start, end]
+    (see sliding_windows), with years the (N, 4) years of the nodes in node order (see node_years).
+    An artist is in a window if its lifespan ("lifespan"), active years ("active") or birth year ("birth") meets it,
+    and it lived at least min_lifespan years.
+    Windows are swept in order with the artists entering and leaving tracked incrementally (degrees are updated,
+    not recomputed); consecutive runs of windows are handled by n_workers processes in parallel.
+    Returns a DataFrame with one row per window: nodes, edges, mean and max degree, components,
+    largest component size, average clustering and, if closeness, the mean and max closeness centrality.
+    """
+    G = G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+    low, high = _intervals(years, mode, min_lifespan)
+    windows = [tuple(window) for window in np.asarray(windows, dtype=np.float64)]
+    n_workers = min(parallel.worker_count(n_workers), max(len(windows), 1))
+    if n_workers == 1:
+        rows = _run_windows(G.indptr, G.indices, low, high, windows, closeness)
+    else:
+        runs = [[windows[i] for i in run] for run in np.array_split(np.arange(len(windows)), n_workers)]
+        blocks, spec = parallel.share_arrays({"indptr": G.indptr, "indices": G.indices, "low": low, "high": high})
+        try:
+            with ProcessPoolExecutor(n_workers, initializer=_init_worker, initargs=(spec, closeness)) as executor:
+                rows = [row for run in executor.map(_worker_windows, runs) for row in run]
+        finally:
+            parallel.release(blocks)
+    return pd.DataFrame(rows)
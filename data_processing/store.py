@@ -0,0 +1,146 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+########## Columnar artist store (parsed once from data/artists.csv, memory-mappable)
+NUMERIC_COLUMNS = ["birth_year", "FirstYear", "LastYear", "death_year", "wikiart_pictures_count"]
+CATEGORICAL_COLUMNS = ["Nationality", "citizenship", "gender", "styles", "movement", "birth_place", "death_place"]
+LIST_COLUMNS = {"locations": False, "Nationality": False, "styles": True} #column -> strip items (split on ",")
+YEAR_COLUMNS = ["birth_year", "FirstYear", "LastYear", "death_year"]
+
+def save_arrays(path, arrays, meta=None):
+    """Save a dict of numpy arrays as a directory of .npy files (plus meta.json), loadable with load_arrays"""
+    os.makedirs(path, exist_ok=True)
+    for key, array in arrays.items():
+        np.save(os.path.join(path, f"{key}.npy"), np.asarray(array), allow_pickle=False)
+    with open(os.path.join(path, "meta.json"), "w") as file:
+        json.dump({"keys": list(arrays), **(meta or {})}, file)
+
+def load_arrays(path, keys=None, mmap_mode="r"):
+    """Load arrays saved by save_arrays, memory-mapped by default (nothing is read until used). Returns (arrays, meta)."""
+    with open(os.path.join(path, "meta.json")) as file:
+        meta = json.load(file)
+    keys = meta["keys"] if keys is None else keys
+    arrays = {key: np.load(os.path.join(path, f"{key}.npy"), mmap_mode=mmap_mode, allow_pickle=False) for key in keys}
+    return arrays, meta
+
+def _categorical(series):
+    codes, vocab = pd.factorize(series, sort=True)
+    return codes.astype(np.int32), np.asarray(vocab, dtype=str)
+
+def _ragged(series, strip):
+    items = series.str.split(",")
+    lengths = items.str.len().fillna(0).to_numpy(dtype=np.int64)
+    flat = items.explode().dropna()
+    if strip:
+        flat = flat.str.strip()
+    codes, vocab = _categorical(flat)
+    indptr = np.zeros(len(series) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(lengths)
+    return indptr, codes, vocab
+
+def build_artist_store(artists):
+    """
+    Parse the artist table (DataFrame of data/artists.csv) into typed columns:
+    'artist' names, float64 NUMERIC_COLUMNS, integer-coded CATEGORICAL_COLUMNS (f"{column}_codes", -1 for missing,
+    and f"{column}_vocab"), and LIST_COLUMNS split on "," as offset-encoded ragged arrays
+    (f"{column}_list_indptr", f"{column}_list_codes", f"{column}_list_vocab").
+    """
+    store = {"artist": artists["artist"].to_numpy(dtype=str)}
+    for column in NUMERIC_COLUMNS:
+        store[column] = artists[column].to_numpy(dtype=np.float64)
+    for column in CATEGORICAL_COLUMNS:
+        store[f"{column}_codes"], store[f"{column}_vocab"] = _categorical(artists[column])
+    for column, strip in LIST_COLUMNS.items():
+        indptr, codes, vocab = _ragged(artists[column].reset_index(drop=True), strip)
+        store[f"{column}_list_indptr"], store[f"{column}_list_codes"], store[f"{column}_list_vocab"] = indptr, codes, vocab
+    return store
+
+def load_artist_store(csv_path="data/artists.csv", cache_dir="data/cache/artists", rebuild=False):
+    """
+    Artist store of the csv file, parsed on the first call and cached (keyed by the file contents) in cache_dir;
+    later calls memory-map the cached arrays.
+    """
+    with open(csv_path, "rb") as file:
+        digest = hashlib.sha1(file.read()).hexdigest()[:16]
+    path = os.path.join(cache_dir, digest)
+    if rebuild or not os.path.exists(os.path.join(path, "meta.json")):
+        save_arrays(path, build_artist_store(pd.read_csv(csv_path)), meta={"source": csv_path, "sha1": digest})
+    return load_arrays(path)[0]
+
+def artist_index(store):
+    """Artist name -> row"""
+    return {name: i for i, name in enumerate(store["artist"].tolist())}
+
+def year_matrix(store, rows=None):
+    """(N, 4) array of birth, first active, last active and death years, as fix_years expects them"""
+    years = np.column_stack([store[column] for column in YEAR_COLUMNS])
+    return years if rows is None else years[rows]
+
+def decode(store, column, rows=None):
+    """Values of a categorical column (object array, np.nan for missing)"""
+    codes = store[f"{column}_codes"] if rows is None else store[f"{column}_codes"][rows]
+    values = np.full(len(codes), np.nan, dtype=object)
+    known = codes >= 0
+    values[known] = np.asarray(store[f"{column}_vocab"], dtype=object)[codes[known]]
+    return values
+
+def ragged_rows(store, column, rows=None):
+    """(row ids, codes) of the items of a list column, for the given rows (all by default), row ids numbered from 0"""
+    indptr, codes = store[f"{column}_list_indptr"], store[f"{column}_list_codes"]
+    if rows is None:
+        rows = np.arange(len(indptr) - 1)
+    rows = np.asarray(rows)
+    lengths = indptr[rows + 1] - indptr[rows]
+    row_ids = np.repeat(np.arange(len(rows)), lengths)
+    starts = np.repeat(indptr[rows] - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+    return row_ids, codes[starts + np.arange(len(row_ids))]
+
+def ragged_value_counts(store, column, rows=None, normalize=True):
+    """value_counts of the items of a list column (e.g. how often each location appears)"""
+    _, codes = ragged_rows(store, column, rows)
+    counts = pd.Series(np.bincount(codes, minlength=len(store[f"{column}_list_vocab"])),
+                       index=np.asarray(store[f"{column}_list_vocab"]))
+    counts = counts[counts > 0].sort_values(ascending=False, kind="stable")
+    return counts / counts.sum() if normalize else counts
+
+def to_frame(store, rows=None):
+    """DataFrame of the numeric and categorical columns, for the measures functions (e.g. describe_measures)"""
+    data = {"artist": store["artist"] if rows is None else store["artist"][rows]}
+    for column in NUMERIC_COLUMNS:
+        data[column] = store[column] if rows is None else store[column][rows]
+    for column in CATEGORICAL_COLUMNS:
+        data[column] = decode(store, column, rows)
+    return pd.DataFrame(data)
+
+def _ragged_encoding(store, column, rows, n):
+    #Unique codes per row with multiplicities, the format of process.encode_artists
+    row_ids, codes = ragged_rows(store, column, rows)
+    vocab_size = max(len(store[f"{column}_list_vocab"]), 1)
+    keys, counts = np.unique(row_ids * vocab_size + codes.astype(np.int64), return_counts=True)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(keys // vocab_size, minlength=n))
+    return indptr, (keys % vocab_size).astype(np.int32), counts.astype(np.int32), np.bincount(row_ids, minlength=n).astype(np.int32)
+
+def to_encoded(store, rows=None, years=None):
+    """
+    Encoded artists for process.get_loc_similarity_batch / process.build_edges, straight from the store columns
+    (places split from 'locations', nationalities from 'Nationality', as in the notebook).
+    years: fixed (N, 4) years of the rows (see process.fix_years), the raw ones by default.
+    """
+    if rows is None:
+        rows = np.arange(len(store["artist"]))
+    rows = np.asarray(rows)
+    n = len(rows)
+    encoded = {"years": np.asarray(year_matrix(store, rows) if years is None else years, dtype=np.float64)}
+    for field, column in (("places", "locations"), ("nationalities", "Nationality")):
+        indptr, codes, counts, lengths = _ragged_encoding(store, column, rows, n)
+        encoded[f"{field}_indptr"], encoded[f"{field}_codes"] = indptr, codes
+        encoded[f"{field}_counts"], encoded[f"{field}_len"] = counts, lengths
+        encoded[f"{field}_vocab"] = np.asarray(store[f"{column}_list_vocab"])
+    for field, column in (("birthplace", "birth_place"), ("citizenship", "citizenship")):
+        encoded[field] = np.asarray(store[f"{column}_codes"][rows], dtype=np.int32)
+        encoded[f"{field}_vocab"] = np.asarray(store[f"{column}_vocab"])
+    return encoded
@@ -0,0 +1,171 @@
+import os
+import json
+import numpy as np
+
+from data_processing import process
+from data_processing import measures
+from data_processing import instrument
+from data_processing import store
+from data_processing.csr import CSRGraph
+
+########## Out-of-core edge files (network construction and filtering in bounded memory)
+#An edge file is a directory of raw little-endian columns rows.bin, cols.bin (int32) and weights.bin (float64, or
+#float32 to halve it), appended chunk by chunk, plus meta.json, written last: a file without it is incomplete.
+#Node attributes are kept apart (the artist store rows in nodes/).
+#    build_edge_file(encoded, "data/cache/edges", names=..., rows=...)
+#    rows, cols, weights = disparity_edges("data/cache/edges", alpha=0.1) #only the backbone is in memory
+#    G = edge_file_graph("data/cache/edges", rows, cols, weights, artist_store)
+COLUMNS = {"rows": np.int32, "cols": np.int32, "weights": np.float64}
+
+class EdgeWriter:
+    """
+    Append edges to an edge file in chunks of chunk_size (at most one chunk is buffered): with EdgeWriter(path) as w: w.append(...)
+    If the block raises, meta.json is not written, so the partial file cannot be opened.
+    """
+    def __init__(self, path, n_nodes=None, chunk_size=1000000, meta=None, weight_dtype=np.float64):
+        self.path = path
+        self.n_nodes = n_nodes
+        self.chunk_size = chunk_size
+        self.meta = meta or {}
+        self.n_edges = 0
+        self.buffered = []
+        self.dtypes = {**COLUMNS, "weights": weight_dtype}
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, "meta.json")):
+            os.remove(os.path.join(path, "meta.json")) #an edge file being overwritten is incomplete until closed
+        self.files = {column: open(os.path.join(path, f"{column}.bin"), "wb") for column in COLUMNS}
+
+    def append(self, rows, cols, weights):
+        self.buffered.append((np.asarray(rows), np.asarray(cols), np.asarray(weights)))
+        if sum(len(chunk[0]) for chunk in self.buffered) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffered:
+            return
+        for position, (column, dtype) in enumerate(self.dtypes.items()):
+            values = np.concatenate([chunk[position] for chunk in self.buffered])
+            values.astype(np.dtype(dtype).newbyteorder("<")).tofile(self.files[column])
+        self.n_edges += sum(len(chunk[0]) for chunk in self.buffered)
+        self.buffered = []
+
+    def _close_files(self):
+        for file in self.files.values():
+            file.close()
+
+    def close(self):
+        self.flush()
+        self._close_files()
+        with open(os.path.join(self.path, "meta.json"), "w") as file:
+            json.dump({**self.meta, "n_edges": self.n_edges, "n_nodes": self.n_nodes,
+                       "dtypes": {column: np.dtype(dtype).str for column, dtype in self.dtypes.items()}}, file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self._close_files()
+        else:
+            self.close()
+        return False
+
+def open_edges(path):
+    """Memory-mapped (rows, cols, weights) of an edge file and its meta dict (nothing is read until used)"""
+    with open(os.path.join(path, "meta.json")) as file:
+        meta = json.load(file)
+    arrays = [np.memmap(os.path.join(path, f"{column}.bin"), dtype=meta["dtypes"][column], mode="r", shape=(meta["n_edges"],))
+              if meta["n_edges"] else np.zeros(0, dtype=meta["dtypes"][column]) for column in COLUMNS]
+    return (*arrays, meta)
+
+def iter_edges(path, chunk_size=1000000):
+    """(offset, rows, cols, weights) chunks of an edge file, as int64 / float64 arrays"""
+    rows, cols, weights, meta = open_edges(path)
+    for start in range(0, meta["n_edges"], chunk_size):
+        stop = min(start + chunk_size, meta["n_edges"])
+        yield start, rows[start:stop].astype(np.int64), cols[start:stop].astype(np.int64), weights[start:stop].astype(np.float64)
+
+@instrument.timed
+def build_edge_file(encoded, path, active_years_only=False, shared_places=True, n_workers=None, chunk_size=1000000,
+                    names=None, rows=None, weight_dtype=np.float64):
+    """
+    process.build_edges streamed to an edge file in path: the shards are written as they are computed, so memory
+    is bounded by the artist arrays and a few shards whatever the number of edges.
+    Edges are in shard order (the same for any n_workers), not sorted. names / rows: artist names and artist store
+    rows of the encoded artists, saved as the node table (path/nodes) that edge_file_graph takes attributes from.
+    weight_dtype=np.float32 halves the weight column, but the weights are then rounded: many weights are round numbers
+    up to float64 error (e.g. 0.9999999999 for 1), so threshold_edges at such cutoffs differs from measures.threshold_filter.
+    Returns the meta dict of the file.
+    """
+    n_nodes = len(encoded["years"])
+    node_table = {"id": np.arange(n_nodes, dtype=np.int32)}
+    if names is not None:
+        node_table["names"] = np.asarray(names, dtype=str)
+    if rows is not None:
+        node_table["rows"] = np.asarray(rows, dtype=np.int64)
+    store.save_arrays(os.path.join(path, "nodes"), node_table)
+    meta = {"active_years_only": active_years_only, "pairs_evaluated": 0}
+    with EdgeWriter(path, n_nodes, chunk_size, meta, weight_dtype) as writer:
+        for shard in process.edge_shards(encoded, active_years_only, shared_places, n_workers, chunk_size):
+            writer.append(*shard[:3])
+            writer.meta["pairs_evaluated"] += shard[3]
+    return open_edges(path)[3]
+
+def node_strengths(path, chunk_size=1000000):
+    """(strength, degree) of every node of an edge file, accumulated chunk by chunk (float64 sums)"""
+    meta = open_edges(path)[3]
+    strength = np.zeros(meta["n_nodes"]); degree = np.zeros(meta["n_nodes"], dtype=np.int64)
+    for _, rows, cols, weights in iter_edges(path, chunk_size):
+        strength += np.bincount(rows, weights, minlength=meta["n_nodes"]) + np.bincount(cols, weights, minlength=meta["n_nodes"])
+        degree += np.bincount(rows, minlength=meta["n_nodes"]) + np.bincount(cols, minlength=meta["n_nodes"])
+    return strength, degree
+
+def _kept_edges(path, keep, chunk_size):
+    #Edges of an edge file for which keep(offset, rows, cols, weights) is True, concatenated in memory
+    kept = [[], [], []]
+    for offset, rows, cols, weights in iter_edges(path, chunk_size):
+        mask = keep(offset, rows, cols, weights)
+        for values, chunk in zip(kept, (rows, cols, weights)):
+            values.append(chunk[mask])
+    if not kept[0]:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    return tuple(np.concatenate(values) for values in kept)
+
+@instrument.timed
+def threshold_edges(path, threshold, chunk_size=1000000):
+    """
+    Edges of an edge file with weight >= threshold, read chunk by chunk: the edges measures.threshold_filter keeps
+    for a float64 edge file (with float32 weights, the comparison is of the rounded weights)
+    """
+    return _kept_edges(path, lambda offset, rows, cols, weights: weights >= threshold, chunk_size)
+
+@instrument.timed
+def disparity_edges(path, alpha, chunk_size=1000000):
+    """
+    Disparity filter backbone of an edge file (measures.disparity_filter_arrays, significant from either endpoint at alpha),
+    in two passes over the file: node strengths and degrees, then the p_ij of each chunk.
+    """
+    strength, degree = node_strengths(path, chunk_size)
+    def keep(offset, rows, cols, weights):
+        p = np.minimum(measures._endpoint_probas(weights, strength[rows], degree[rows]),
+                       measures._endpoint_probas(weights, strength[cols], degree[cols]))
+        return p < alpha
+    return _kept_edges(path, keep, chunk_size)
+
+def edge_file_graph(path, rows, cols, weights, artist_store=None, columns=None):
+    """
+    CSRGraph of filtered edges of an edge file (e.g. threshold_edges / disparity_edges) on the nodes they touch,
+    named from the node table; with artist_store, the store columns (store.to_frame, or only columns) of those artists
+    as node attributes.
+    """
+    nodes = np.unique(np.concatenate((rows, cols)))
+    node_table, _ = store.load_arrays(os.path.join(path, "nodes"))
+    names = np.asarray(node_table["names"])[nodes].tolist() if "names" in node_table else nodes.tolist()
+    attributes = None
+    if artist_store is not None:
+        frame = store.to_frame(artist_store, np.asarray(node_table["rows"])[nodes])
+        if columns is not None:
+            frame = frame[columns]
+        attributes = frame.to_dict("records")
+    return CSRGraph.from_edges(len(nodes), np.searchsorted(nodes, rows), np.searchsorted(nodes, cols),
+                               np.asarray(weights, dtype=np.float64), names, node_attributes=attributes)